@@ -6,122 +6,292 @@ import numpy as np
 import CCDLUtil.Utility.AssertVal as AV
 
 
-class MovingWindowBuffer(object):
+class WindowLease(object):
+    """
+    A zero-copy window handed out by RingWindowBuffer.lease_window.
+
+    data is a read only view into the ring buffer.  It stays correct only until enough new samples have been added to
+    the ring to overwrite it, so check is_valid() after using data (and copy anything that must be kept longer).
+    """
+
+    def __init__(self, ring, data, samples_written):
+        self.ring = ring
+        self.data = data
+        self.samples_written = samples_written
+        self.released = False
+
+    def is_valid(self):
+        """
+        Returns True if no sample of data has been overwritten yet.
+        """
+        return self.ring.samples_written - self.samples_written <= self.ring.capacity - len(self.data)
+
+    def release(self):
+        """
+        Tells the ring this window is no longer used (only needed when the ring runs assertions).
+        """
+        self.released = True
+        if self in self.ring.leases:
+            self.ring.leases.remove(self)
+
+
+class RingWindowBuffer(object):
+
+    def __init__(self, window_size, num_channels, capacity=None, dtype=np.float64, run_assertions=False):
+        """
+        A preallocated ring of the most recent samples of shape (sample, channel), that samples are added to in blocks.
+
+        The ring is mirrored: every sample is stored twice, capacity samples apart, so the most recent window_size samples
+        are always contiguous in memory and can be handed out as a view without reordering.
+
+        Windows can be taken with get_window (a copy, always safe to keep) or lease_window (a zero-copy view, that is only
+        valid until it is overwritten - see WindowLease).
+
+        :param window_size: Number of samples in each window.
+        :param num_channels: Number of channels of each sample.
+        :param capacity: Number of samples kept. Must be at least window_size. A leased window stays valid for
+                         capacity - window_size new samples.  If None, 4 * window_size.  Defaults to None
+        :param dtype: dtype of the stored samples. Defaults to np.float64
+        :param run_assertions: If True, checks the shape of every block and raises an error (rather than silently
+                               handing out corrupted data) if a block would overwrite a window that is leased and not
+                               yet released. Defaults to False
+        """
+        capacity = 4 * window_size if capacity is None else capacity
+        if capacity < window_size:
+            raise ValueError('capacity (%d) must be at least window_size (%d)' % (capacity, window_size))
+        self.window_size, self.num_channels, self.capacity = window_size, num_channels, capacity
+        self.run_assertions = run_assertions
+        self.storage = np.zeros((2 * capacity, num_channels), dtype=dtype)
+        self.leases = []
+        self.reset()
 
-    # todo -- this fails if data passed > 2d samples passed at a time.
-    # todo -- test this method.
+    def reset(self):
+        """
+        Removes all samples from the ring.
+        """
+        # The next sample is written to storage[write_index] and storage[write_index + capacity].
+        self.write_index = 0
+        self.samples_written = 0
+        self.leases = []
+
+    def get_num_samples(self):
+        """
+        Returns the number of samples in the ring (at most capacity).
+        """
+        return min(self.samples_written, self.capacity)
+
+    def is_full_window(self):
+        """
+        Returns True once window_size samples have been added.
+        """
+        return self.samples_written >= self.window_size
+
+    def add_samples(self, data):
+        """
+        Adds a block of samples to the ring.
+
+        :param data: np array (or list) of shape (sample, channel), or a single sample of shape (channel,).
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data.reshape((1, -1))
+        if self.run_assertions:
+            AV.assert_equal(data.ndim, 2)
+            AV.assert_equal(data.shape[1], self.num_channels)
+            self._assert_leases_not_overwritten(len(data))
+        if len(data) > self.capacity:
+            # Only the last capacity samples would be kept anyway.
+            self.samples_written += len(data) - self.capacity
+            data = data[-self.capacity:]
+        num_samples = len(data)
+        first = min(num_samples, self.capacity - self.write_index)
+        rest = num_samples - first
+        for offset in (0, self.capacity):
+            self.storage[offset + self.write_index:offset + self.write_index + first] = data[:first]
+            self.storage[offset:offset + rest] = data[first:]
+        self.write_index = (self.write_index + num_samples) % self.capacity
+        self.samples_written += num_samples
+
+    def _assert_leases_not_overwritten(self, num_new_samples):
+        for lease in self.leases:
+            if self.samples_written + num_new_samples - lease.samples_written > self.capacity - len(lease.data):
+                raise AssertionError('Error: adding %d samples would overwrite a leased window that has not been released!' % num_new_samples)
+
+    def _window_view(self, window_size):
+        if window_size > self.get_num_samples():
+            raise ValueError('Only %d samples are available, %d requested' % (self.get_num_samples(), window_size))
+        end = self.write_index + self.capacity
+        return self.storage[end - window_size:end]
+
+    def get_window(self, window_size=None):
+        """
+        Returns a copy of the most recent window_size samples - shape (window_size, channel)
+        :param window_size: Number of samples.  If None, the window_size of the ring. Defaults to None
+        """
+        return self._window_view(self.window_size if window_size is None else window_size).copy()
+
+    def lease_window(self, window_size=None):
+        """
+        Returns the most recent window_size samples without copying them, as a WindowLease.
 
-    def __init__(self, moving_window_size, num_channels, buffer_queue, out_queue, update_interval, internal_buffer_size=None):
+        :param window_size: Number of samples.  If None, the window_size of the ring. Defaults to None
+        :return: WindowLease - lease.data is a read only view of shape (window_size, channel)
         """
-        A sample is defined as every read from the buffer_queue.
+        view = self._window_view(self.window_size if window_size is None else window_size).view()
+        view.flags.writeable = False
+        lease = WindowLease(self, view, self.samples_written)
+        if self.run_assertions:
+            self.leases.append(lease)
+        return lease
+
+
+class MovingWindowBuffer(object):
+
+    def __init__(self, moving_window_size, num_channels, buffer_queue, out_queue, update_interval, internal_buffer_size=None,
+                 copy_windows=True, run_assertions=False):
+        """
+        A sample is defined as a single row of data read from the buffer_queue.
         A channel is a dimension along the data read from the buffer queue.
 
-        An understanding of the internal workings of this object are needed to use it most wisely:
-            The buffer stores data in the format (sample #, channel #).
-            The buffer's actual size (not visible to the client) is preallocated (and never changes) to avoid problems
-                with reallocating large portions of memory.  This size is controlled with 'internal_buffer_size'.
+        The buffer stores the data in a preallocated RingWindowBuffer of internal_buffer_size samples (that never changes
+        size), so no data is moved around as samples arrive.
 
         :param moving_window_size:  The number of samples to save to the buffer.
         :param num_channels:  Number of channels of data (ie. size of the list placed on the buffer_queue)
         :param buffer_queue:  Buffer queue is the origin of the data.
-                                Data passed to this queue should be a list or 1D np array.
-                                
+                                Data passed to this queue should be a list or 1D np array (a single sample) or a 2D np array
+                                of shape (sample, channel) (a block of samples, such as a packet from the BrainAmp).
+
                                 If 'start' is passed to this queue, we will clear the buffer_queue, then begin putting data on the queue
                                 If 'stop' is passed to this queue, we will stop putting data on the queue and perpetually clear
                                     the buffer_queue
-                                
+
         :param out_queue:  Queue to place data on after the buffer reaches moving_window_size.
         :param update_interval: On ever update_interval samples, the pervious moving_window_size samples are placed on the out_buffer_queue
         :param internal_buffer_size: The size to make the buffer internally.  If none, will be set to 20 * moving_window_size. Defaults to None
+        :param copy_windows: If True, each window is copied before it is placed on the out_queue.  If False, a WindowLease
+                             (a zero-copy view of the window) is placed on the out_queue instead - the consumer must check
+                             lease.is_valid() after using lease.data.  Defaults to True
+        :param run_assertions: If True, checks every block (see RingWindowBuffer). Defaults to False
         """
         if internal_buffer_size is None:
             internal_buffer_size = 20 * moving_window_size
         self.moving_window_size, self.num_channels = moving_window_size, num_channels
         self.update_interval = update_interval
         self.internal_buffer_size = internal_buffer_size
-        self.buffer = np.zeros((self.internal_buffer_size, self.num_channels))
+        self.copy_windows = copy_windows
+        self.ring = RingWindowBuffer(window_size=moving_window_size, num_channels=num_channels, capacity=internal_buffer_size,
+                                     run_assertions=run_assertions)
         self.buffer_queue = buffer_queue
         self.out_queue = out_queue
+        # Number of samples since the last window was placed on the out_queue.
+        self.sample_index = 0
 
     def start_buffer(self):
         """
          Starts the buffer, reading from buffer_queue and writing to out_buffer_queue
-         once the buffer reaches moving_window_size.  Once the buffer reaches moving_window_size and is placed on the
-         queue, the buffer is cleared.
-        """
-        # This is our lead and trailing storage indexes.  This means the data in our buffer (as seen by the client)
-            # is self.buffer[trail_buffer_storage_index:lead_buffer_storage_index, :]
-        lead_buffer_storage_index = -1  # Set to -1 so first update will make it 0. This avoids a fense-post problem.
-        trail_buffer_storage_index = lead_buffer_storage_index - self.moving_window_size
-        sample_index = 0
+         once the buffer reaches moving_window_size.  After that, the last moving_window_size samples are placed on the
+         queue every update_interval samples.
+        """
         while True:
-            # We follow the algorithm
-                # 1. Get new sample and update indexes
-                # 2. Check if we need to adjust the buffer bounds
-                # 3. Add sample to the buffer at sample_index
-                # 4. Check if we need to put our buffer on the sample queue
-                    # The buffer should be formatted so this can be done easily
-
-            ###############################################
-            #  Step 1 - Get new sample and update indexes #
-            ###############################################
-            sample_arr = self.buffer_queue.get()  # A blocking call
-            if sample_arr == 'stop':
-                # Reset our indexes.
-                lead_buffer_storage_index = -1  # Set to -1 so first update will make it 0. This avoids a fense-post problem.
-                trail_buffer_storage_index = lead_buffer_storage_index - self.moving_window_size
-                sample_index = 0
-                self.handle_stop()
-
-
-            # This one we just collected is our nth sample.
-            # Samples are zero based indexed
-            sample_index += 1
-            lead_buffer_storage_index += 1
-            trail_buffer_storage_index += 1
-
-
-            ############################################################
-            #  Step 2  - Check if we need to adjust the buffer bounds  #
-            ############################################################
-            # Check if we're going to go over the buffer limit.
-            if lead_buffer_storage_index == self.internal_buffer_size:
-                # Fix buffer by coping over data.  We use self.moving_window_size - 1 because we have not yet
-                # inserted the new data.
-                self.buffer[0:self.moving_window_size - 1, :] = self.buffer[trail_buffer_storage_index: lead_buffer_storage_index - 1]
-                # Reset our indexes.
-                lead_buffer_storage_index = self.moving_window_size
-                trail_buffer_storage_index = 0
-
-            # Run some assertions
-            AV.assert_less(lead_buffer_storage_index, self.internal_buffer_size)
-            AV.assert_equal(lead_buffer_storage_index - trail_buffer_storage_index, self.moving_window_size)
-
-            ############################################
-            #  Step 3  - Add Add sample to the buffer  #
-            ############################################
-            self.buffer[lead_buffer_storage_index, :] = sample_arr
-
-
-            #####################################################################
-            #  Step 4 - Check if we need to put our buffer on the sample queue  #
-            #####################################################################
-            # Check if we need to put the buffer on the queue.
-            if sample_index == self.update_interval:
-                sub_buffer_to_send = self.buffer[trail_buffer_storage_index:lead_buffer_storage_index, :]
-                AV.assert_equal(sub_buffer_to_send.shape[0], self.moving_window_size, message="Internal Error - buffer is incorrectly formatted")
-                # Add our buffer to the queue.
-                self.out_queue.put(sub_buffer_to_send)
-                # Reset our sample index
-                sample_index = 0
+            data = self.buffer_queue.get()  # A blocking call
+            if isinstance(data, str):
+                if data == 'stop':
+                    self.handle_stop()
+                continue
+            self.add_samples(data)
+
+    def add_samples(self, data):
+        """
+        Adds a sample or a block of samples to the buffer, and places a window on the out_queue at every update_interval
+        samples (once the buffer holds moving_window_size samples).
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data.reshape((1, -1))
+        start = 0
+        while start < len(data):
+            # Split the block where the next window is due.
+            stop = min(len(data), start + self.update_interval - self.sample_index)
+            self.ring.add_samples(data[start:stop])
+            self.sample_index += stop - start
+            start = stop
+            if self.sample_index == self.update_interval:
+                self.sample_index = 0
+                if self.ring.is_full_window():
+                    self.out_queue.put(self.ring.get_window() if self.copy_windows else self.ring.lease_window())
 
     def handle_stop(self):
+        # Reset our buffer.
+        self.ring.reset()
+        self.sample_index = 0
         while True:
             sample_arr = self.buffer_queue.get()
-            if sample_arr == 'start':
+            if isinstance(sample_arr, str) and sample_arr == 'start':
                 return
 
 
+class BlockAccumulator(object):
+
+    def __init__(self, block_size, num_channels, dtype=np.float64):
+        """
+        Collects samples (or blocks of samples) into full blocks of block_size samples.
+
+        Samples are written straight into a preallocated block, so adding a sample costs the same no matter how full the
+        block is.  Full blocks are handed to the caller, and a new block is taken from a pool of recycled blocks (blocks
+        that the consumer is done with and has passed to recycle) or allocated if the pool is empty.  Recycling is up to
+        the consumer: if recycle is never called, every block is a new array that the consumer can keep.
+
+        :param block_size: Number of samples in each block.
+        :param num_channels: Number of channels of each sample.
+        :param dtype: dtype of the blocks. Defaults to np.float64
+        """
+        self.block_size, self.num_channels, self.dtype = block_size, num_channels, dtype
+        self.recycled_blocks = []
+        self.block = self._new_block()
+        # Number of samples in self.block
+        self.sample_index = 0
+
+    def _new_block(self):
+        return self.recycled_blocks.pop() if len(self.recycled_blocks) > 0 else np.empty((self.block_size, self.num_channels), dtype=self.dtype)
+
+    def add_samples(self, data):
+        """
+        Adds a sample of shape (channel,) or a block of samples of shape (sample, channel).
+
+        :return: list of full blocks (np arrays of shape (block_size, channel)) completed by data. Often empty.
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data.reshape((1, -1))
+        full_blocks = []
+        start = 0
+        while start < len(data):
+            count = min(len(data) - start, self.block_size - self.sample_index)
+            self.block[self.sample_index:self.sample_index + count] = data[start:start + count]
+            self.sample_index += count
+            start += count
+            if self.sample_index == self.block_size:
+                full_blocks.append(self.block)
+                self.block = self._new_block()
+                self.sample_index = 0
+        return full_blocks
+
+    def recycle(self, block):
+        """
+        Returns a block (from add_samples) that is no longer used, so it can be filled again instead of allocating a new one.
+        Can be called from the consumer's thread.
+        """
+        if block.shape == (self.block_size, self.num_channels) and block.dtype == self.dtype:
+            self.recycled_blocks.append(block)
+
+    def reset(self):
+        """
+        Drops the samples of the current (incomplete) block.
+        """
+        self.sample_index = 0
+
+
 class NonOverlappingBuffer(object):
     """
     A NoOverlap Buffer is a buffer that reads in data.  This is a more primitive version of the MovingWindowBuffer class.
@@ -129,37 +299,37 @@ class NonOverlappingBuffer(object):
 
     def __init__(self, capacity, num_channels, buffer_queue, out_queue):
         """
-        A sample is defined as every read from the buffer_queue.
+        A sample is defined as a single row of data read from the buffer_queue.
         A channel is a dimension along the data read from the buffer queue.
 
-        This nonoverlapping buffer stores moving_window_size samples and, once moving_window_size is reached, it places
-        the results on the out_buffer_queue and flushes the buffer.
+        This nonoverlapping buffer stores capacity samples and, once capacity is reached, it places
+        the results (shape (capacity, channel)) on the out_buffer_queue and starts a new buffer.  A consumer that is done
+        with a buffer from the out_queue can pass it to recycle so it is reused instead of allocating a new one.
         :param capacity:  The number of samples to save to the buffer.
         :param num_channels:  Number of channels of data (ie. size of the list placed on the buffer_queue)
         :param buffer_queue:  Buffer queue is the origin of the data.
-                                Data passed to this queue should be a list or 1D np array.
-        :param out_queue:  Queue to place data on after the buffer reaches moving_window_size.
+                                Data passed to this queue should be a list or 1D np array (a single sample), or a 2D np
+                                array of shape (sample, channel).
+        :param out_queue:  Queue to place data on after the buffer reaches capacity.
         """
         self.capacity, self.num_channels = capacity, num_channels
-        self.buffer = np.zeros((self.capacity, self.num_channels))
-        self.sample_index = 0
+        self.accumulator = BlockAccumulator(block_size=capacity, num_channels=num_channels)
         self.buffer_queue = buffer_queue
         self.out_queue = out_queue
 
     def start_buffer(self):
         """
          Starts the buffer, reading from buffer_queue and writing to out_buffer_queue
-         once the buffer reaches moving_window_size.  Once the buffer reaches moving_window_size and is placed on the
-         queue, the buffer is cleared.
+         once the buffer reaches capacity.  Once the buffer reaches capacity and is placed on the
+         queue, a new buffer is started.
         """
         while True:
             arr = self.buffer_queue.get()  # A blocking call
-            if self.sample_index % self.capacity == 0:  # check if we reached capcity
-                if self.sample_index != 0:  # Make sure we aren't putting on an empty buffer.
-                    self.out_queue.put(self.buffer)
-                self.buffer = np.zeros((self.capacity, self.num_channels))
-                self.buffer = arr  # Set our buffer to our new sample
-            else:
-                self.buffer = np.vstack((self.buffer, arr))
-            self.sample_index += 1
+            for full_buffer in self.accumulator.add_samples(arr):
+                self.out_queue.put(full_buffer)
 
+    def recycle(self, buffer):
+        """
+        Returns a buffer taken from the out_queue that is no longer used (see BlockAccumulator.recycle).
+        """
+        self.accumulator.recycle(buffer)
@@ -0,0 +1,52 @@
+"""
+Measures the throughput (samples/s) of MovingWindowBuffer when fed single samples or blocks of samples, with windows
+copied or leased.
+
+Usage:
+    python BufferBenchmark.py
+"""
+
+import time
+import Queue
+import numpy as np
+from CCDLUtil.DataManagement.Buffer import MovingWindowBuffer
+
+NUM_CHANNELS = 32
+WINDOW_SIZE = 500
+UPDATE_INTERVAL = 10
+
+
+def run_configuration(block_size, copy_windows, run_assertions, num_samples=200000):
+    """
+    Feeds num_samples samples through a MovingWindowBuffer in blocks of block_size samples.
+    :return: samples/s, number of windows emitted
+    """
+    out_queue = Queue.Queue()
+    buf = MovingWindowBuffer(moving_window_size=WINDOW_SIZE, num_channels=NUM_CHANNELS, buffer_queue=None, out_queue=out_queue,
+                             update_interval=UPDATE_INTERVAL, copy_windows=copy_windows, run_assertions=run_assertions)
+    data = np.random.randn(num_samples, NUM_CHANNELS)
+    blocks = [data[ii] if block_size == 1 else data[ii:ii + block_size] for ii in xrange(0, num_samples, block_size)]
+    start = time.time()
+    for block in blocks:
+        buf.add_samples(block)
+        # Consume windows as a live consumer would, so leases are released.
+        while not out_queue.empty():
+            window = out_queue.get()
+            if not copy_windows:
+                window.release()
+    elapsed = time.time() - start
+    return num_samples / elapsed
+
+
+def run_benchmark():
+    print 'Window %d samples x %d channels, update every %d samples' % (WINDOW_SIZE, NUM_CHANNELS, UPDATE_INTERVAL)
+    print '%-12s %-8s %-11s %15s' % ('Block size', 'Windows', 'Assertions', 'samples/s')
+    for block_size in [1, 10, 100]:
+        for copy_windows in [True, False]:
+            for run_assertions in [False, True]:
+                rate = run_configuration(block_size, copy_windows, run_assertions)
+                print '%-12d %-8s %-11s %15.0f' % (block_size, 'copy' if copy_windows else 'lease', str(run_assertions), rate)
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -9,7 +9,60 @@ import time
 import bisect
 import ast
 
-def epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops, trim=False):
+def get_epoch_sample_bounds(eeg_indexes, trial_starts, trial_stops):
+    """
+    Finds the sample range [start, stop) of every trial with one np.searchsorted call each for the starts and stops.
+
+    A trial starts at the first sample after its start value and stops before the first sample at or after its stop
+    value (the same as bisect.bisect_right and bisect.bisect_left).
+
+    :param eeg_indexes: nondecreasing epoch index for each sample (eeg index or time)
+    :param trial_starts: lst of trial start values (eeg index or time)
+    :param trial_stops: lst of trial stop values (eeg index or time)
+    :return: start_samples, stop_samples - np arrays of shape (epoch,)
+    """
+    AV.assert_equal(len(trial_starts), len(trial_stops))
+    eeg_indexes = np.asarray(eeg_indexes)
+    start_samples = np.searchsorted(eeg_indexes, trial_starts, side='right')
+    stop_samples = np.searchsorted(eeg_indexes, trial_stops, side='left')
+    empty = np.flatnonzero(start_samples >= stop_samples)
+    if len(empty) > 0:
+        raise AssertionError('Error: trial %d is empty. Start sample %d should be less than stop sample %d!' %
+                             (empty[0], start_samples[empty[0]], stop_samples[empty[0]]))
+    return start_samples, stop_samples
+
+
+def gather_epochs(raw_data, start_samples, num_samples, allow_view=False):
+    """
+    Extracts epochs of num_samples samples from raw_data, starting at each of start_samples.
+
+    If allow_view is True and the starts are evenly spaced (as they are for back to back trials of the same length),
+    the returned epochs are a read only strided view into raw_data, so no data is copied (or read, if raw_data is a
+    np.memmap).  Otherwise, the epochs are copied into one preallocated array.
+
+    :param raw_data: data shape [sample, channel]
+    :param start_samples: np array of the first sample of each epoch
+    :param num_samples: Number of samples in each epoch
+    :param allow_view: If True, a strided view may be returned instead of a copy. Defaults to False
+    :return: epoched data of shape (epoch, num_samples, channel)
+    """
+    start_samples = np.asarray(start_samples)
+    num_epochs = len(start_samples)
+    steps = np.diff(start_samples)
+    if allow_view and isinstance(raw_data, np.ndarray) and num_epochs > 0 and (num_epochs == 1 or np.all(steps == steps[0])):
+        step = int(steps[0]) if num_epochs > 1 else 0
+        first = raw_data[start_samples[0]:]
+        epoched_data = np.lib.stride_tricks.as_strided(first, shape=(num_epochs, num_samples) + raw_data.shape[1:],
+                                                       strides=(step * first.strides[0],) + first.strides)
+        epoched_data.flags.writeable = False
+        return epoched_data
+    epoched_data = np.empty((num_epochs, num_samples) + raw_data.shape[1:], dtype=raw_data.dtype)
+    for epoch_index, start_sample in enumerate(start_samples):
+        epoched_data[epoch_index] = raw_data[start_sample:start_sample + num_samples]
+    return epoched_data
+
+
+def epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops, trim=False, allow_view=False):
     """
     Takes raw data of shape [sample, channel] and returns epoched data of shape [epoch, sample channel].
     The epoches are taken according to the indexing of the start and stop values in the eeg indexes
@@ -18,27 +71,19 @@ def epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops, trim=False):
     :param raw_data: data shape [sample, channel]
     :param trial_starts: lst of trial start values (eeg index or time)
     :param trial_stops: lst of trial start values (eeg index or time)
-    :param trim: if trim, we will cut the end of one axis to make the concat work.
+    :param trim: if trim, all epochs are cut to the length of the shortest epoch.  If not trim, all trials must have the
+                 same length.
+    :param allow_view: if True, a read only strided view into raw_data may be returned instead of a copy (see gather_epochs).
     :return:
     """
     AV.assert_equal(len(eeg_indexes), raw_data.shape[0])
-    AV.assert_equal(len(trial_starts), len(trial_stops))
-    epoched_data = None
-    for start_stop_index in xrange(len(trial_starts)):
-        start_packet_index = bisect.bisect_right(eeg_indexes, trial_starts[start_stop_index])
-        end_packet_index = bisect.bisect_left(eeg_indexes, trial_stops[start_stop_index])
-        AV.assert_less(start_packet_index, end_packet_index)
-        trial_epoched_data = np.expand_dims(raw_data[start_packet_index:end_packet_index], axis=0)
-        try:
-            epoched_data = trial_epoched_data if epoched_data is None else np.concatenate((epoched_data, trial_epoched_data), axis=0)
-        except ValueError:
-            if trim:
-                min_shape = min(epoched_data.shape[1], trial_epoched_data.shape[1])
-                epoched_data = epoched_data[:, :min_shape, :]
-                trial_epoched_data = trial_epoched_data[:, :min_shape, :]
-                epoched_data = np.concatenate((epoched_data, trial_epoched_data), axis=0)
-            else:
-                raise ValueError('Epoched data shape', epoched_data.shape, 'Trial Epoched data shape', trial_epoched_data.shape)
+    start_samples, stop_samples = get_epoch_sample_bounds(eeg_indexes, trial_starts, trial_stops)
+    durations = stop_samples - start_samples
+    if len(durations) == 0:
+        raise ValueError('No trials to epoch')
+    if not trim and np.any(durations != durations[0]):
+        raise ValueError('Trials are not the same length', durations)
+    epoched_data = gather_epochs(raw_data, start_samples, int(np.min(durations)), allow_view=allow_view)
     AV.assert_equal(len(trial_stops), epoched_data.shape[0])
     return epoched_data
 
@@ -59,7 +104,7 @@ def cut_epoches_to_same_number_of_samples(epoched_data_list):
     return epoched_data_list
 
 
-def epoch_data_from_key(eeg_data_indexes, eeg_data, trial_list, start_key_list, end_key_list):
+def epoch_data_from_key(eeg_data_indexes, eeg_data, trial_list, start_key_list, end_key_list, allow_view=False):
     """
     Takes the list of eeg_data_indexes, eeg_data, trial_list, start_key_list, end_key_list and returns a list
     of epoched data, epoched according to those parameters.  Note that each element of the returned epoched data has the shape
@@ -72,6 +117,7 @@ def epoch_data_from_key(eeg_data_indexes, eeg_data, trial_list, start_key_list,
     :param trial_list: List of trial dictionaries, as extracted from a log file.
     :param start_key_list: List of start keys
     :param end_key_list: List of corresponding end keys. Must be same length as start_key_list
+    :param allow_view: If True, elements may be read only strided views into eeg_data rather than copies (see gather_epochs).
     :return: List of epoched eeg data, epoched according to the values provided in the trial_list and the start and end key_lists.
     """
 
@@ -80,7 +126,7 @@ def epoch_data_from_key(eeg_data_indexes, eeg_data, trial_list, start_key_list,
         start_indexes = extract_value_from_list_of_dicts(dictionary_list=trial_list, key=start_key)
         end_indexes = extract_value_from_list_of_dicts(dictionary_list=trial_list, key=end_key)
         end_indexes = convert_start_end_index_lists_to_single_duration_trials(start_trial_index=start_indexes, end_trial_index=end_indexes)
-        epoched_data_list.append(epoch_data(eeg_indexes=eeg_data_indexes, trial_starts=start_indexes, trial_stops=end_indexes, raw_data=eeg_data, trim=True))
+        epoched_data_list.append(epoch_data(eeg_indexes=eeg_data_indexes, trial_starts=start_indexes, trial_stops=end_indexes, raw_data=eeg_data, trim=True, allow_view=allow_view))
     return epoched_data_list
 
 
@@ -202,50 +248,53 @@ def convert_start_end_index_lists_to_single_duration_trials(start_trial_index, e
     return CCDLArrayParser.convert_ununiform_start_stop_lists_to_uniform_start_stop_lists(start_lst=start_trial_index, stop_lst=end_trial_index)
 
 
-def reepoch_data_with_fixed_window_size(epoched_data, labels, window_size):
+def reepoch_data_with_fixed_window_size(epoched_data, labels, window_size, hop=None, as_view=False):
     """
     For especially long epochs, we can make them into multiple smaller epochs - and thus have more data to play with
     This takes an np array of epoched data - shape (epoch, sample, channel) and returnes a new np array of shape
     (epoch, sample -- of len window_size, channel) where the num epochs and num samples are different than epoched_data
-    Number of channels is unaffected. This transformation is determined by window size.
+    Number of channels is unaffected. This transformation is determined by window size and hop.
 
-    A new np array is returned. epoched_data is unmodified.
+    A new np array is returned (unless as_view is True). epoched_data is unmodified.
 
     Additionally, as we are altering the data array, we will need to change the size of the labels to accommodate.
 
     :param epoched_data: Original epoched data - shape (epoch, sample, channel)
     :param labels: np array of labels for our data - shape (epoch,)
     :param window_size: Size of desired window (samples)
-    :return: transformed epoch data of - shape (new epoch num, new num sample, channel)
+    :param hop: Number of samples between the starts of consecutive windows. If None, defaults to window_size
+                (windows do not overlap).
+    :param as_view: If True, returns a read only strided view of shape (epoch, window, sample -- of len window_size, channel)
+                    into epoched_data instead of copying every window.  Overlapping windows (hop < window_size) then cost
+                    no extra memory. Index the view (ie. select channels) before reshaping it to
+                    (epoch * window, sample, channel), as the reshape copies. Defaults to False
+    :return: transformed epoch data of - shape (new epoch num, new num sample, channel), labels and windows_per_epoch.
+             Windows are ordered by epoch and then by time, so label i belongs to window i.
     """
-
-    # Get some initial parameters
-    original_num_epoch = epoched_data.shape[0]
-    block_dur = epoched_data.shape[1]
-    num_channels = epoched_data.shape[2]
+    hop = window_size if hop is None else hop
+    if window_size <= 0 or hop <= 0:
+        raise ValueError('window_size and hop must be positive. Got window_size %d, hop %d' % (window_size, hop))
+    epoched_data = np.asarray(epoched_data)
     # epoched_data.shape -> (num epoch, samples, channels), ie. (32, 4514, 31)
-
-    windows_per_epoch = int(block_dur / window_size)
-    # pre allocate space for our new epochs (This is to save time from multiple np concats).
-    # Shape is (num new epochs, epoch samples, num channels)  ie. (1184, 120, 31)
-    new_data = np.zeros(shape=(windows_per_epoch * original_num_epoch, window_size, num_channels))
-    for epoch_index in xrange(0, epoched_data.shape[0]):
-        for sample_offset, sample_index in enumerate(xrange(0, block_dur, window_size)):
-            # We ran off the edge of our data.  Move onto the next epoch
-            if sample_index + window_size >= block_dur: continue
-
-            # Get the new epoch
-            new_epoch = epoched_data[epoch_index, sample_index:sample_index + window_size, :]
-            assert new_epoch.shape[0] == window_size, '%d, %d' % (new_epoch.shape[0], window_size)
-
-            new_data[epoch_index * windows_per_epoch + sample_offset, :, :] = new_epoch
+    original_num_epoch, block_dur = epoched_data.shape[0], epoched_data.shape[1]
+    windows_per_epoch = (block_dur - window_size) // hop + 1 if block_dur >= window_size else 0
+
+    # Shape is (num epoch, windows per epoch, window samples, num channels)  ie. (32, 37, 120, 31)
+    epoch_stride, sample_stride = epoched_data.strides[0], epoched_data.strides[1]
+    windows = np.lib.stride_tricks.as_strided(epoched_data, shape=(original_num_epoch, windows_per_epoch, window_size) + epoched_data.shape[2:],
+                                              strides=(epoch_stride, hop * sample_stride, sample_stride) + epoched_data.strides[2:])
+    if as_view:
+        windows.flags.writeable = False
+        new_data = windows
+    else:
+        # One copy of all windows. Shape is (num new epochs, epoch samples, num channels)  ie. (1184, 120, 31)
+        new_data = np.empty(windows.shape, dtype=epoched_data.dtype)
+        new_data[...] = windows
+        new_data = new_data.reshape((original_num_epoch * windows_per_epoch, window_size) + epoched_data.shape[2:])
 
     # Reshape our labels
     if labels is not None:
-        new_labels = []
-        for label in labels:
-            new_labels += [label] * windows_per_epoch
-        labels = np.asarray(new_labels)
+        labels = np.repeat(np.asarray(labels), windows_per_epoch, axis=0)
 
     # Return our newly reepoched data - shape (epoch, sample, channel)
     return new_data, labels, windows_per_epoch
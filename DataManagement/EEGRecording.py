@@ -0,0 +1,321 @@
+"""
+Binary recording format for EEG data.
+
+Saving every sample as a line of text makes long sessions very large and slow to reload.  Instead, a recording is a
+fixed header followed by fixed size binary records, one per sample:
+
+    Header (little endian)
+        magic           8 bytes     'CCDLEEG1'
+        version         uint16
+        num_channels    uint16
+        fs              float64     Sampling rate (Hz)
+        header_size     uint32      Size of the whole header in bytes (the first record starts here)
+        resolutions     num_channels float64
+        channel names   num_channels zero terminated strings
+        meta info       one zero terminated string (for example the meta information written by the BrainAmpStreamer)
+        padding         zeros up to header_size (a multiple of 4096, so records start on a page boundary)
+
+    Records (one per sample)
+        eeg_index       int64       The packet (or sample) index - the same as the index column of our csv files.
+        clock_time      float64     The time the packet was received (typically from time.time())
+        data            num_channels float32
+
+Records are appended in blocks, and the file is only flushed according to the writer's flush policy rather than after
+every sample.  If a recording was cut off mid-record, the incomplete record is ignored when reading.
+
+Because every record has the same size, a recording can be memory mapped (EEGRecordingReader.memmap) so that only the
+pages that are actually used are read from disk.  Existing csv recordings can be converted once to this format with
+convert_csv_to_recording (or load_csv_as_recording, which caches the conversion next to the csv file).
+"""
+
+import os
+import time
+import struct
+import numpy as np
+import CCDLUtil.DataManagement.FileParser as FileParser
+
+MAGIC = 'CCDLEEG1'
+VERSION = 1
+HEADER_ALIGNMENT = 4096
+_FIXED_HEADER_FORMAT = '<8sHHdL'
+
+
+def get_record_dtype(num_channels):
+    """
+    Returns the numpy dtype of a single record (sample) in a recording with num_channels channels.
+    """
+    return np.dtype([('eeg_index', '<i8'), ('clock_time', '<f8'), ('data', '<f4', (num_channels,))])
+
+
+class EEGRecordingWriter(object):
+
+    def __init__(self, file_path, channel_names, fs, resolutions=None, meta_info='', flush_interval=1.0, flush_size=2 ** 20):
+        """
+        Creates a new recording (overwriting file_path if it exists) and writes the header.
+
+        :param file_path: str - Where to save the recording.
+        :param channel_names: list of channel names (strings).  Determines the number of channels.
+        :param fs: Sampling rate (Hz) of the data to be written.
+        :param resolutions: Optional -- list of channel resolutions. If None, all resolutions are set to 1.0.
+                            Note that the data written is not scaled by these values, they are only recorded in the header.
+        :param meta_info: Optional -- str of free text to save in the header. Defaults to ''.
+        :param flush_interval: The file is flushed when at least flush_interval seconds have passed since the last flush.
+                               If None, we do not flush on time. Defaults to 1 second.
+        :param flush_size: The file is flushed when at least flush_size bytes have been written since the last flush.
+                           If None, we do not flush on size. Defaults to 1 MB.
+        """
+        channel_names = [str(name) for name in channel_names]
+        num_channels = len(channel_names)
+        if resolutions is None:
+            resolutions = [1.0] * num_channels
+        if len(resolutions) != num_channels:
+            raise ValueError('There are not the same number of resolutions as channel names: %d Resolutions, %d Channel Names' % (len(resolutions), num_channels))
+        for name in channel_names + [str(meta_info)]:
+            if '\x00' in name:
+                raise ValueError('Channel names and meta info cannot contain null characters')
+        self.file_path = file_path
+        self.channel_names, self.fs, self.resolutions = channel_names, fs, list(resolutions)
+        self.record_dtype = get_record_dtype(num_channels)
+        self.flush_interval, self.flush_size = flush_interval, flush_size
+        self.num_samples = 0
+        self._unflushed_bytes = 0
+        self._last_flush_time = time.time()
+        self.f = open(file_path, 'wb')
+        self.f.write(EEGRecordingWriter._build_header(channel_names, fs, resolutions, str(meta_info)))
+        self.f.flush()
+
+    @staticmethod
+    def _build_header(channel_names, fs, resolutions, meta_info):
+        variable = struct.pack('<%dd' % len(resolutions), *resolutions)
+        variable += ''.join([name + '\x00' for name in channel_names]) + meta_info + '\x00'
+        header_size = struct.calcsize(_FIXED_HEADER_FORMAT) + len(variable)
+        header_size = HEADER_ALIGNMENT * ((header_size + HEADER_ALIGNMENT - 1) // HEADER_ALIGNMENT)
+        header = struct.pack(_FIXED_HEADER_FORMAT, MAGIC, VERSION, len(channel_names), fs, header_size) + variable
+        return header + '\x00' * (header_size - len(header))
+
+    def write_block(self, data, eeg_indexes, clock_times):
+        """
+        Appends a block of samples to the recording.
+
+        :param data: np array (or list) of shape (sample, channel), or a single sample of shape (channel,).
+        :param eeg_indexes: Index of each sample - a single value (used for every sample in the block) or an array of
+                            length sample.
+        :param clock_times: Time of each sample - a single value (used for every sample in the block) or an array of
+                            length sample.
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = np.expand_dims(data, axis=0)
+        if data.ndim != 2 or data.shape[1] != len(self.channel_names):
+            raise ValueError('Data must be of shape (sample, %d).  Actual Shape %s' % (len(self.channel_names), str(data.shape)))
+        records = np.empty(data.shape[0], dtype=self.record_dtype)
+        records['eeg_index'] = eeg_indexes
+        records['clock_time'] = clock_times
+        records['data'] = data
+        self.f.write(records.tostring())
+        self.num_samples += data.shape[0]
+        self._unflushed_bytes += records.nbytes
+        if (self.flush_size is not None and self._unflushed_bytes >= self.flush_size) or \
+                (self.flush_interval is not None and time.time() - self._last_flush_time >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Flushes everything written so far to the operating system.
+        """
+        self.f.flush()
+        self._unflushed_bytes = 0
+        self._last_flush_time = time.time()
+
+    def close(self):
+        """
+        Flushes and closes the recording.  The data is synced to disk before returning.
+        """
+        if not self.f.closed:
+            self.flush()
+            os.fsync(self.f.fileno())
+            self.f.close()
+
+
+class EEGRecordingReader(object):
+
+    def __init__(self, file_path):
+        """
+        Reads the header of a recording written by EEGRecordingWriter.
+
+        After construction, the following attributes are available:
+            channel_names, fs, resolutions, meta_info, num_channels, num_samples, header_size, record_dtype
+
+        :param file_path: str - Path to the recording.
+        """
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            fixed_size = struct.calcsize(_FIXED_HEADER_FORMAT)
+            fixed = f.read(fixed_size)
+            if len(fixed) != fixed_size or not fixed.startswith(MAGIC):
+                raise ValueError('%s is not a CCDLUtil EEG recording' % file_path)
+            magic, version, num_channels, fs, header_size = struct.unpack(_FIXED_HEADER_FORMAT, fixed)
+            if version != VERSION:
+                raise ValueError('Unsupported recording version: %d' % version)
+            variable = f.read(header_size - fixed_size)
+        self.num_channels, self.fs, self.header_size = num_channels, fs, header_size
+        self.resolutions = list(struct.unpack_from('<%dd' % num_channels, variable, 0))
+        strings = variable[8 * num_channels:].split('\x00')
+        self.channel_names = strings[:num_channels]
+        self.meta_info = strings[num_channels]
+        self.record_dtype = get_record_dtype(num_channels)
+        # Ignore any incomplete record at the end of the file.
+        self.num_samples = (os.path.getsize(file_path) - header_size) // self.record_dtype.itemsize
+
+    def read(self, start=0, stop=None):
+        """
+        Reads samples [start, stop) into memory.
+
+        :param start: First sample to read. Defaults to 0
+        :param stop: Sample to stop at (not included).  If None, reads to the end of the recording. Defaults to None
+        :return: eeg_indexes, clock_times, data
+                    eeg_indexes - np array of shape (sample,)
+                    clock_times - np array of shape (sample,)
+                    data - np array of shape (sample, channel) and dtype float32
+        """
+        stop = self.num_samples if stop is None else min(stop, self.num_samples)
+        count = max(0, stop - start)
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.header_size + start * self.record_dtype.itemsize)
+            records = np.fromfile(f, dtype=self.record_dtype, count=count)
+        return records['eeg_index'], records['clock_time'], records['data']
+
+    def memmap(self):
+        """
+        Memory maps the recording (read only).  Nothing is read from disk until the returned arrays are accessed, and then
+        only the pages that are touched.  Slicing the returned arrays (for example when epoching) gives views, not copies.
+
+        :return: eeg_indexes, clock_times, data
+                    eeg_indexes - np.memmap of shape (sample,)
+                    clock_times - np.memmap of shape (sample,)
+                    data - np.memmap of shape (sample, channel) and dtype float32
+        """
+        if self.num_samples == 0:
+            # An empty file region cannot be mapped.
+            return self.read()
+        records = np.memmap(self.file_path, dtype=self.record_dtype, mode='r', offset=self.header_size, shape=(self.num_samples,))
+        return records['eeg_index'], records['clock_time'], records['data']
+
+
+def convert_csv_to_recording(csv_file_path, file_path, fs, channel_names=None, skiprows=0, delimiter=',', eeg_col_index=0,
+                             clock_col_index=1, chunk_size=10000):
+    """
+    Converts a csv recording (as saved by EEGInterfaceParent.start_saving_data, ie. index,time,chan1,chan2...) to a
+    binary recording.  The csv is converted chunk_size lines at a time, so it is never loaded into memory at once.
+
+    The skipped header rows are saved as the meta info of the recording.  Channel data is stored as float32.
+
+    :param csv_file_path: str - Path to the csv file.
+    :param file_path: str - Where to save the recording.
+    :param fs: Sampling rate (Hz) of the data.
+    :param channel_names: Optional -- list of channel names.  If None, channels are named by their csv column number.
+    :param skiprows: Number of header rows to skip. Defaults to 0
+    :param delimiter: Delimiter used in the csv file. Defaults to ','
+    :param eeg_col_index: Column of our eeg indexes (usually 0, defaults to 0)
+    :param clock_col_index: Column of our eeg timestamps (usually 1, defaults to 1)
+    :param chunk_size: Number of lines to parse at a time. Defaults to 10000
+    :return: The number of samples written.
+    """
+    writer = None
+    row_length = None
+    try:
+        with open(csv_file_path, 'r') as infile:
+            meta_info = ''.join([next(infile) for _ in range(skiprows)]).replace('\x00', '')
+            while True:
+                lines = [line for _, line in zip(xrange(chunk_size), infile)]
+                if len(lines) == 0:
+                    break
+                row_length, rows = FileParser.parse_delimited_lines(lines, delimiter=delimiter, row_length=row_length)
+                if len(rows) == 0:
+                    continue
+                channel_cols = [col for col in range(row_length) if col not in (eeg_col_index, clock_col_index)]
+                if writer is None:
+                    if channel_names is None:
+                        channel_names = [str(col) for col in channel_cols]
+                    writer = EEGRecordingWriter(file_path, channel_names=channel_names, fs=fs, meta_info=meta_info, flush_interval=None)
+                writer.write_block(rows[:, channel_cols], rows[:, eeg_col_index], rows[:, clock_col_index])
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError('No data found in %s' % csv_file_path)
+    return writer.num_samples
+
+
+def load_csv_as_recording(csv_file_path, fs, cache_file_path=None, **kwargs):
+    """
+    Returns an EEGRecordingReader for a csv recording.  The first time this is called, the csv file is converted with
+    convert_csv_to_recording and saved to cache_file_path.  Later calls reuse the cached recording (unless the csv file
+    has been modified since), so the csv is only ever parsed once.
+
+    :param csv_file_path: str - Path to the csv file.
+    :param fs: Sampling rate (Hz) of the data.
+    :param cache_file_path: Where to save the converted recording. If None, defaults to csv_file_path + '.eeg'
+    :param kwargs: Passed to convert_csv_to_recording (for example skiprows or channel_names).
+    :return: EEGRecordingReader
+    """
+    if cache_file_path is None:
+        cache_file_path = csv_file_path + '.eeg'
+    if not os.path.exists(cache_file_path) or os.path.getmtime(cache_file_path) < os.path.getmtime(csv_file_path):
+        # Convert to a temporary file first so an interrupted conversion is never mistaken for a valid cache.
+        temp_file_path = cache_file_path + '.tmp'
+        convert_csv_to_recording(csv_file_path, temp_file_path, fs, **kwargs)
+        if os.path.exists(cache_file_path):
+            os.remove(cache_file_path)
+        os.rename(temp_file_path, cache_file_path)
+    return EEGRecordingReader(cache_file_path)
+
+
+def recording_to_standard_mat_format(file_path, eeg_system, event_markers, experiment_description, date_collected, aux_data=None, subject_name=None):
+    """
+    Loads a recording and returns it as a dictionary in our standard .mat format (see FileParser.get_standard_mat_format).
+    The eeg indexes and clock times of the recording become packet_indexes and time_stamps.
+
+    :param file_path: str - Path to the recording.
+    :param eeg_system: string - The EEG System must be a valid system as shown in CCDLUtil.Utility.Constants.EEGSystemNames.ALL_VALID_NAMES
+    :param event_markers: Our event markers that could be used for epoching our eeg
+    :param experiment_description: sting - A written description of what occurred during the experiment.
+    :param date_collected: string - Denoting the date in which the data was collected.
+    :param aux_data: Numpy array or None (defaults to None)
+    :param subject_name: String, Number, or None - The name or number of our subject.
+    :return: A dictionary that fits our standard .mat formatting.
+    """
+    reader = EEGRecordingReader(file_path)
+    eeg_indexes, clock_times, data = reader.read()
+    return FileParser.get_standard_mat_format(eeg_system=eeg_system, unepoched_eeg_data=data, event_markers=event_markers,
+                                              channel_names=reader.channel_names, experiment_description=experiment_description,
+                                              date_collected=date_collected, fs=reader.fs, time_stamps=clock_times,
+                                              packet_indexes=eeg_indexes, aux_data=aux_data, subject_name=subject_name)
+
+
+def standard_mat_format_to_recording(mdict, file_path, resolutions=None, meta_info=''):
+    """
+    Writes a dictionary in our standard .mat format (as returned by FileParser.get_standard_mat_format or loaded with
+    FileParser.load_matlab_file) to a recording.
+
+    Missing packet_indexes are replaced with the sample number, missing time_stamps with nan.
+
+    :param mdict: Dictionary in our standard .mat format.
+    :param file_path: str - Where to save the recording.
+    :param resolutions: Optional -- list of channel resolutions to record in the header.
+    :param meta_info: Optional -- str of free text to save in the header. Defaults to ''.
+    :return: The number of samples written.
+    """
+    # Values loaded from a .mat file are wrapped in 2D arrays and strings are padded.
+    data = np.asarray(mdict['unepoched_eeg_data'])
+    channel_names = [str(name).strip() for name in np.ravel(mdict['channel_names'])]
+    fs = float(np.squeeze(mdict['fs']))
+    num_samples = data.shape[0]
+    eeg_indexes = np.ravel(mdict['packet_indexes']) if 'packet_indexes' in mdict else np.arange(num_samples)
+    clock_times = np.ravel(mdict['time_stamps']) if 'time_stamps' in mdict else np.nan
+    writer = EEGRecordingWriter(file_path, channel_names=channel_names, fs=fs, resolutions=resolutions, meta_info=meta_info)
+    try:
+        writer.write_block(data, eeg_indexes, clock_times)
+    finally:
+        writer.close()
+    return num_samples
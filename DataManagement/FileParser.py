@@ -8,6 +8,7 @@ import CCDLUtil.Utility.AssertVal as AV
 import time
 import bisect
 import ast
+import multiprocessing
 import scipy.io
 import CCDLUtil.Utility.Constants as CCDLConstants
 
@@ -61,7 +62,7 @@ def load_matlab_file(mat_file_path):
     Loads a .mat file to a python dictionary
     :param mat_file_path: The path to the matlab file.
     """
-    return scipy.io.savemat(file_name=mat_file_path)
+    return scipy.io.loadmat(file_name=mat_file_path)
 
 
 def get_standard_mat_format(eeg_system, unepoched_eeg_data, event_markers, channel_names, experiment_description, date_collected, fs, time_stamps, packet_indexes, aux_data=None, subject_name=None):
@@ -92,6 +93,10 @@ def get_standard_mat_format(eeg_system, unepoched_eeg_data, event_markers, chann
         raise ValueError('time_stamps and packet_indexes cannot both be None.')
     mdict = {'description': experiment_description, 'date_collected': date_collected, 'unepoched_eeg_data': unepoched_eeg_data,
              'channel_names': channel_names, "fs": fs, "event_markers": event_markers, 'eeg_system': eeg_system}
+    if time_stamps is not None:
+        mdict['time_stamps'] = time_stamps
+    if packet_indexes is not None:
+        mdict['packet_indexes'] = packet_indexes
     if aux_data is not None:
         mdict['aux_data'] = aux_data
     if subject_name is not None:
@@ -169,6 +174,107 @@ def iter_loadtxt(filename, delimiter=',', skiprows=0, dtype=float):
     return data
 
 
+def parse_delimited_lines(lines, delimiter=',', row_length=None, dtype=float):
+    """
+    Parses a list of lines to a 2D numpy array with the same rules as iter_loadtxt (a trailing delimiter is removed and
+    rows that do not have row_length values are ignored).
+
+    Lines are only filtered in python, the numbers themselves are parsed by numpy in a single call.
+
+    :param lines: list of strings
+    :param delimiter: Delimiter (such as ',')
+    :param row_length: Number of values in a complete row.  If None, the length of the first line is used.
+    :param dtype: type of data.
+    :return: row_length, np array of shape (row, row_length).  row_length is None if lines is empty.
+    """
+    rows = []
+    for line in lines:
+        line = line.strip()
+        if line.endswith(delimiter):
+            line = line[:-1].rstrip()
+        num_values = line.count(delimiter) + 1
+        row_length = num_values if row_length is None else row_length
+        if num_values == row_length:
+            rows.append(line)
+    if len(rows) == 0:
+        return row_length, np.empty((0, 0 if row_length is None else row_length), dtype=dtype)
+    data = np.fromstring(delimiter.join(rows), dtype=dtype, sep=delimiter)
+    if data.size != len(rows) * row_length:
+        # np.fromstring stops at the first value it can't parse.  Find it to give the same error as iter_loadtxt.
+        for item in delimiter.join(rows).split(delimiter):
+            dtype(item)
+        raise ValueError('Could not parse all values in the given lines')
+    return row_length, data.reshape((-1, row_length))
+
+
+def _parse_file_chunk(args):
+    """
+    Parses the lines in bytes [start, end) of a file.  Used by parallel_loadtxt in a process pool.
+    """
+    filename, start, end, delimiter, row_length, dtype = args
+    with open(filename, 'rb') as infile:
+        infile.seek(start)
+        lines = infile.read(end - start).splitlines()
+    return parse_delimited_lines(lines, delimiter=delimiter, row_length=row_length, dtype=dtype)[1]
+
+
+def get_line_aligned_chunks(filename, skiprows=0, chunk_size=2 ** 24):
+    """
+    Splits a text file (after skiprows header rows) into byte ranges of about chunk_size bytes.  Every range starts at
+    the beginning of a line and ends at the end of a line.
+
+    :return: list of (start, end) tuples
+    """
+    file_size = os.path.getsize(filename)
+    chunks = []
+    with open(filename, 'rb') as infile:
+        for _ in range(skiprows):
+            infile.readline()
+        start = infile.tell()
+        while start < file_size:
+            infile.seek(min(start + chunk_size, file_size))
+            infile.readline()  # Move to the end of the current line.
+            end = min(max(infile.tell(), start + 1), file_size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parallel_loadtxt(filename, delimiter=',', skiprows=0, dtype=float, processes=None, chunk_size=2 ** 24):
+    """
+    Loads a txt file to a 2D numpy array with the same results as iter_loadtxt, but the file is split at line boundaries
+    and the chunks are parsed in parallel on a process pool.
+
+    Ignores incomplete rows and trailing delimiters.  The row length is taken from the first row after the header.
+    :param filename: Name of file to load
+    :param delimiter: Delimiter (such as ',')
+    :param skiprows: Skip rows in header.
+    :param dtype: type of data.
+    :param processes: Number of processes to parse with.  If None, uses the number of cpus.  If 1, the file is parsed in
+                      this process.
+    :param chunk_size: Approximate number of bytes parsed at a time (per task). Defaults to 16 MB.
+    :return: np array of data.
+    """
+    with open(filename, 'r') as infile:
+        for _ in range(skiprows):
+            next(infile)
+        row_length = parse_delimited_lines([next(infile, '')], delimiter=delimiter, dtype=dtype)[0]
+    chunks = get_line_aligned_chunks(filename, skiprows=skiprows, chunk_size=chunk_size)
+    tasks = [(filename, start, end, delimiter, row_length, dtype) for start, end in chunks]
+    if len(tasks) == 0:
+        raise ValueError("Check to ensure file is not blank")
+    if processes == 1 or len(tasks) == 1:
+        results = map(_parse_file_chunk, tasks)
+    else:
+        pool = multiprocessing.Pool(processes=processes)
+        try:
+            results = pool.map(_parse_file_chunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return np.concatenate(results, axis=0)
+
+
 def manage_storage(data_storage_location, take_init):
     """
     Deals with the file system to init all files
@@ -0,0 +1,59 @@
+"""
+Compares the throughput (MB/s) of FileParser.iter_loadtxt with FileParser.parallel_loadtxt.
+
+Usage:
+    python IngestBenchmark.py [csv_file_path [skiprows]]
+
+If no file is passed, a csv in the format written by EEGInterfaceParent.start_saving_data (index,time,32 channels) is
+generated in the temp directory.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import CCDLUtil.DataManagement.FileParser as FileParser
+
+
+def write_synthetic_csv(file_path, num_samples=200000, num_channels=32, header_rows=15):
+    """
+    Writes a csv recording similar to those saved by start_saving_data (with a trailing delimiter on each line).
+    """
+    with open(file_path, 'w') as f:
+        for ii in xrange(header_rows):
+            f.write('Header line,\t%d\n' % ii)
+        for start in xrange(0, num_samples, 10000):
+            block = np.random.randn(min(10000, num_samples - start), num_channels) * 100
+            f.write(''.join(['%d,%f,%s,\n' % (index, time.time(), ','.join(map(str, row)))
+                             for index, row in enumerate(block, start)]))
+
+
+def time_ingest(name, fn, file_size):
+    start = time.time()
+    data = fn()
+    elapsed = time.time() - start
+    print '%-30s %8.2f s %10.1f MB/s   shape %s' % (name, elapsed, file_size / elapsed / 2 ** 20, str(data.shape))
+    return data
+
+
+def run_benchmark(file_path, skiprows):
+    file_size = os.path.getsize(file_path)
+    print 'Loading %s (%.1f MB)' % (file_path, file_size / 2.0 ** 20)
+    expected = time_ingest('iter_loadtxt', lambda: FileParser.iter_loadtxt(file_path, skiprows=skiprows), file_size)
+    for processes in [1, None]:
+        name = 'parallel_loadtxt (%s processes)' % (str(processes) if processes is not None else 'all')
+        data = time_ingest(name, lambda: FileParser.parallel_loadtxt(file_path, skiprows=skiprows, processes=processes), file_size)
+        assert np.array_equal(expected, data), 'Results differ from iter_loadtxt'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run_benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    else:
+        csv_file_path = os.path.join(tempfile.gettempdir(), 'ingest_benchmark.csv')
+        write_synthetic_csv(csv_file_path)
+        try:
+            run_benchmark(csv_file_path, 15)
+        finally:
+            os.remove(csv_file_path)
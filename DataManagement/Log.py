@@ -8,6 +8,7 @@ an experiment (not EEG data).
 import CCDLUtil.DataManagement.StringParser as StringParser
 import Queue
 from CCDLUtil.Utility.Decorators import threaded
+from CCDLUtil.Utility.EventLoop import EventLoop
 
 
 class Log(object):
@@ -16,20 +17,30 @@ class Log(object):
     A log object is responsible for reading items from a queue and writing them to file.
     """
 
-    def __init__(self, subject_log_file_path, verbose=False, header=None):
+    def __init__(self, subject_log_file_path, verbose=False, header=None, loop=None, interval=0.05):
         """
         Logs all items to file.  Files are taken from the log_queue and written to the file specified by
         subject_log_file_path.
         :param subject_log_file_path: String. where to save the file
         :param log_queue: queue to read items from
         :param header:
+        :param loop: Optional -- a CCDLUtil.Utility.EventLoop.EventLoop.  If given, the queue is written to file on the loop
+                     every interval seconds instead of in a new thread, and the file is closed when the loop stops.
+                     Defaults to None
+        :param interval: Seconds between writes when loop is given. Defaults to 0.05
         """
         self.f = file(subject_log_file_path, 'w')
         self.log_queue = Queue.Queue()
         if header is not None:
             self.f.write(header)
-        # create new thread and start logging to file
-        self._start_log(verbose=verbose)
+        self.timer = None
+        if loop is not None:
+            self.timer = loop.call_every(interval, self._write_pending, verbose)
+            # Write what is left on the queue and close the file when the loop stops.
+            loop.call_on_stop(self.close, verbose)
+        else:
+            # create new thread and start logging to file
+            self._start_log(verbose=verbose)
 
     def info(self, message):
         """
@@ -59,3 +70,34 @@ class Log(object):
                 print body
             self.f.write(body)
             self.f.flush()
+
+    def _write_pending(self, verbose=False):
+        """
+        Writes all the items on the queue (without waiting for more).  Used when logging on an event loop.
+        """
+        bodies = []
+        while True:
+            try:
+                body = self.log_queue.get_nowait()
+            except Queue.Empty:
+                break
+            assert type(body) is str
+            body = StringParser.idempotent_append_newline(body)
+            if verbose:
+                print body
+            bodies.append(body)
+        if len(bodies) > 0:
+            self.f.write(''.join(bodies))
+            self.f.flush()
+
+    def close(self, verbose=False):
+        """
+        Writes the items left on the queue and closes the file.  When logging on an event loop, this is called when the
+        loop stops.  When logging in a thread, only call this once nothing more will be logged.
+        """
+        if self.f.closed:
+            return
+        if self.timer is not None:
+            EventLoop.cancel(self.timer)
+        self._write_pending(verbose)
+        self.f.close()
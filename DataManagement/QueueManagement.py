@@ -5,11 +5,17 @@ See https://docs.python.org/3/library/queue.html for Queue api.
 
 """
 
+import time
 import Queue
+import collections
 import multiprocessing
+import numpy as np
 
 def clear_queue(q):
     """Clears a queue in a thread-safe manner"""
+    if isinstance(q, BatchQueue):
+        q.clear()
+        return
     with q.mutex:
         q.queue.clear()
 
@@ -34,3 +40,179 @@ def get_queue_dict(all_queues, thread=True):
         else:
             queue_dict[q] = multiprocessing.Queue()
     return queue_dict
+
+
+class BatchQueue(Queue.Queue):
+    """
+    A Queue.Queue for streaming samples from one acquisition thread to a consumer in blocks.
+
+    The producer puts single samples (or blocks of samples) as usual.  They are gathered into one (sample, channel) block
+    and only handed to the consumer (with a single lock and wakeup) once max_block_size samples have been gathered or
+    the first gathered sample is max_latency seconds old - whichever comes first.  The consumer reads with get_block
+    (or with get, which returns one block).
+
+    get_stats reports the queue depth and the lag between a sample being put and it being read.
+
+    Note that maxsize and task_done/join are not supported.
+    """
+
+    def __init__(self, max_block_size=32, max_latency=0.02):
+        """
+        :param max_block_size: Maximum number of samples gathered into a block before it is handed to the consumer.
+        :param max_latency: Maximum time (seconds) a sample waits to be handed to the consumer. Defaults to 20 ms
+        """
+        Queue.Queue.__init__(self)
+        self.max_block_size, self.max_latency = max_block_size, max_latency
+        # Time each block in self.queue was started (its first sample was put).
+        self.block_times = collections.deque()
+        self.pending, self.pending_samples, self.pending_since = [], 0, None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Resets the statistics reported by get_stats.
+        """
+        with self.mutex:
+            self.samples_put, self.blocks_flushed, self.samples_got = 0, 0, 0
+            self.max_depth_samples, self.total_lag, self.max_lag, self.blocks_got = 0, 0.0, 0.0, 0
+            self.depth_samples = self.pending_samples + sum([len(block) for block in self.queue])
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Puts a sample of shape (channel,) or a block of samples of shape (sample, channel) on the queue.
+        block and timeout are ignored (the queue is never full).
+        """
+        item = np.asarray(item)
+        if item.ndim == 1:
+            item = item.reshape((1, -1))
+        with self.mutex:
+            now = time.time()
+            first_pending = self.pending_samples == 0
+            if first_pending:
+                self.pending_since = now
+            self.pending.append(item)
+            self.pending_samples += len(item)
+            self.samples_put += len(item)
+            self.depth_samples += len(item)
+            self.max_depth_samples = max(self.max_depth_samples, self.depth_samples)
+            if self.pending_samples >= self.max_block_size or now - self.pending_since >= self.max_latency:
+                self._flush_pending()
+            elif first_pending:
+                # Wake up a waiting consumer so it waits for max_latency from now rather than its whole timeout.
+                self.not_empty.notify()
+
+    def put_nowait(self, item):
+        return self.put(item)
+
+    def flush(self):
+        """
+        Hands all gathered samples to the consumer now.
+        """
+        with self.mutex:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        # Must be called with self.mutex held.
+        if self.pending_samples == 0:
+            return
+        if len(self.block_times) > len(self.queue):
+            # The queue was cleared externally (ie. with self.queue.clear()). Drop the times of the removed blocks.
+            for _ in xrange(len(self.block_times) - len(self.queue)):
+                self.block_times.popleft()
+        pending_block = self.pending[0] if len(self.pending) == 1 else np.concatenate(self.pending, axis=0)
+        self.queue.append(pending_block)
+        self.block_times.append(self.pending_since)
+        self.pending, self.pending_samples, self.pending_since = [], 0, None
+        self.blocks_flushed += 1
+        self.not_empty.notify()
+
+    def _get(self):
+        pending_block = self.queue.popleft()
+        self._record_get(pending_block, self.block_times.popleft() if len(self.block_times) > 0 else None)
+        return pending_block
+
+    def _record_get(self, got_block, block_time):
+        self.samples_got += len(got_block)
+        self.depth_samples -= len(got_block)
+        if block_time is not None:
+            lag = time.time() - block_time
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            self.blocks_got += 1
+
+    def get(self, block=True, timeout=None):
+        """
+        Returns one block of shape (sample, channel).  Gathered samples are handed out once they are max_latency old,
+        even if no more samples are put.
+        """
+        return self.get_block(max_n=None, timeout=timeout if block else 0, max_blocks=1)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_block(self, max_n=None, timeout=None, max_blocks=None):
+        """
+        Returns all available samples (up to max_n) as one block of shape (sample, channel).  Blocks until at least one
+        sample is available.
+
+        :param max_n: Maximum number of samples to return.  If None, there is no limit. Defaults to None
+        :param timeout: Maximum time to wait (seconds).  If None, waits forever.  Raises Queue.Empty on timeout.
+        :param max_blocks: Maximum number of gathered blocks to combine.  If None, there is no limit. Defaults to None
+        :return: np array of shape (sample, channel)
+        """
+        with self.not_empty:
+            deadline = None if timeout is None else time.time() + timeout
+            while not self._qsize():
+                now = time.time()
+                if self.pending_samples > 0 and now - self.pending_since >= self.max_latency:
+                    self._flush_pending()
+                    break
+                wait = None if deadline is None else deadline - now
+                if wait is not None and wait <= 0:
+                    raise Queue.Empty
+                if self.pending_samples > 0:
+                    latency_wait = self.pending_since + self.max_latency - now
+                    wait = latency_wait if wait is None else min(wait, latency_wait)
+                self.not_empty.wait(wait)
+            blocks, num_samples = [], 0
+            while self._qsize() and (max_n is None or num_samples < max_n) and (max_blocks is None or len(blocks) < max_blocks):
+                next_block = self.queue[0]
+                if max_n is not None and num_samples + len(next_block) > max_n:
+                    # Split the block, leaving the rest on the queue.
+                    take = max_n - num_samples
+                    self.queue[0] = next_block[take:]
+                    next_block = next_block[:take]
+                    self._record_get(next_block, self.block_times[0] if len(self.block_times) > 0 else None)
+                else:
+                    next_block = self._get()
+                blocks.append(next_block)
+                num_samples += len(next_block)
+            self.not_full.notify()
+        return blocks[0] if len(blocks) == 1 else np.concatenate(blocks, axis=0)
+
+    def clear(self):
+        """
+        Removes all samples from the queue (including samples not yet handed to the consumer).
+        """
+        with self.mutex:
+            self.queue.clear()
+            self.block_times.clear()
+            self.pending, self.pending_samples, self.pending_since = [], 0, None
+            self.depth_samples = 0
+
+    def get_stats(self):
+        """
+        :return: dict of statistics since the last reset_stats:
+                    depth_samples - Samples put but not yet read.
+                    depth_blocks - Blocks ready to be read.
+                    max_depth_samples - Largest depth_samples seen.
+                    samples_put, samples_got - Number of samples put and read.
+                    blocks_flushed - Number of blocks handed to the consumer.
+                    mean_samples_per_block - samples_put / blocks_flushed
+                    mean_lag, max_lag - Time (seconds) from the first sample of a block being put to the block being read.
+        """
+        with self.mutex:
+            return {'depth_samples': self.depth_samples, 'depth_blocks': len(self.queue), 'max_depth_samples': self.max_depth_samples,
+                    'samples_put': self.samples_put, 'samples_got': self.samples_got, 'blocks_flushed': self.blocks_flushed,
+                    'mean_samples_per_block': self.samples_put / float(max(1, self.blocks_flushed)),
+                    'mean_lag': self.total_lag / max(1, self.blocks_got), 'max_lag': self.max_lag}
@@ -0,0 +1,225 @@
+"""
+A shared memory ring of EEG frames (samples of shape (channel,)) for streaming from one producer to consumers in other
+processes (ie. a decoder, the display and a saver) without pickling arrays through a multiprocessing.Queue.
+
+Usage:
+    ring = SharedFrameRing(capacity=5000, num_channels=32)
+    multiprocessing.Process(target=consumer, args=(ring,)).start()  # The ring is shared, not copied.
+    ring.write(block)  # in the acquisition thread, block of shape (sample, channel)
+
+    def consumer(ring):
+        reader = ring.reader()
+        while True:
+            sequence, frames, indexes = reader.read(timeout=1.0)
+            ...
+"""
+
+import time
+import ctypes
+import numpy as np
+import multiprocessing.sharedctypes
+
+
+class RingOverrunError(RuntimeError):
+    """
+    Raised by SharedFrameReader.read (when raise_on_overrun is True) if frames were overwritten before they were read.
+    """
+    pass
+
+
+class SharedFrameRing(object):
+
+    def __init__(self, capacity, num_channels, dtype=np.float32):
+        """
+        A single producer/multiple consumer ring of frames in shared memory.
+
+        Every frame is given a sequence number (0 for the first frame ever written, then counting up).  Frames are
+        stored in a mirrored ring (every frame is stored twice, capacity frames apart), so any run of up to capacity
+        consecutive frames is contiguous and can be read as a zero-copy view.
+
+        Only one process (and thread) may write.  Any number of SharedFrameReaders, each with its own cursor, can read.
+        The producer never waits for readers - a reader that falls more than capacity frames behind has frames
+        overwritten, which it detects (see SharedFrameReader).
+
+        The ring can be passed to a multiprocessing.Process (as an argument) like a multiprocessing.Queue.
+
+        :param capacity: Number of frames kept.
+        :param num_channels: Number of channels of each frame.
+        :param dtype: dtype of the frames. Defaults to np.float32
+        """
+        self.capacity, self.num_channels, self.dtype = capacity, num_channels, np.dtype(dtype)
+        self.raw_frames = multiprocessing.sharedctypes.RawArray(ctypes.c_char, 2 * capacity * num_channels * self.dtype.itemsize)
+        # Optional per frame index (ie. the EEG index of each sample), mirrored like the frames.
+        self.raw_indexes = multiprocessing.sharedctypes.RawArray(ctypes.c_longlong, 2 * capacity)
+        # Time (time.time()) each frame was written, to measure the latency of readers.
+        self.raw_write_times = multiprocessing.sharedctypes.RawArray(ctypes.c_double, capacity)
+        # [write_begin, write_end] - frames with sequence numbers below write_end can be read.  While a block is being
+        # written, write_begin is already advanced to the end of the block, so readers know which frames are being
+        # overwritten.
+        self.raw_header = multiprocessing.sharedctypes.RawArray(ctypes.c_longlong, 2)
+        self._map()
+
+    def _map(self):
+        self.frames = np.frombuffer(self.raw_frames, dtype=self.dtype).reshape((2 * self.capacity, self.num_channels))
+        self.indexes = np.frombuffer(self.raw_indexes, dtype=np.int64)
+        self.write_times = np.frombuffer(self.raw_write_times, dtype=np.float64)
+        self.header = np.frombuffer(self.raw_header, dtype=np.int64)
+
+    def __getstate__(self):
+        # The numpy views can't be pickled, but the shared arrays can (when spawning a process).
+        return {'capacity': self.capacity, 'num_channels': self.num_channels, 'dtype': self.dtype, 'raw_frames': self.raw_frames,
+                'raw_indexes': self.raw_indexes, 'raw_write_times': self.raw_write_times, 'raw_header': self.raw_header}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def get_num_written(self):
+        """
+        Returns the number of frames written so far (the sequence number of the next frame).
+        """
+        return int(self.header[1])
+
+    def write(self, frames, indexes=None):
+        """
+        Writes a block of frames to the ring.  Must only be called by the producer.
+
+        :param frames: np array (or list) of shape (sample, channel), or a single frame of shape (channel,).
+        :param indexes: Optional -- int or array of shape (sample,) stored alongside each frame (ie. the EEG index).
+                        An int is taken as the index of the first frame, with the next frames counting up from it.
+                        If None, the sequence numbers are stored.  Defaults to None
+        :return: The sequence number of the first frame written.
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 1:
+            frames = frames.reshape((1, -1))
+        num_frames = len(frames)
+        if num_frames > self.capacity:
+            raise ValueError('Cannot write %d frames to a ring of capacity %d' % (num_frames, self.capacity))
+        sequence = int(self.header[1])
+        if indexes is None:
+            indexes = np.arange(sequence, sequence + num_frames)
+        elif np.isscalar(indexes):
+            indexes = np.arange(indexes, indexes + num_frames)
+        self.header[0] = sequence + num_frames
+        slot = sequence % self.capacity
+        first = min(num_frames, self.capacity - slot)
+        rest = num_frames - first
+        for offset in (0, self.capacity):
+            self.frames[offset + slot:offset + slot + first] = frames[:first]
+            self.frames[offset:offset + rest] = frames[first:]
+            self.indexes[offset + slot:offset + slot + first] = indexes[:first]
+            self.indexes[offset:offset + rest] = indexes[first:]
+        now = time.time()
+        self.write_times[slot:slot + first] = now
+        self.write_times[:rest] = now
+        self.header[1] = sequence + num_frames
+        return sequence
+
+    def get_write_time(self, sequence):
+        """
+        Returns the time (time.time()) frame sequence was written, or None if it has been overwritten.
+        """
+        write_time = self.write_times[sequence % self.capacity]
+        return write_time if self.is_valid(sequence, 1) else None
+
+    def is_valid(self, sequence, num_frames):
+        """
+        Returns True if the frames sequence to sequence + num_frames - 1 have not been (and are not being) overwritten.
+        """
+        return int(self.header[0]) - sequence <= self.capacity and sequence + num_frames <= int(self.header[1])
+
+    def reader(self, start_at_oldest=False, raise_on_overrun=False):
+        """
+        Returns a new SharedFrameReader of this ring.  See SharedFrameReader.
+        """
+        return SharedFrameReader(self, start_at_oldest=start_at_oldest, raise_on_overrun=raise_on_overrun)
+
+
+class SharedFrameReader(object):
+
+    def __init__(self, ring, start_at_oldest=False, raise_on_overrun=False):
+        """
+        Reads frames from a SharedFrameRing, keeping its own cursor (the sequence number of the next frame to read).
+
+        If the producer gets more than capacity frames ahead of the cursor, the frames in between are lost.  This is
+        counted in overruns and frames_dropped, and the cursor is moved on to the oldest frame still in the ring (or
+        RingOverrunError is raised if raise_on_overrun is True).
+
+        :param ring: The SharedFrameRing to read.
+        :param start_at_oldest: If True, the first read starts with the oldest frame in the ring.  Otherwise only frames
+                                written after the reader is created are read. Defaults to False
+        :param raise_on_overrun: If True, read raises RingOverrunError when frames were lost. Defaults to False
+        """
+        self.ring = ring
+        self.raise_on_overrun = raise_on_overrun
+        num_written = ring.get_num_written()
+        self.cursor = max(0, num_written - ring.capacity) if start_at_oldest else num_written
+        self.overruns, self.frames_dropped = 0, 0
+
+    def get_num_available(self):
+        """
+        Returns the number of frames that can be read (not counting frames lost to an overrun).
+        """
+        return self.ring.get_num_written() - max(self.cursor, int(self.ring.header[0]) - self.ring.capacity)
+
+    def _check_overrun(self):
+        oldest = int(self.ring.header[0]) - self.ring.capacity
+        if self.cursor < oldest:
+            dropped = oldest - self.cursor
+            self.overruns += 1
+            self.frames_dropped += dropped
+            self.cursor = oldest
+            if self.raise_on_overrun:
+                raise RingOverrunError('Reader fell behind: %d frames were overwritten before they were read' % dropped)
+
+    def read(self, max_n=None, copy=True, timeout=0, poll_interval=0.001):
+        """
+        Reads the frames written since the last read (up to max_n) and moves the cursor past them.
+
+        :param max_n: Maximum number of frames to read. If None, all available frames (at most capacity). Defaults to None
+        :param copy: If True, the frames are copied out of the ring.  If False, read only views into the ring are
+                     returned - check is_valid(sequence, len(frames)) after using them, as the producer may have
+                     overwritten them in the meantime. Defaults to True
+        :param timeout: Time to wait (seconds) for at least one frame. 0 to return immediately, None to wait forever.
+                        Defaults to 0
+        :param poll_interval: Time between checks for new frames while waiting. Defaults to 1 ms
+        :return: sequence, frames, indexes -- sequence is the sequence number of the first frame, frames has shape
+                 (sample, channel) and indexes has shape (sample,).  frames and indexes are empty if nothing was written.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self._check_overrun()
+        while self.ring.get_num_written() <= self.cursor and (deadline is None or time.time() < deadline):
+            time.sleep(poll_interval)
+            self._check_overrun()
+        sequence = self.cursor
+        num_frames = self.ring.get_num_written() - sequence
+        if max_n is not None:
+            num_frames = min(num_frames, max_n)
+        slot = sequence % self.ring.capacity
+        frames = self.ring.frames[slot:slot + num_frames]
+        indexes = self.ring.indexes[slot:slot + num_frames]
+        if copy:
+            frames, indexes = frames.copy(), indexes.copy()
+            if not self.ring.is_valid(sequence, num_frames):
+                # The producer overwrote some of the frames while we copied them.
+                self._check_overrun()
+                return self.read(max_n=max_n, copy=copy, timeout=timeout, poll_interval=poll_interval)
+        else:
+            frames, indexes = frames.view(), indexes.view()
+            frames.flags.writeable = False
+            indexes.flags.writeable = False
+        self.cursor = sequence + num_frames
+        return sequence, frames, indexes
+
+    def is_valid(self, sequence, num_frames):
+        """
+        Returns True if the frames returned by a read (with copy=False) have not been overwritten.
+        """
+        return self.ring.is_valid(sequence, num_frames)
+
+    def get_lag(self):
+        """
+        Returns the number of frames written but not yet read by this reader.
+        """
+        return self.ring.get_num_written() - self.cursor
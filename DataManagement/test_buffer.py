@@ -0,0 +1,86 @@
+import Queue
+import numpy as np
+import CCDLUtil.DataManagement.Buffer as Buffer
+
+
+def test_ring_window_matches_stream():
+    stream = np.random.RandomState(0).randn(500, 2)
+    ring = Buffer.RingWindowBuffer(window_size=20, num_channels=2, capacity=50)
+    position = 0
+    # Blocks that wrap the ring, a single sample and a block longer than the ring.
+    for block_size in [7, 30, 1, 13, 120, 49, 50, 230]:
+        ring.add_samples(stream[position:position + block_size] if block_size > 1 else stream[position])
+        position += block_size
+        assert ring.get_num_samples() == min(position, 50)
+        if position < 20:
+            assert not ring.is_full_window()
+            continue
+        np.testing.assert_array_equal(ring.get_window(), stream[position - 20:position])
+        if position >= 50:
+            np.testing.assert_array_equal(ring.get_window(window_size=50), stream[position - 50:position])
+    assert position == 500
+
+
+def test_lease_is_valid_until_overwritten():
+    ring = Buffer.RingWindowBuffer(window_size=10, num_channels=1, capacity=25)
+    ring.add_samples(np.arange(10.0).reshape(-1, 1))
+    lease = ring.lease_window()
+    assert not lease.data.flags.writeable
+    ring.add_samples(np.zeros((15, 1)))
+    assert lease.is_valid()
+    np.testing.assert_array_equal(lease.data[:, 0], np.arange(10.0))
+    ring.add_samples(np.zeros((1, 1)))
+    assert not lease.is_valid()
+
+
+def test_lease_assertions():
+    ring = Buffer.RingWindowBuffer(window_size=10, num_channels=1, capacity=25, run_assertions=True)
+    ring.add_samples(np.zeros((10, 1)))
+    lease = ring.lease_window()
+    try:
+        ring.add_samples(np.zeros((16, 1)))
+    except AssertionError:
+        lease.release()
+        ring.add_samples(np.zeros((16, 1)))
+        return
+    assert False, 'Expected an AssertionError'
+
+
+def test_moving_window_blocks_match_single_samples():
+    stream = np.random.RandomState(1).randn(300, 3)
+    windows = []
+    for blocks in [[stream[ii] for ii in range(300)], np.split(stream, [10, 11, 60, 200])]:
+        out_queue = Queue.Queue()
+        buf = Buffer.MovingWindowBuffer(moving_window_size=40, num_channels=3, buffer_queue=None, out_queue=out_queue,
+                                        update_interval=15, internal_buffer_size=100)
+        for block in blocks:
+            buf.add_samples(block)
+        windows.append([out_queue.get_nowait() for _ in range(out_queue.qsize())])
+    # A window every 15 samples, once 40 samples have arrived.
+    expected = [stream[stop - 40:stop] for stop in range(45, 301, 15)]
+    for found in windows:
+        assert len(found) == len(expected)
+        for window, expected_window in zip(found, expected):
+            np.testing.assert_array_equal(window, expected_window)
+
+
+def test_block_accumulator_blocks_and_recycling():
+    stream = np.random.RandomState(2).randn(95, 2)
+    accumulator = Buffer.BlockAccumulator(block_size=20, num_channels=2)
+    blocks = []
+    for block in [stream[0]] + np.split(stream[1:], [5, 50, 51]):
+        blocks += accumulator.add_samples(block)
+    assert len(blocks) == 4
+    np.testing.assert_array_equal(np.concatenate(blocks), stream[:80])
+    # Without recycling, every block is a new array.
+    assert len(set(id(block) for block in blocks)) == 4
+    accumulator.recycle(blocks[0])
+    accumulator.recycle(np.empty((10, 2)))  # The wrong shape is not reused.
+    # The block after the one being filled is taken from the pool.
+    reused = accumulator.add_samples(stream[:25])
+    assert reused[1] is blocks[0]
+    np.testing.assert_array_equal(np.concatenate(reused), np.concatenate((stream[80:95], stream[:25])))
+    accumulator.reset()
+    new_block = accumulator.add_samples(stream[:20])[0]
+    assert new_block is not blocks[0]
+    np.testing.assert_array_equal(new_block, stream[:20])
@@ -0,0 +1,107 @@
+import bisect
+import numpy as np
+import CCDLUtil.DataManagement.DataParser as DataParser
+
+
+def baseline_epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops):
+    # The bisect and concatenate loop that epoch_data used before it was vectorized (with trim=True).
+    epoched_data = None
+    for start, stop in zip(trial_starts, trial_stops):
+        trial = raw_data[bisect.bisect_right(eeg_indexes, start):bisect.bisect_left(eeg_indexes, stop)][None]
+        if epoched_data is not None:
+            min_shape = min(epoched_data.shape[1], trial.shape[1])
+            epoched_data, trial = epoched_data[:, :min_shape], trial[:, :min_shape]
+        epoched_data = trial if epoched_data is None else np.concatenate((epoched_data, trial), axis=0)
+    return epoched_data
+
+
+def make_recording(num_packets=200, packet_size=10, num_channels=3):
+    # Every sample of a packet has the packet's eeg index, as the streamers save them.
+    eeg_indexes = list(np.repeat(np.arange(num_packets), packet_size))
+    raw_data = np.random.RandomState(0).randn(len(eeg_indexes), num_channels)
+    return eeg_indexes, raw_data
+
+
+def test_sample_bounds_match_bisect():
+    eeg_indexes, _ = make_recording()
+    trial_starts, trial_stops = [3, 50, 50.5, 120], [10, 61, 70, 199]
+    start_samples, stop_samples = DataParser.get_epoch_sample_bounds(eeg_indexes, trial_starts, trial_stops)
+    np.testing.assert_array_equal(start_samples, [bisect.bisect_right(eeg_indexes, start) for start in trial_starts])
+    np.testing.assert_array_equal(stop_samples, [bisect.bisect_left(eeg_indexes, stop) for stop in trial_stops])
+
+
+def test_empty_trial_raises():
+    eeg_indexes, _ = make_recording()
+    try:
+        DataParser.get_epoch_sample_bounds(eeg_indexes, [5, 20], [30, 20])
+    except AssertionError:
+        return
+    assert False, 'Expected an AssertionError'
+
+
+def test_epoch_data_matches_baseline():
+    eeg_indexes, raw_data = make_recording()
+    trial_starts, trial_stops = [0, 30, 90, 150], [20, 50, 110, 170]
+    for allow_view in [False, True]:
+        np.testing.assert_array_equal(DataParser.epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops, allow_view=allow_view),
+                                      baseline_epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops))
+
+
+def test_epoch_data_trims_to_shortest_trial():
+    eeg_indexes, raw_data = make_recording()
+    trial_starts, trial_stops = [0, 30, 90], [25, 50, 130]
+    np.testing.assert_array_equal(DataParser.epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops, trim=True),
+                                  baseline_epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops))
+    try:
+        DataParser.epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops)
+    except ValueError:
+        return
+    assert False, 'Expected a ValueError'
+
+
+def test_gather_epochs_view_and_copy():
+    raw_data = np.arange(60.0).reshape(20, 3)
+    view = DataParser.gather_epochs(raw_data, [2, 6, 10], 5, allow_view=True)
+    copy = DataParser.gather_epochs(raw_data, [2, 6, 10], 5)
+    np.testing.assert_array_equal(view, copy)
+    assert np.shares_memory(view, raw_data) and not view.flags.writeable
+    assert not np.shares_memory(copy, raw_data)
+    # Unevenly spaced starts can't be a view.
+    uneven = DataParser.gather_epochs(raw_data, [0, 3, 10], 4, allow_view=True)
+    assert not np.shares_memory(uneven, raw_data)
+    np.testing.assert_array_equal(uneven, [raw_data[0:4], raw_data[3:7], raw_data[10:14]])
+
+
+def baseline_reepoch(epoched_data, labels, window_size):
+    # The loop reepoch_data_with_fixed_window_size used before it was strided (for epochs that are not a multiple of
+    # window_size long - the loop left the last window of those empty).
+    windows_per_epoch = epoched_data.shape[1] // window_size
+    new_data = np.zeros((windows_per_epoch * epoched_data.shape[0], window_size, epoched_data.shape[2]))
+    for epoch_index in range(epoched_data.shape[0]):
+        for window_index in range(windows_per_epoch):
+            sample_index = window_index * window_size
+            new_data[epoch_index * windows_per_epoch + window_index] = epoched_data[epoch_index, sample_index:sample_index + window_size]
+    return new_data, np.repeat(labels, windows_per_epoch), windows_per_epoch
+
+
+def test_reepoch_matches_baseline():
+    epoched_data = np.random.RandomState(1).randn(4, 103, 3)
+    labels = np.array([0, 1, 0, 1])
+    new_data, new_labels, windows_per_epoch = DataParser.reepoch_data_with_fixed_window_size(epoched_data, labels, 10)
+    expected_data, expected_labels, expected_windows = baseline_reepoch(epoched_data, labels, 10)
+    np.testing.assert_array_equal(new_data, expected_data)
+    np.testing.assert_array_equal(new_labels, expected_labels)
+    assert windows_per_epoch == expected_windows == 10
+
+
+def test_reepoch_hop_and_view():
+    epoched_data = np.random.RandomState(2).randn(3, 50, 2)
+    new_data, labels, windows_per_epoch = DataParser.reepoch_data_with_fixed_window_size(epoched_data, [5, 6, 7], 20, hop=7)
+    assert windows_per_epoch == 5
+    np.testing.assert_array_equal(labels, np.repeat([5, 6, 7], 5))
+    expected = [epoched_data[epoch, start:start + 20] for epoch in range(3) for start in range(0, 31, 7)]
+    np.testing.assert_array_equal(new_data, expected)
+    windows, _, _ = DataParser.reepoch_data_with_fixed_window_size(epoched_data, None, 20, hop=7, as_view=True)
+    assert windows.shape == (3, 5, 20, 2)
+    assert np.shares_memory(windows, epoched_data) and not windows.flags.writeable
+    np.testing.assert_array_equal(windows.reshape(new_data.shape), new_data)
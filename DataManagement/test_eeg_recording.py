@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import CCDLUtil.DataManagement.FileParser as FileParser
+import CCDLUtil.DataManagement.EEGRecording as EEGRecording
+import CCDLUtil.EEGInterface.EEGInterface as EEGInterface
+
+
+def write_recording(file_path, blocks, channel_names=('C3', 'Cz', 'C4'), fs=500.0):
+    writer = EEGRecording.EEGRecordingWriter(file_path, channel_names=list(channel_names), fs=fs, resolutions=[0.1, 0.2, 0.3],
+                                             meta_info='Subject Name,\tS1')
+    for index, (t, data) in enumerate(blocks):
+        writer.write_block(data, eeg_indexes=index, clock_times=t)
+    writer.close()
+    return writer
+
+
+def test_round_trip(tmpdir):
+    file_path = str(tmpdir.join('a.eeg'))
+    rng = np.random.RandomState(0)
+    blocks = [(100.0 + ii, rng.randn(10, 3)) for ii in range(5)]
+    write_recording(file_path, blocks)
+    reader = EEGRecording.EEGRecordingReader(file_path)
+    assert reader.channel_names == ['C3', 'Cz', 'C4']
+    assert reader.fs == 500.0
+    assert reader.resolutions == [0.1, 0.2, 0.3]
+    assert reader.meta_info == 'Subject Name,\tS1'
+    assert reader.num_samples == 50
+    eeg_indexes, clock_times, data = reader.read()
+    np.testing.assert_array_equal(eeg_indexes, np.repeat(np.arange(5), 10))
+    np.testing.assert_array_equal(clock_times, np.repeat(100.0 + np.arange(5), 10))
+    assert data.dtype == np.float32
+    np.testing.assert_array_equal(data, np.concatenate([block for _, block in blocks]).astype(np.float32))
+    # Partial reads
+    np.testing.assert_array_equal(reader.read(start=12, stop=17)[2], data[12:17])
+
+
+def test_memmap_matches_read(tmpdir):
+    file_path = str(tmpdir.join('a.eeg'))
+    write_recording(file_path, [(float(ii), np.full((4, 3), ii)) for ii in range(3)])
+    reader = EEGRecording.EEGRecordingReader(file_path)
+    for read, mapped in zip(reader.read(), reader.memmap()):
+        np.testing.assert_array_equal(read, mapped)
+
+
+def test_incomplete_record_is_ignored(tmpdir):
+    file_path = str(tmpdir.join('a.eeg'))
+    write_recording(file_path, [(0.0, np.ones((3, 3)))])
+    with open(file_path, 'ab') as f:
+        f.write('\x00' * 5)
+    assert EEGRecording.EEGRecordingReader(file_path).num_samples == 3
+
+
+def test_binary_saver_drains_queue_on_stop(tmpdir):
+    file_path = str(tmpdir.join('a.eeg'))
+    interface = EEGInterface.EEGInterfaceParent(live=False)
+    interface.save_channel_names, interface.save_fs = ['C3', 'C4'], 500.0
+    interface.start_saving_binary_data(file_path)
+    interface.data_save_queue.put((None, None, 'Subject Name,\tS1'))
+    for ii in range(100):
+        interface.data_save_queue.put((ii, 10.0 + ii, np.full((2, 2), ii)))
+    interface.stopped = True
+    assert interface.wait_for_saving(5)
+    reader = EEGRecording.EEGRecordingReader(file_path)
+    assert reader.meta_info == 'Subject Name,\tS1'
+    eeg_indexes, clock_times, data = reader.read()
+    np.testing.assert_array_equal(eeg_indexes, np.repeat(np.arange(100), 2))
+    np.testing.assert_array_equal(data[:, 0], np.repeat(np.arange(100), 2))
+
+
+def test_binary_saver_closes_recording_on_timeout(tmpdir):
+    file_path = str(tmpdir.join('a.eeg'))
+    interface = EEGInterface.EEGInterfaceParent(live=False)
+    interface.save_channel_names, interface.save_fs = ['C3', 'C4'], 500.0
+    interface.start_saving_binary_data(file_path, timeout=0.2)
+    interface.data_save_queue.put((0, 10.0, np.ones((3, 2))))
+    # No more data arrives, so the saver stops by itself without stopped being set.
+    assert interface.wait_for_saving(5)
+    eeg_indexes, clock_times, data = EEGRecording.EEGRecordingReader(file_path).read()
+    np.testing.assert_array_equal(data, np.ones((3, 2)))
+
+
+def test_csv_conversion_matches_iter_loadtxt(tmpdir):
+    csv_file_path = str(tmpdir.join('a.csv'))
+    rng = np.random.RandomState(1)
+    with open(csv_file_path, 'w') as f:
+        f.write('header 1\nheader 2\n')
+        for ii in range(250):
+            f.write(','.join([str(ii), str(1000.5 + ii)] + ['%.4f' % value for value in rng.randn(4)]) + ',\n')
+    expected = FileParser.iter_loadtxt(csv_file_path, skiprows=2)
+    reader = EEGRecording.load_csv_as_recording(csv_file_path, fs=250, skiprows=2, chunk_size=64)
+    eeg_indexes, clock_times, data = reader.read()
+    assert reader.meta_info == 'header 1\nheader 2\n'
+    np.testing.assert_array_equal(eeg_indexes, expected[:, 0])
+    np.testing.assert_array_equal(clock_times, expected[:, 1])
+    np.testing.assert_array_equal(data, expected[:, 2:].astype(np.float32))
+    # The converted recording is reused while the csv is unchanged.
+    cache_mtime = os.path.getmtime(csv_file_path + '.eeg')
+    EEGRecording.load_csv_as_recording(csv_file_path, fs=250, skiprows=2)
+    assert os.path.getmtime(csv_file_path + '.eeg') == cache_mtime
@@ -0,0 +1,44 @@
+import numpy as np
+import CCDLUtil.DataManagement.FileParser as FileParser
+
+
+def write_csv(file_path, num_rows=500, num_channels=6, header_rows=3):
+    rng = np.random.RandomState(0)
+    with open(file_path, 'w') as f:
+        for ii in range(header_rows):
+            f.write('header line %d\n' % ii)
+        for ii in range(num_rows):
+            # Trailing delimiter, as written by the OpenBCIStreamer.
+            f.write(','.join([str(ii), '%.6f' % (1000 + ii * 0.002)] + ['%.5f' % value for value in rng.randn(num_channels)]) + ',\n')
+        # An incomplete last row (ie. from a crash) is ignored.
+        f.write('%d,1.5,2.5\n' % num_rows)
+
+
+def test_line_aligned_chunks_cover_the_file(tmpdir):
+    file_path = str(tmpdir.join('a.csv'))
+    write_csv(file_path)
+    contents = open(file_path, 'rb').read()
+    header_size = len(''.join(contents.splitlines(True)[:3]))
+    chunks = FileParser.get_line_aligned_chunks(file_path, skiprows=3, chunk_size=1000)
+    assert len(chunks) > 1
+    assert chunks[0][0] == header_size
+    assert chunks[-1][1] == len(contents)
+    for (start, end), (next_start, _) in zip(chunks[:-1], chunks[1:]):
+        assert end == next_start
+        assert contents[end - 1] == '\n'
+
+
+def test_parallel_loadtxt_matches_iter_loadtxt(tmpdir):
+    file_path = str(tmpdir.join('a.csv'))
+    write_csv(file_path)
+    expected = FileParser.iter_loadtxt(file_path, skiprows=3)
+    assert expected.shape == (500, 8)
+    for processes in (1, 2):
+        data = FileParser.parallel_loadtxt(file_path, skiprows=3, processes=processes, chunk_size=1000)
+        np.testing.assert_array_equal(data, expected)
+
+
+def test_parallel_loadtxt_single_chunk(tmpdir):
+    file_path = str(tmpdir.join('a.csv'))
+    write_csv(file_path, num_rows=10, header_rows=0)
+    np.testing.assert_array_equal(FileParser.parallel_loadtxt(file_path), FileParser.iter_loadtxt(file_path))
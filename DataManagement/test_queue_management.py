@@ -0,0 +1,57 @@
+import time
+import Queue
+import threading
+import numpy as np
+import CCDLUtil.DataManagement.QueueManagement as QueueManagement
+
+
+def test_blocks_are_handed_out_when_full():
+    q = QueueManagement.BatchQueue(max_block_size=4, max_latency=10)
+    for ii in range(10):
+        q.put([ii, -ii])
+    np.testing.assert_array_equal(q.get(), [[ii, -ii] for ii in range(4)])
+    np.testing.assert_array_equal(q.get_block(), [[ii, -ii] for ii in range(4, 8)])
+    # The last two samples are not max_latency old yet.
+    try:
+        q.get(timeout=0.05)
+    except Queue.Empty:
+        pass
+    else:
+        assert False, 'Expected Queue.Empty'
+    q.flush()
+    np.testing.assert_array_equal(q.get_nowait(), [[8, -8], [9, -9]])
+    stats = q.get_stats()
+    assert (stats['samples_put'], stats['samples_got'], stats['blocks_flushed'], stats['depth_samples']) == (10, 10, 3, 0)
+
+
+def test_get_block_limits():
+    q = QueueManagement.BatchQueue(max_block_size=3, max_latency=10)
+    q.put(np.arange(18).reshape(9, 2))
+    q.put(np.arange(6).reshape(3, 2))
+    # Both puts are handed out as one block each, max_n splits them.
+    np.testing.assert_array_equal(q.get_block(max_n=5), np.arange(10).reshape(5, 2))
+    np.testing.assert_array_equal(q.get_block(), np.concatenate((np.arange(10, 18).reshape(4, 2), np.arange(6).reshape(3, 2))))
+    q.put([1, 2])
+    QueueManagement.clear_queue(q)
+    assert q.get_stats()['depth_samples'] == 0
+    q.flush()
+    assert q.empty()
+
+
+def test_sample_put_while_waiting_arrives_within_max_latency():
+    q = QueueManagement.BatchQueue(max_block_size=100, max_latency=0.05)
+    got = []
+
+    def consume():
+        got.append(q.get_block(timeout=3))
+        got.append(time.time())
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    # Let the consumer start waiting with its whole timeout.
+    time.sleep(0.1)
+    put_time = time.time()
+    q.put([1.0, 2.0])
+    consumer.join(5)
+    np.testing.assert_array_equal(got[0], [[1.0, 2.0]])
+    assert got[1] - put_time < 0.5
@@ -0,0 +1,43 @@
+import numpy as np
+import CCDLUtil.DataManagement.SharedFrameRing as SharedFrameRing
+
+
+def frames(start, num_frames, num_channels=2):
+    return np.arange(start, start + num_frames)[:, np.newaxis] * np.ones(num_channels, dtype=np.float32)
+
+
+def test_read_across_the_wrap():
+    ring = SharedFrameRing.SharedFrameRing(capacity=8, num_channels=2)
+    reader = ring.reader()
+    ring.write(frames(0, 6))
+    assert reader.read()[0] == 0
+    ring.write(frames(6, 5), indexes=100)
+    sequence, data, indexes = reader.read()
+    assert sequence == 6
+    np.testing.assert_array_equal(data, frames(6, 5))
+    np.testing.assert_array_equal(indexes, np.arange(100, 105))
+    assert len(reader.read()[1]) == 0
+
+
+def test_overrun_is_detected():
+    ring = SharedFrameRing.SharedFrameRing(capacity=8, num_channels=2)
+    reader = ring.reader()
+    ring.write(frames(0, 6))
+    ring.write(frames(6, 6))
+    sequence, data, _ = reader.read()
+    # Frames 0 to 3 were overwritten before they were read.
+    assert (reader.overruns, reader.frames_dropped) == (1, 4)
+    assert sequence == 4
+    np.testing.assert_array_equal(data, frames(4, 8))
+
+
+def test_overrun_raises_when_asked():
+    ring = SharedFrameRing.SharedFrameRing(capacity=4, num_channels=2)
+    reader = ring.reader(raise_on_overrun=True)
+    ring.write(frames(0, 3))
+    ring.write(frames(3, 3))
+    try:
+        reader.read()
+    except SharedFrameRing.RingOverrunError:
+        return
+    assert False, 'Expected a RingOverrunError'
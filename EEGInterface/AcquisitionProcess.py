@@ -0,0 +1,185 @@
+"""
+Runs an EEG streamer in its own process, so packet receipt doesn't compete for the GIL with the display, decoding and
+logging of the experiment.
+
+The streamer's live data is published to a CCDLUtil.DataManagement.SharedFrameRing (rather than the out_buffer_queue),
+which any number of readers in the experiment (or in other processes) read without copying or pickling.  Saving runs in
+the acquisition process too.
+
+Usage:
+    acquisition = BrainAmpStreamer.start_in_process(num_channels=32, channels_for_live='All',
+                                                    save_data_file_path='subject.csv')
+    reader = acquisition.reader()
+    while True:
+        sequence, frames, indexes = acquisition.read(reader, timeout=1.0)  # frames is shape (sample, channel)
+        ...
+    acquisition.stop()
+"""
+
+import time
+import ctypes
+import threading
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy as np
+import CCDLUtil.EEGInterface.EEG_INDEX as EEG_INDEX
+import CCDLUtil.DataManagement.SharedFrameRing as SharedFrameRing
+
+# Fields of AcquisitionProcess.stats
+FRAMES_PUBLISHED, BLOCKS_PUBLISHED, LAST_PUBLISH_TIME, MAX_PUBLISH_GAP, OVERFLOWS, PUBLISH_TIME = range(6)
+NUM_STATS = 6
+
+
+class RingPublisher(object):
+
+    def __init__(self, ring, stats, streamer):
+        """
+        Takes the place of the streamer's out_buffer_queue in the acquisition process: items put on it are written to
+        the ring (with the streamer's data_index as the index of each frame).
+
+        :param ring: The SharedFrameRing to publish to.
+        :param stats: Shared array of the publishing statistics (see AcquisitionProcess.get_stats).
+        :param streamer: The streamer (for its data_index and overflow_count).
+        """
+        self.ring, self.stats, self.streamer = ring, stats, streamer
+
+    def put(self, item, block=True, timeout=None):
+        start = time.time()
+        frames = np.asarray(item, dtype=self.ring.dtype)
+        if frames.ndim == 1:
+            frames = frames.reshape((1, -1))
+        self.ring.write(frames, indexes=np.repeat(self.streamer.data_index, len(frames)))
+        now = time.time()
+        if self.stats[LAST_PUBLISH_TIME] > 0:
+            self.stats[MAX_PUBLISH_GAP] = max(self.stats[MAX_PUBLISH_GAP], now - self.stats[LAST_PUBLISH_TIME])
+        self.stats[FRAMES_PUBLISHED] += len(frames)
+        self.stats[BLOCKS_PUBLISHED] += 1
+        self.stats[PUBLISH_TIME] += now - start
+        self.stats[OVERFLOWS] = self.streamer.overflow_count
+        self.stats[LAST_PUBLISH_TIME] = now
+
+    def put_nowait(self, item):
+        self.put(item)
+
+
+def run_streamer(streamer_class, streamer_kwargs, ring, stats, index_clock, stop_event, save_data_file_path, save_binary,
+                 save_kwargs):
+    """
+    The target of the acquisition process.  Creates the streamer, publishes its live data to ring, and saves its data
+    until stop_event is set.
+    """
+    # The streamer records its eeg index in the clock shared with the experiment process.
+    EEG_INDEX.INDEX_CLOCK = index_clock
+    streamer = streamer_class(**streamer_kwargs)
+    streamer.out_buffer_queue = RingPublisher(ring, stats, streamer)
+    if save_data_file_path is not None:
+        if save_binary:
+            streamer.start_saving_binary_data(save_data_file_path, **save_kwargs)
+        else:
+            streamer.start_saving_data_batched(save_data_file_path, **save_kwargs)
+    recording_thread = threading.Thread(target=streamer.start_recording)
+    recording_thread.daemon = True
+    recording_thread.start()
+    stop_event.wait()
+    streamer.stop_recording()
+    streamer.stopped = True
+    streamer.wait_for_saving()
+
+
+class AcquisitionProcess(object):
+
+    def __init__(self, streamer_class, num_channels, capacity=None, dtype=np.float32, save_data_file_path=None,
+                 save_binary=False, save_kwargs=None, **streamer_kwargs):
+        """
+        Starts a streamer in a new process.  See EEGInterfaceParent.start_in_process.
+
+        :param streamer_class: The EEGInterfaceParent child to run (ie. BrainAmpStreamer).  It is created in the new
+                               process, with live=True and streamer_kwargs.
+        :param num_channels: Number of channels the streamer puts on its out_buffer_queue (ie. len(channels_for_live)).
+        :param capacity: Number of frames kept in the ring.  If None, 10 seconds at 500 Hz. Defaults to None
+        :param dtype: dtype of the frames. Defaults to np.float32
+        :param save_data_file_path: If not None, the streamer's data is saved to this file (by the acquisition process).
+        :param save_binary: If True, data is saved with start_saving_binary_data, otherwise with start_saving_data_batched.
+        :param save_kwargs: Optional -- dict of extra arguments for the saving method.
+        """
+        self.ring = SharedFrameRing.SharedFrameRing(capacity=5000 if capacity is None else capacity, num_channels=num_channels,
+                                                    dtype=dtype)
+        self.stats = multiprocessing.sharedctypes.RawArray(ctypes.c_double, NUM_STATS)
+        self.index_clock = EEG_INDEX.EEGIndexClock()
+        self.stop_event = multiprocessing.Event()
+        streamer_kwargs['live'] = True
+        self.process = multiprocessing.Process(target=run_streamer, args=(
+            streamer_class, streamer_kwargs, self.ring, self.stats, self.index_clock, self.stop_event, save_data_file_path,
+            save_binary, save_kwargs if save_kwargs is not None else {}))
+        self.process.daemon = True
+        self.process.start()
+        # Read latency of frames (time from being published to being read), measured by read.
+        self.num_reads, self.total_latency, self.max_latency = 0, 0.0, 0.0
+
+    def reader(self, start_at_oldest=False):
+        """
+        Returns a new SharedFrameReader of the published frames.  Each consumer should have its own reader.
+        """
+        return self.ring.reader(start_at_oldest=start_at_oldest)
+
+    def read(self, reader, max_n=None, timeout=0):
+        """
+        Reads frames with reader (see SharedFrameReader.read), and records the latency of the read for get_stats.
+
+        :return: sequence, frames, indexes
+        """
+        sequence, frames, indexes = reader.read(max_n=max_n, timeout=timeout)
+        if len(frames) > 0:
+            write_time = self.ring.get_write_time(sequence + len(frames) - 1)
+            if write_time is not None:
+                latency = time.time() - write_time
+                self.num_reads += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+        return sequence, frames, indexes
+
+    def get_current_index(self):
+        """
+        Returns the streamer's current eeg index (see EEG_INDEX.EEGIndexClock), or None before the first packet.
+        """
+        return self.index_clock.get_current_index()
+
+    def get_stats(self, reader=None):
+        """
+        :param reader: Optional -- a reader to include the lag and overruns of.
+        :return: dict of statistics:
+                    frames_published, blocks_published - What the streamer put on its out_buffer_queue.
+                    max_publish_gap - Longest time (seconds) between two published blocks - the worst case jitter of
+                                      packet receipt.
+                    mean_publish_time - Mean time (seconds) spent writing a block to the ring.
+                    overflows - Number of overflows reported by the streamer (ie. lost BrainAmp packets).
+                    mean_read_latency, max_read_latency - Time (seconds) from the last frame of a read being published to
+                                                          it being read (measured by read).
+                    reader_lag, reader_overruns, reader_frames_dropped - If a reader is passed.
+        """
+        stats = {'frames_published': int(self.stats[FRAMES_PUBLISHED]), 'blocks_published': int(self.stats[BLOCKS_PUBLISHED]),
+                 'max_publish_gap': self.stats[MAX_PUBLISH_GAP],
+                 'mean_publish_time': self.stats[PUBLISH_TIME] / max(1, self.stats[BLOCKS_PUBLISHED]),
+                 'overflows': int(self.stats[OVERFLOWS]),
+                 'mean_read_latency': self.total_latency / max(1, self.num_reads), 'max_read_latency': self.max_latency}
+        if reader is not None:
+            stats.update({'reader_lag': reader.get_lag(), 'reader_overruns': reader.overruns,
+                          'reader_frames_dropped': reader.frames_dropped})
+        return stats
+
+    def stop(self, timeout=30.0):
+        """
+        Stops the streamer and waits for the acquisition process to save everything left on its data_save_queue and exit.
+
+        :param timeout: Seconds to wait before the process is terminated (losing any data not yet saved).  If None, waits
+                        until the process exits. Defaults to 30
+        :return: True if the process exited by itself, False if it had to be terminated.
+        """
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            print "Acquisition process did not stop within %s seconds - terminating.  The saved data may be incomplete." % timeout
+            self.process.terminate()
+            self.process.join()
+            return False
+        return True
@@ -27,6 +27,8 @@ import Queue
 import numpy as np
 import CCDLUtil.EEGInterface.EEG_INDEX
 import CCDLUtil.EEGInterface.EEGInterface
+import CCDLUtil.SignalProcessing.Filters as CCDLFilters
+from CCDLUtil.EEGInterface.BrainAmp.RDAReceiver import RDAReceiver
 from CCDLUtil.Utility.Decorators import threaded
 import csv
 
@@ -48,14 +50,14 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
     """
 
     def __init__(self, channels_for_live, live=True, save_data=True, subject_name=None, subject_tracking_number=None,
-                 experiment_number=None):
+                 experiment_number=None, receive_buffer_size=2 ** 20, downsample_fs=500, decimator_numtaps=None):
         """
         A data collection object for the EEG interface.  This provides option for live data streaming and saving data to file.
 
         For live data streaming, use with a threading or multiprocessing queue (ie. Queue.queue()
            Data will be put on the queue, which can be read by another thread.)
 
-        Modifies the EEG_INDEX and EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.  These variables can be read from any thread.
+        Sets the eeg index in CCDLUtil/EEGInterface/EEG_INDEX.py (with EEG_INDEX.set_eeg_index) when each packet arrives.  The index can be read from any thread.
             Use this to time mark events in your other programs.
 
         :param channels_for_live: List - a list of channel names (or indexes) to put on the out_buffer_queue. If [], no channels will be put on the out_buffer_queue.
@@ -64,13 +66,23 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         :param out_buffer_queue: The channel listed in the channels_for_live parameter will be placed on this queue. This is intended for live data analysis.
                                  If None, no data will be put on the queue.
                                  Items put on the out buffer queue will be a numpy array (though this can be either a 2D or a 1D numpy array).
-                                 Data put on this queue is downsampled to 500 Hz.  **Data put on this queue is of the shape (sample, channel)**.
+                                 Data put on this queue is downsampled to downsample_fs (500 Hz by default).
+                                 **Data put on this queue is of the shape (sample, channel)**.
 
-                                 10 Samples are put on this queue at a time.  Thus the actual shape will be (10, channel)
+                                 At 500 Hz, 10 Samples are put on this queue at a time.  Thus the actual shape will be (10, channel)
 
         :param subject_name: Optional -- Name of the subject. Defaults to 'None'
         :param subject_tracking_number: Optional -- Subject Tracking Number (AKA TMS group experiment number tracker). Defaults to 'None'
         :param experiment_number: Optional -- Experimental number. Defaults to 'None'
+        :param receive_buffer_size: Size (in bytes) of the preallocated buffer that RDA messages are received into.
+                                    Defaults to 1 MB.
+        :param downsample_fs: Sampling rate (Hz) of the saved and live data.  The amplifier sampling rate must be an
+                              integer multiple of this value. Defaults to 500.
+        :param decimator_numtaps: Length of the anti-aliasing FIR filter used when downsampling.  If None, the
+                                  PolyphaseDecimator default is used. Defaults to None.
+                                  The filter delays the data by (decimator_numtaps - 1) / 2 amplifier samples (20 ms with
+                                  the defaults), so the saved and live samples lag their index and time by
+                                  downsample_delay seconds (which is also written to the saved meta information).
         """
         # Call our EEGInterfaceParent init method.
         super(BrainAmpStreamer, self).__init__(
@@ -89,6 +101,19 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
             print "See CCDLUtil Documentation for instructions on how to run the BrainVision EEG system --"
             time.sleep(1)
             raise
+        self.downsample_fs = downsample_fs
+        self.decimator_numtaps = decimator_numtaps
+        # Created once we know our sampling rate (see first_message_actions).
+        self.decimator = None
+        # Delay (seconds) of the downsampled data relative to its eeg index and time - the group delay of the decimator.
+        # Subtract it from event times (or add it to event indexes) when epoching.  Set by first_message_actions.
+        self.downsample_delay = None
+        # Messages are received into a preallocated buffer and handed out without copying.
+        self.rda_receiver = RDAReceiver(self.con, buffer_size=receive_buffer_size)
+        # (channel_count, resolution vector, channel_dict) from the start message (see handle_message).
+        self.rda_properties = None
+        # If set, overflows are also written to subject_data_path + subject_name + '_Overflow.txt'
+        self.subject_data_path = None
 
     @staticmethod
     def recv_data(socket, requestedSize):
@@ -141,6 +166,8 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
     def get_data(self, rawdata, num_channels):
         """
         Helper function for extracting eeg and marker data from a raw data array
+
+        This decodes one value at a time with struct.  See decode_data for the vectorized version used when recording.
         """
         # read from tcpip socket
 
@@ -155,20 +182,53 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
             data.append(value[0])
 
         # Extract markers
+        markers = BrainAmpStreamer.get_markers(rawdata, 12 + 4 * points * num_channels, markerCount)
+        return block, points, markerCount, data, markers
+
+    @staticmethod
+    def decode_data(rawdata, num_channels, resolutions=None):
+        """
+        Vectorized version of get_data.  The whole eeg payload is read with a single np.frombuffer call rather than
+        one struct.unpack call per value.
+
+        :param rawdata: The data part of an RDA data message (msgtype 4).  Can be a str, bytearray or buffer.
+        :param num_channels: Number of channels, as given by the start message.
+        :param resolutions: Optional -- list or 1D np array of channel resolutions (length num_channels).  If not None,
+                            the data is multiplied by the resolutions (broadcast over the sample axis).  Pass a float32
+                            np array to keep the result in float32.  Defaults to None (unscaled values).
+        :return: block, points, markerCount, data, markers
+                    data is a np array of shape (points, channel) and dtype float32.  If resolutions is None, this is
+                    a read-only view into rawdata.
+        """
+        (block, points, markerCount) = struct.unpack_from('<LLL', rawdata, 0)
+        data = np.frombuffer(rawdata, dtype='<f4', count=points * num_channels, offset=12).reshape((points, num_channels))
+        if resolutions is not None:
+            data = data * np.asarray(resolutions, dtype=np.float32)
+        markers = BrainAmpStreamer.get_markers(rawdata, 12 + 4 * points * num_channels, markerCount)
+        return block, points, markerCount, data, markers
+
+    @staticmethod
+    def get_markers(rawdata, index, marker_count):
+        """
+        Helper function for extracting the markers that follow the eeg data in a data message.
+        :param rawdata: The data part of an RDA data message
+        :param index: Byte offset of the first marker (12 + 4 * points * num_channels)
+        :param marker_count: Number of markers in the message
+        :return: List of Marker objects
+        """
         markers = []
-        index = 12 + 4 * points * num_channels
-        for m in range(markerCount):
-            markersize = struct.unpack('<L', rawdata[index:index+4])
+        for m in range(marker_count):
+            markersize = struct.unpack_from('<L', rawdata, index)
 
             ma = Marker()
-            (ma.position, ma.points, ma.channel) = struct.unpack('<LLl', rawdata[index+4:index+16])
+            (ma.position, ma.points, ma.channel) = struct.unpack_from('<LLl', rawdata, index + 4)
             typedesc = BrainAmpStreamer.split_string(rawdata[index + 16:index + markersize[0]])
             ma.type = typedesc[0]
             ma.description = typedesc[1]
 
             markers.append(ma)
             index = index + markersize[0]
-        return block, points, markerCount, data, markers
+        return markers
 
     @threaded(False)
     def start_recording(self):
@@ -179,66 +239,92 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         print "start recording"
         while True:
             raw_data, msgsize, msgtype = self.get_raw_data()
-            # Perform action dependent on the message type
-            if msgtype == 1:
-                channel_count, sampling_interval, resolutions, channel_names, channel_dict, meta_info_str = self.first_message_actions(raw_data)
-            elif msgtype == 4:
-                # Data message, extract data and markers
-                (block, points, marker_count, data, markers) = self.get_data(raw_data, channel_count)
-                # data is a list of length 3200
-                assert len(data) == 3200
-                # Get the time we collected the sample
-                data_recieve_time = time.time()
-                self.data_index += 1  # Increase our sample counter
-
-                CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX = self.data_index
-                CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX_2 = self.data_index
-
-                ######################
-                # Check for overflow #
-                ######################
-                if self.last_block != -1 and block > self.last_block + 1:
-                    print "*** Index: " + str(self.data_index) + "OVERFLOW with " + str(block - self.last_block) + " datablocks ***"
-                    if self.subject_data_path is not None:
-                        with open(self.subject_data_path + self.subject_name + '_Overflow.txt', 'a') as handle_f:
-                            handle_f.write(str(self.data_index) + '\t' + str(block - self.last_block) + '\n')
-                self.last_block = block
-                self.print_marker_count(markers=marker_count, marker_count=marker_count)
-
-                ###################
-                # Handle the Data #
-                ###################
-                # Save the Data - We put data on the queue to be saved - format for queue (index, time, data)
-                if self.data_save_queue is not None:
-                    downsampled_matrix = self.downsample_all_channels(data=data, resolutions=resolutions)
-                    save_string = self.convert_downsample_matrix_to_save_string(data_index=self.data_index,
-                                                                                data_recieve_time=data_recieve_time, downsampled_matrix=downsampled_matrix)
-                    self.data_save_queue.put((None, None, save_string))
-
-                # The data put on the out buffer queue is downsamled to 500 Hz.
-                if self.live:
-                    self.handle_out_buffer_queue(data, resolutions, channel_count, channel_dict)
-
-            elif msgtype == 3:
-                self.con.close()  # Stop message, terminate program; Close tcpip connection
+            if not self.handle_message(raw_data, msgtype):
                 break
 
-    def convert_downsample_matrix_to_save_string(self, data_index, data_recieve_time, downsampled_matrix):
+    def start_recording_on_loop(self, loop):
+        """
+        The event loop version of start_recording: rather than running a receive loop in a new thread, the RDA socket is
+        watched by loop (a CCDLUtil.Utility.EventLoop.EventLoop) and messages are handled in the loop thread as they
+        arrive.
+        """
+        print "start recording"
+        loop.add_reader(self.con, self._receive_on_loop, loop)
+
+    def _receive_on_loop(self, loop):
+        self.rda_receiver.receive_available()
+        message = self.rda_receiver.pop_message()
+        while message is not None:
+            raw_data, msgsize, msgtype = message
+            if not self.handle_message(raw_data, msgtype):
+                loop.remove_reader(self.con)
+                return
+            message = self.rda_receiver.pop_message()
+
+    def handle_message(self, raw_data, msgtype):
         """
-        converts a downsample matrix of shape(samples, channels) to a string that can be used to save to a file
+        Handles one RDA message.
+
+        :param raw_data: The data part of the message (see get_raw_data)
+        :param msgtype: The message type.  1 is the start message (with our channel properties), 4 a data message and 3 the
+                        stop message.
+        :return: False if the message was a stop message (the connection is then closed), otherwise True.
         """
-        ret_str = ''
-        data_index_str = str(data_index)
-        data_recieve_time_str = str(data_recieve_time)
-        for ii in xrange(downsampled_matrix.shape[0]):
-            ret_str += ','.join([data_index_str, data_recieve_time_str] + map(str, list(downsampled_matrix[ii, :]))) + '\n'
-        return ret_str
-
-    def downsample_all_channels(self, data, resolutions):
+        # Perform action dependent on the message type
+        if msgtype == 1:
+            channel_count, sampling_interval, resolutions, channel_names, channel_dict, meta_info_str = self.first_message_actions(raw_data)
+            # Kept for the data messages that follow.
+            self.rda_properties = channel_count, np.asarray(resolutions, dtype=np.float32), channel_dict
+        elif msgtype == 4:
+            channel_count, resolution_vector = self.rda_properties[:2]
+            # Data message, extract data and markers.  data is shape (points, channel), scaled by our resolutions.
+            (block, points, marker_count, data, markers) = self.decode_data(raw_data, channel_count, resolution_vector)
+            # Get the time we collected the sample
+            data_recieve_time = time.time()
+            self.data_index += 1  # Increase our sample counter
+
+            CCDLUtil.EEGInterface.EEG_INDEX.set_eeg_index(self.data_index, timestamp=data_recieve_time)
+
+            ######################
+            # Check for overflow #
+            ######################
+            if self.last_block != -1 and block > self.last_block + 1:
+                print "*** Index: " + str(self.data_index) + "OVERFLOW with " + str(block - self.last_block) + " datablocks ***"
+                self.overflow_count += 1
+                if self.subject_data_path is not None:
+                    with open(self.subject_data_path + self.subject_name + '_Overflow.txt', 'a') as handle_f:
+                        handle_f.write(str(self.data_index) + '\t' + str(block - self.last_block) + '\n')
+            self.last_block = block
+            self.print_marker_count(markers=marker_count, marker_count=marker_count)
+
+            ###################
+            # Handle the Data #
+            ###################
+            # We downsample each packet once and use the result for both saving and live data.
+            # The decimator keeps state between packets, so this must be called for every packet.
+            downsampled_matrix = self.downsample_all_channels(data=data)
+            # Save the Data - We put data on the queue to be saved - format for queue (index, time, data)
+            # The matrix is converted to text (or binary) by the saving thread, not here.
+            if self.data_save_queue is not None:
+                self.data_save_queue.put((self.data_index, data_recieve_time, downsampled_matrix))
+
+            # The data put on the out buffer queue is downsampled to downsample_fs.
+            if self.live:
+                self.handle_out_buffer_queue(downsampled_matrix)
+
+        elif msgtype == 3:
+            self.con.close()  # Stop message, terminate program; Close tcpip connection
+            return False
+        return True
+
+    def downsample_all_channels(self, data):
         """
-        Downsamples our data from 5000 Hz to 500 Hz for all channels
-        :param data: One data packet for 32 channels.
-        :param resolutions: Our resolutions
+        Downsamples our data from 5000 Hz to 500 Hz (or, more generally, to downsample_fs) for all channels
+
+        The data is low pass filtered before samples are dropped (see CCDLUtil.SignalProcessing.Filters.PolyphaseDecimator)
+        to avoid aliasing.  The filter keeps its state between packets, so every packet must be passed through this method
+        exactly once and in order.  The filter delays the data by self.downsample_delay seconds.
+        :param data: One data packet for all channels, shape (100, channel), already scaled by our resolutions.
         :return: A matrix of shape 10 by 32.  That is 10 samples for 32 channels.
         """
         # We sample at 5000 Hz.  We want to down sample to 500 hz.  We collect data in packets of 100 samples
@@ -247,49 +333,26 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         # Because we want to sample at 500 Hz, we need to take 10x as many samples, so for every packet,
         # we need to collect 10 data points out of the 100 (aka, we need to collect every 10th data point)
 
-        indexes_needed = range(0, 100, 10)
         # Shape is (Samples, Channels)
-        channels = np.zeros((len(indexes_needed), len(resolutions)))
-        for ii, resolution in enumerate(resolutions):
-            # TODO: document this change
-            channel_data = [data[index * 32 + ii] * resolution for index in indexes_needed]
-            channels[:, ii] = np.asarray(channel_data)
-        return channels
-
-    def handle_out_buffer_queue(self, data, resolutions, channel_count, channel_dict):
+        return self.decimator.decimate(data)
+
+    def handle_out_buffer_queue(self, downsampled_matrix):
         """
-        Puts every 10th sample on the out_buffer_queue (downsampling to 500 Hz)
+        Puts the channels_for_live channels of our downsampled packet on the out_buffer_queue
         Number of channels: 32
         Sampling Rate [Hz]: 5000
         Sampling Interval [micro seconds]: 200  (0.0002 seconds; 5000 Hz)
 
         Packet size = 100 samples
         Packet arrival = 50 Hz
-        """
-        # We sample at 5000 Hz.  We want to down sample to 500 hz.  We collect data in packets of 100 samples
-        # at 50 Hz. 100 * 50 = 5000
-        # If we took a single sample from each packet, we would be sampling at 50 Hz.
-        # Because we want to sample at 500 Hz, we need to take 10x as many samples, so for every packet,
-        # we need to collect 10 data points out of the 100 (aka, we need to collect every 10th data point)
 
-        # 100 is the number of samples we get once
-        indexes_needed = range(0, 100, 10)
-        # Shape is (Samples, Channels)
-        # size is correct: 10 x 1
-        channels = np.zeros((len(indexes_needed), len(self.channels_for_live)))
-        for ii, ch in enumerate(self.channels_for_live):
-            # Get the channel index
-            if type(ch) is str:
-                channel_index = channel_dict[ch]
-            else:
-                channel_index = ch
-            # Get our resolution for this channel (0.5)
-            resolution = resolutions[channel_index]
-            # TODO: doucment this change -- fixed the indexing of channel data
-            channel_data = [data[index * 32 + channel_index] * resolution for index in indexes_needed]
-            channels[:, ii] = np.asarray(channel_data)
+        :param downsampled_matrix: One downsampled data packet for all channels, shape (sample, channel).
+                                   See downsample_all_channels.  The channels_for_live channels are selected by
+                                   self.channel_router (resolved when the start message arrives).
+        """
         # Put our numpy array of channels on the queue.  Channels shape -> [samples (10), channel]
-        self.out_buffer_queue.put(channels)
+        # The matrix is also put on the data_save_queue, so the live consumer gets its own copy.
+        self.out_buffer_queue.put(self.channel_router.select('live', downsampled_matrix, copy=True))
 
     @staticmethod
     def print_marker_count(markers, marker_count):
@@ -326,13 +389,18 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         self.last_block = -1
 
         sampling_interval_seconds = sampling_interval * 10.0 ** -6
+        # A new decimator (with cleared filter state) for each start message.
+        self.decimator = CCDLFilters.PolyphaseDecimator(fs=1000000.0 / sampling_interval, target_fs=self.downsample_fs,
+                                                        numtaps=self.decimator_numtaps)
+        self.downsample_delay = self.decimator.delay * sampling_interval_seconds
         meta_info_str = "Subject Name,\t" + str(self.subject_name) + \
                         "\nSubject Tracking Number,\t" + str(self.subject_number) + \
                         "\nExperiment Number,\t" + str(self.experiment_number) + \
                         "\nNumber of channels,\t" + str(channel_count) + \
                         "\nSampling interval,\t" + str(sampling_interval) + ' microseconds (' + str(sampling_interval_seconds) + ' seconds)' + \
                         '\nOriginal Sampling Frequency,\t' + str(1.0 / sampling_interval_seconds) + ' Hz' + \
-                        '\nDownsampled Sampling Frequency,\t' + str(500) + ' Hz' + \
+                        '\nDownsampled Sampling Frequency,\t' + str(self.downsample_fs) + ' Hz' + \
+                        '\nDownsampling Filter Delay,\t' + str(self.downsample_delay) + ' seconds' + \
                         "\nResolutions,\t,\t" + str(resolutions) + \
                         "\nChannel Names,\t,\t" + str(channel_names)
         if self.data_save_queue is not None:
@@ -341,18 +409,20 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
             print meta_info_str
 
         channel_dict = dict(zip(channel_names, range(channel_count)))
+        # Resolve channel names to indexes once, rather than for every packet.
+        self.channel_router.resolve(channel_names=channel_names)
+        # For the header of binary recordings.  The saved data is already scaled by the resolutions.
+        self.save_channel_names, self.save_fs, self.save_resolutions = channel_names, self.downsample_fs, resolutions
         return channel_count, sampling_interval, resolutions, channel_names, channel_dict, meta_info_str
 
     def get_raw_data(self):
-        # Get message header as raw array of chars
-        raw_hdr = BrainAmpStreamer.recv_data(self.con, 24)
-
-        # Split array into usefull information id1 to id4 are constants
-        (id1, id2, id3, id4, msgsize, msgtype) = struct.unpack('<llllLL', raw_hdr)
+        """
+        Receives the next RDA message.
 
-        # Get data part of message, which is of variable size
-        raw_data = BrainAmpStreamer.recv_data(self.con, msgsize - 24)
-        return raw_data, msgsize, msgtype
+        The returned raw_data is a view into our receive buffer (see RDAReceiver) and is only valid until the next call.
+        :return: raw_data, msgsize, msgtype
+        """
+        return self.rda_receiver.next_message()
 
 
 if __name__ == '__main__':
@@ -44,7 +44,7 @@ class BrainAmpSyntheticDataGenerator(object):
         For live data streaming, use with a threading or multiprocessing queue (ie. Queue.queue().
            Data will be put on the queue, which can be read by another thread.)
 
-        Modifies the EEG_INDEX and EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.  These variables can be read from any thread.
+        Sets the eeg index in CCDLUtil/EEGInterface/EEG_INDEX.py (with EEG_INDEX.set_eeg_index) when each packet arrives.  The index can be read from any thread.
             Use this to time mark events in your other programs.
 
         :param subject_data_path: Path to save the save the data.  If None, no data will be saved.
@@ -99,8 +99,7 @@ class BrainAmpSyntheticDataGenerator(object):
             data_recieve_time = time.time()
             self.data_index += 1  # Increase our sample counter
 
-            EEGInterface.EEG_INDEX.EEG_INDEX = self.data_index
-            EEGInterface.EEG_INDEX.EEG_INDEX_2 = self.data_index
+            EEGInterface.EEG_INDEX.set_eeg_index(self.data_index)
 
             ###################
             # Handle the Data #
@@ -0,0 +1,127 @@
+"""
+Compares the threaded mode (start_recording and start_saving_data, each in their own thread) of the BrainAmpStreamer with
+the event loop mode (start_recording_on_loop and save_data_on_loop, sharing one CCDLUtil.Utility.EventLoop thread).
+
+A synthetic BrainVision Recorder is served on the RDA port (localhost:51244, so the Recorder must not be running),
+sending 32 channel packets of 100 points at 50 Hz.  For each mode, we measure the latency from a packet being sent to its
+(downsampled) data being read from the out_buffer_queue, and the CPU time used by the process.
+
+Usage:
+    python EventLoopBenchmark.py [seconds_per_mode]
+"""
+
+import os
+import sys
+import time
+import socket
+import struct
+import tempfile
+import threading
+import numpy as np
+from CCDLUtil.Utility.EventLoop import EventLoop
+from CCDLUtil.EEGInterface.BrainAmp.BrainAmpInterface import BrainAmpStreamer
+from CCDLUtil.EEGInterface.BrainAmp.RDADecodingBenchmark import build_start_message_body, build_data_message_body
+
+RDA_PORT = 51244
+NUM_CHANNELS = 32
+POINTS = 100
+PACKET_INTERVAL = 0.02
+
+
+def rda_message(msgtype, body):
+    """
+    Adds the 24 byte RDA header to a message body.
+    """
+    return struct.pack('<llllLL', 0, 0, 0, 0, 24 + len(body), msgtype) + body
+
+
+class SyntheticRecorder(object):
+
+    def __init__(self, duration):
+        """
+        Serves one connection on the RDA port, sending data messages every PACKET_INTERVAL seconds for duration seconds.
+        send_times[ii] is the time data message ii was sent.
+        """
+        self.duration = duration
+        self.send_times = []
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('localhost', RDA_PORT))
+        self.listener.listen(1)
+        threading.Thread(target=self.serve).start()
+
+    def serve(self):
+        con, _ = self.listener.accept()
+        self.listener.close()
+        con.sendall(rda_message(1, build_start_message_body([0.1] * NUM_CHANNELS, ['Ch%d' % ii for ii in xrange(NUM_CHANNELS)])))
+        packets = [rda_message(4, build_data_message_body(block, np.random.randn(POINTS, NUM_CHANNELS) * 100))
+                   for block in xrange(16)]
+        start = time.time()
+        block = 0
+        while time.time() - start < self.duration:
+            next_time = start + block * PACKET_INTERVAL
+            time.sleep(max(0.0, next_time - time.time()))
+            # Patch the block counter so the streamer doesn't report an overflow.
+            packet = packets[block % len(packets)]
+            packet = packet[:24] + struct.pack('<L', block) + packet[28:]
+            self.send_times.append(time.time())
+            con.sendall(packet)
+            block += 1
+        con.sendall(rda_message(3, ''))
+        con.close()
+
+
+def consume(out_buffer_queue, receive_times):
+    # A blocking get - in Python 2, get with a timeout polls (sleeping up to 50 ms), which would add to the latency.
+    while out_buffer_queue.get() is not None:
+        receive_times.append(time.time())
+
+
+def run_mode(use_event_loop, duration):
+    """
+    Streams for duration seconds.
+    :return: latencies (seconds, one per packet), cpu fraction (of one core)
+    """
+    recorder = SyntheticRecorder(duration)
+    streamer = BrainAmpStreamer(channels_for_live='All', live=True, save_data=True)
+    save_file_path = os.path.join(tempfile.gettempdir(), 'event_loop_benchmark.csv')
+    receive_times = []
+    consumer = threading.Thread(target=consume, args=(streamer.out_buffer_queue, receive_times))
+    consumer.start()
+    cpu_start, wall_start = sum(os.times()[:2]), time.time()
+    if use_event_loop:
+        loop = EventLoop()
+        streamer.start_recording_on_loop(loop)
+        streamer.save_data_on_loop(loop, save_file_path)
+        loop.start()
+    else:
+        streamer.start_recording()
+        streamer.start_saving_data(save_file_path)
+    time.sleep(duration + 0.5)
+    cpu, wall = sum(os.times()[:2]) - cpu_start, time.time() - wall_start
+    streamer.stopped = True
+    streamer.out_buffer_queue.put(None)
+    if use_event_loop:
+        time.sleep(0.2)
+        loop.stop()
+    else:
+        # Wake the saving thread up so it sees stopped.
+        streamer.data_save_queue.put((None, None, ''))
+    consumer.join()
+    os.remove(save_file_path)
+    num_packets = min(len(receive_times), len(recorder.send_times))
+    latencies = np.asarray(receive_times[:num_packets]) - np.asarray(recorder.send_times[:num_packets])
+    return latencies, cpu / wall
+
+
+def run_benchmark(duration):
+    print 'Streaming %d channels x %d points at %d packets/s for %.0f s per mode' % (NUM_CHANNELS, POINTS, 1 / PACKET_INTERVAL, duration)
+    for name, use_event_loop in [('threaded', False), ('event loop', True)]:
+        latencies, cpu = run_mode(use_event_loop, duration)
+        print '%-12s packets %5d   latency mean %6.2f ms  p95 %6.2f ms  max %6.2f ms   cpu %5.1f%%' % (
+            name, len(latencies), 1000 * np.mean(latencies), 1000 * np.percentile(latencies, 95), 1000 * np.max(latencies),
+            100 * cpu)
+
+
+if __name__ == '__main__':
+    run_benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 10.0)
@@ -0,0 +1,113 @@
+"""
+Compares the per-value struct decoding of RDA data messages (BrainAmpStreamer.get_data) with the vectorized
+np.frombuffer decoding (BrainAmpStreamer.decode_data).
+
+Usage:
+    python RDADecodingBenchmark.py [capture_file_path]
+
+If a capture file is passed, it must contain the raw RDA byte stream as sent by the BrainVision Recorder (header and data
+messages back to back).  Such a file can be recorded by connecting to the 32 Bit RDA port and writing everything that
+arrives to disk, for example:
+
+    nc localhost 51244 > capture.rda
+
+If no capture file is passed, 32 channel packets of 100 points are synthesized in the same format.
+"""
+
+import sys
+import struct
+import timeit
+import numpy as np
+from CCDLUtil.EEGInterface.BrainAmp.BrainAmpInterface import BrainAmpStreamer
+
+
+def build_start_message_body(resolutions, channel_names, sampling_interval=200.0):
+    """
+    Builds the data part of an RDA start message (msgtype 1).
+    """
+    body = struct.pack('<Ld', len(resolutions), sampling_interval)
+    body += struct.pack('<%dd' % len(resolutions), *resolutions)
+    body += ''.join([name + '\x00' for name in channel_names])
+    return body
+
+
+def build_data_message_body(block, data):
+    """
+    Builds the data part of an RDA data message (msgtype 4) without markers.
+    :param block: Block counter
+    :param data: np array of shape (points, channel)
+    """
+    points = data.shape[0]
+    return struct.pack('<LLL', block, points, 0) + np.asarray(data, dtype='<f4').tostring()
+
+
+def load_recorded_frames(capture_file_path):
+    """
+    Splits a raw RDA capture into messages.
+    :param capture_file_path: Path to the capture file.
+    :return: channel_count, resolutions, list of data message bodies
+    """
+    with open(capture_file_path, 'rb') as f:
+        stream = f.read()
+    channel_count, resolutions, bodies = None, None, []
+    index = 0
+    while index + 24 <= len(stream):
+        (id1, id2, id3, id4, msgsize, msgtype) = struct.unpack_from('<llllLL', stream, index)
+        if index + msgsize > len(stream):
+            break  # The capture ends with an incomplete message.
+        body = stream[index + 24:index + msgsize]
+        if msgtype == 1:
+            channel_count, sampling_interval, resolutions, channel_names = BrainAmpStreamer.get_properties(body)
+        elif msgtype == 4 and channel_count is not None:
+            bodies.append(body)
+        index += msgsize
+    if channel_count is None:
+        raise ValueError('No start message found in %s' % capture_file_path)
+    return channel_count, resolutions, bodies
+
+
+def synthesize_frames(num_frames=250, channel_count=32, points=100):
+    """
+    Creates data message bodies similar to what the BrainAmp sends (32 channels, 100 points per packet).
+    :return: channel_count, resolutions, list of data message bodies
+    """
+    resolutions = [0.5] * channel_count
+    bodies = [build_data_message_body(block, np.random.randn(points, channel_count) * 100)
+              for block in xrange(num_frames)]
+    return channel_count, resolutions, bodies
+
+
+def run_benchmark(channel_count, resolutions, bodies, repeats=3):
+    """
+    Times both decoders over all bodies and prints the packets per second of each.
+    """
+    # get_data is an instance method. We don't need a connection to the recorder to call it.
+    streamer = BrainAmpStreamer.__new__(BrainAmpStreamer)
+    # Make sure both decoders agree before timing them.
+    block, points, marker_count, data, markers = streamer.get_data(bodies[0], channel_count)
+    expected = np.asarray(data).reshape((points, channel_count)) * np.asarray(resolutions)
+    vectorized = BrainAmpStreamer.decode_data(bodies[0], channel_count, np.asarray(resolutions, dtype=np.float32))[3]
+    assert np.allclose(expected, vectorized, rtol=1e-5), 'Decoders disagree'
+
+    def per_value():
+        for body in bodies:
+            data = streamer.get_data(body, channel_count)[3]
+            [data[ii * channel_count + jj] * resolutions[jj] for ii in xrange(points) for jj in xrange(channel_count)]
+
+    resolution_vector = np.asarray(resolutions, dtype=np.float32)
+
+    def vectorized():
+        for body in bodies:
+            BrainAmpStreamer.decode_data(body, channel_count, resolution_vector)
+
+    print 'Decoding %d packets of shape (%d, %d)' % (len(bodies), points, channel_count)
+    for name, fn in [('struct per value', per_value), ('np.frombuffer', vectorized)]:
+        best = min(timeit.repeat(fn, number=1, repeat=repeats))
+        print '%-18s %10.1f packets/s  (%.3f ms/packet)' % (name, len(bodies) / best, 1000.0 * best / len(bodies))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run_benchmark(*load_recorded_frames(sys.argv[1]))
+    else:
+        run_benchmark(*synthesize_frames())
@@ -0,0 +1,119 @@
+"""
+Receive layer for the RDA tcpip interface of the BrainVision Recorder.
+
+Messages are received with recv_into directly into one preallocated bytearray, and are handed out as zero-copy buffer
+objects (rather than building each message up with string concatenation).  At 5 kHz x 32 channels this avoids
+allocating two new strings for every packet.
+
+Each RDA message starts with a 24 byte header:
+    id1, id2, id3, id4 (constants), msgsize (size of the whole message, including the header), msgtype
+"""
+
+import struct
+
+
+class RDAReceiver(object):
+
+    HEADER_SIZE = 24
+
+    def __init__(self, con, buffer_size=2 ** 20):
+        """
+        Reads RDA messages from a connected socket.
+
+        The internal buffer is used as a ring: data is received at the write index and messages are handed out from the
+        read index.  When the next message would run past the end of the buffer, the (partially received) message is
+        moved to the front of the buffer and receiving continues from there.  Only this partial message is ever copied.
+
+        :param con: A connected socket (ie. BrainAmpStreamer.con)
+        :param buffer_size: Size of the internal buffer in bytes.  Must be larger than the largest message
+                            (a 100 point, 32 channel data message is 12,836 bytes). Defaults to 1 MB.
+        """
+        self.con = con
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        # Data in self.buffer[read_index:write_index] has been received but not yet handed out.
+        self.read_index = 0
+        self.write_index = 0
+
+    def next_message(self):
+        """
+        Blocks until a full message has been received.
+
+        The returned data is a view into the internal buffer.  It is only valid until the following call to
+        next_message, so copy anything that needs to be kept (BrainAmpStreamer.decode_data with resolutions already
+        returns a new array).
+
+        :return: raw_data, msgsize, msgtype -- the same as BrainAmpStreamer.get_raw_data.  raw_data is a read-only buffer
+                 object of the data part of the message (the header is not included).
+        """
+        self._fill(RDAReceiver.HEADER_SIZE)
+        (id1, id2, id3, id4, msgsize, msgtype) = struct.unpack_from('<llllLL', self.buffer, self.read_index)
+        if msgsize < RDAReceiver.HEADER_SIZE:
+            raise RuntimeError('Invalid RDA message size: %d' % msgsize)
+        self._fill(msgsize)
+        raw_data = buffer(self.buffer, self.read_index + RDAReceiver.HEADER_SIZE, msgsize - RDAReceiver.HEADER_SIZE)
+        self.read_index += msgsize
+        return raw_data, msgsize, msgtype
+
+    def receive_available(self):
+        """
+        Receives once from the socket - the non blocking counterpart of next_message, for when the socket is known to be
+        readable (ie. in an EventLoop reader callback).  Complete messages are then taken with pop_message.
+
+        :return: Number of bytes received.
+        """
+        if self.read_index == self.write_index:
+            self.read_index = self.write_index = 0
+        # Make sure the message being received fits in the rest of the buffer.
+        needed = RDAReceiver.HEADER_SIZE
+        if self.write_index - self.read_index >= RDAReceiver.HEADER_SIZE:
+            needed = max(needed, struct.unpack_from('<L', self.buffer, self.read_index + 16)[0])
+        if self.read_index + needed > len(self.buffer) or self.write_index == len(self.buffer):
+            self._wrap(needed)
+        num_bytes = self.con.recv_into(self.view[self.write_index:], len(self.buffer) - self.write_index)
+        if num_bytes == 0:
+            raise RuntimeError("connection broken")
+        self.write_index += num_bytes
+        return num_bytes
+
+    def pop_message(self):
+        """
+        Returns the next message if it has been received completely, otherwise None.  See next_message.
+        """
+        pending = self.write_index - self.read_index
+        if pending < RDAReceiver.HEADER_SIZE:
+            return None
+        (id1, id2, id3, id4, msgsize, msgtype) = struct.unpack_from('<llllLL', self.buffer, self.read_index)
+        if msgsize < RDAReceiver.HEADER_SIZE:
+            raise RuntimeError('Invalid RDA message size: %d' % msgsize)
+        if pending < msgsize:
+            return None
+        raw_data = buffer(self.buffer, self.read_index + RDAReceiver.HEADER_SIZE, msgsize - RDAReceiver.HEADER_SIZE)
+        self.read_index += msgsize
+        return raw_data, msgsize, msgtype
+
+    def _fill(self, needed):
+        """
+        Receives from the socket until at least needed bytes are available at the read index.
+        """
+        if self.read_index == self.write_index:
+            # Nothing is pending, so we can start from the front of the buffer without copying anything.
+            self.read_index = self.write_index = 0
+        while self.write_index - self.read_index < needed:
+            if self.read_index + needed > len(self.buffer):
+                self._wrap(needed)
+            num_bytes = self.con.recv_into(self.view[self.write_index:], len(self.buffer) - self.write_index)
+            if num_bytes == 0:
+                raise RuntimeError("connection broken")
+            self.write_index += num_bytes
+
+    def _wrap(self, needed):
+        """
+        Moves the pending bytes to the front of the buffer.
+        """
+        if needed > len(self.buffer):
+            raise ValueError('RDA message of %d bytes does not fit in a %d byte receive buffer' % (needed, len(self.buffer)))
+        pending = self.write_index - self.read_index
+        # Copy through a temporary string as the source and destination may overlap.
+        self.buffer[0:pending] = self.view[self.read_index:self.write_index].tobytes()
+        self.read_index, self.write_index = 0, pending
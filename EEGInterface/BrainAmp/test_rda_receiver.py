@@ -0,0 +1,63 @@
+import struct
+from CCDLUtil.EEGInterface.BrainAmp.RDAReceiver import RDAReceiver
+
+
+class FakeSocket(object):
+
+    def __init__(self, stream, recv_sizes):
+        """
+        Hands out stream in pieces of recv_sizes bytes (cycling), like a socket receiving fragmented tcp packets.
+        """
+        self.stream, self.recv_sizes, self.position, self.num_recvs = stream, recv_sizes, 0, 0
+
+    def recv_into(self, view, nbytes):
+        size = min(nbytes, self.recv_sizes[self.num_recvs % len(self.recv_sizes)], len(self.stream) - self.position)
+        view[:size] = self.stream[self.position:self.position + size]
+        self.position += size
+        self.num_recvs += 1
+        return size
+
+
+def rda_message(msgtype, body):
+    return struct.pack('<llllLL', 1, 2, 3, 4, 24 + len(body), msgtype) + body
+
+
+def test_fragmented_messages_wrap_the_buffer():
+    bodies = [chr(ii % 256) * (37 * ii % 150) for ii in range(200)]
+    stream = ''.join([rda_message(ii % 5, body) for ii, body in enumerate(bodies)])
+    receiver = RDAReceiver(FakeSocket(stream, [1, 7, 300, 24, 61]), buffer_size=400)
+    for ii, body in enumerate(bodies):
+        raw_data, msgsize, msgtype = receiver.next_message()
+        assert (str(raw_data), msgsize, msgtype) == (body, 24 + len(body), ii % 5)
+
+
+def test_broken_connection_raises():
+    receiver = RDAReceiver(FakeSocket(rda_message(4, 'abc')[:20], [100]))
+    try:
+        receiver.next_message()
+    except RuntimeError:
+        return
+    assert False, 'Expected a RuntimeError'
+
+
+def test_message_larger_than_buffer_raises():
+    receiver = RDAReceiver(FakeSocket(rda_message(4, 'x' * 200), [1000]), buffer_size=100)
+    try:
+        receiver.next_message()
+    except ValueError:
+        return
+    assert False, 'Expected a ValueError'
+
+
+def test_receive_available_and_pop_message():
+    bodies = [chr(ii % 256) * (53 * ii % 170) for ii in range(150)]
+    stream = ''.join([rda_message(4, body) for body in bodies])
+    receiver = RDAReceiver(FakeSocket(stream, [3, 90, 24, 250]), buffer_size=400)
+    received = []
+    while len(received) < len(bodies):
+        receiver.receive_available()
+        message = receiver.pop_message()
+        while message is not None:
+            received.append(str(message[0]))
+            message = receiver.pop_message()
+    assert received == bodies
@@ -0,0 +1,97 @@
+"""
+Channel selection for the EEG streamers.
+
+Each destination of the data (the out_buffer_queue, the data_save_queue, misc queues...) is a route with its own channel
+list.  Channel names are resolved to an index array once, when the channel names are known (ie. when the BrainAmp sends
+its header), so routing a packet is a single fancy indexing call per route.
+"""
+
+import numpy as np
+
+
+class ChannelRouter(object):
+
+    def __init__(self):
+        """
+        Maps route names to the channels each route wants.  Add routes with add_route, then call resolve before select.
+        """
+        self.route_channels = {}
+        # route name -> np index array, or None for all channels
+        self.route_indexes = {}
+        self.resolved = False
+
+    def add_route(self, name, channels):
+        """
+        Adds (or replaces) a route.
+
+        :param name: Name of the route (ie. 'live').
+        :param channels: 'All' (case is ignored) for all channels, a list of channel names (or indexes), or [] or None for
+                         no channels.
+        """
+        if isinstance(channels, str) and channels.lower().strip() != 'all':
+            raise ValueError('Invalid channels for route %s: %s' % (name, channels))
+        self.route_channels[name] = channels
+        self.resolved = False
+
+    def resolve(self, channel_names=None, num_channels=None):
+        """
+        Resolves the channels of every route to index arrays.  Call again if the channel names change.
+
+        :param channel_names: List of the channel names of the data, in order. If None, routes must use channel indexes.
+        :param num_channels: Number of channels of the data, used to check the channel indexes. If None, the length of
+                             channel_names (if given).
+        """
+        channel_dict = {} if channel_names is None else dict(zip(channel_names, range(len(channel_names))))
+        if num_channels is None and channel_names is not None:
+            num_channels = len(channel_names)
+        self.route_indexes = {}
+        for name, channels in self.route_channels.items():
+            if isinstance(channels, str):
+                self.route_indexes[name] = None
+                continue
+            indexes = []
+            for ch in channels if channels is not None else []:
+                if isinstance(ch, str):
+                    if ch not in channel_dict:
+                        raise ValueError('Unknown channel %s for route %s' % (ch, name))
+                    ch = channel_dict[ch]
+                if num_channels is not None and not -num_channels <= ch < num_channels:
+                    raise ValueError('Channel index %d out of range for route %s' % (ch, name))
+                indexes.append(ch)
+            self.route_indexes[name] = np.asarray(indexes, dtype=np.intp)
+        self.resolved = True
+
+    def is_resolved(self):
+        """
+        Returns True if resolve was called after the last route was added.
+        """
+        return self.resolved
+
+    def has_channels(self, name):
+        """
+        Returns True if the route selects at least one channel.
+        """
+        indexes = self.route_indexes[name]
+        return indexes is None or len(indexes) > 0
+
+    def get_indexes(self, name):
+        """
+        Returns the index array of the route, or None if it takes all channels.
+        """
+        return self.route_indexes[name]
+
+    def select(self, name, data, copy=False):
+        """
+        Selects the channels of a route.
+
+        :param name: Name of the route.
+        :param data: A block of shape (sample, channel), or a single sample (np array or list) of shape (channel,).
+        :param copy: If True, the result never shares memory with data (ie. when data is also put on another queue and
+                     the consumer may modify it). Defaults to False
+        :return: data (unchanged) if the route takes all channels (and copy is False), otherwise a np array of the
+                 selected channels.
+        """
+        indexes = self.route_indexes[name]
+        if indexes is None:
+            return np.array(data) if copy else data
+        return np.asarray(data)[..., indexes]
@@ -4,11 +4,23 @@ threading.Thread(target=lambda: EEGDataSaver.start_eeg_data_saving(subject_data_
 
 """
 
+import os
 import sys
 import time
 import Queue
+import threading
+import numpy as np
 from CCDLUtil.Utility.Decorators import threaded
+from CCDLUtil.Utility.EventLoop import EventLoop
 import CCDLUtil.DataManagement.StringParser as StringParser
+import CCDLUtil.DataManagement.QueueManagement as QueueManagement
+import CCDLUtil.EEGInterface.ChannelRouter as ChannelRouter
+import CCDLUtil.DataManagement.EEGRecording as EEGRecording
+import CCDLUtil.EEGInterface.AcquisitionProcess as AcquisitionProcess
+
+# % format of each data point written by format_save_items, by dtype.  '%.8g' writes float32 data as str() does (0.1 is
+# written as 0.1 rather than 0.100000001), and '%.12g' writes float64 data as str() does for python floats.
+SAVE_FLOAT_FORMATS = {np.dtype(np.float32): '%.8g', np.dtype(np.float64): '%.12g'}
 
 
 class EEGInterfaceParent(object):
@@ -18,13 +30,13 @@ class EEGInterfaceParent(object):
     """
 
     def __init__(self, channels_for_live='All', live=True, save_data=True, subject_name=None,
-                 subject_tracking_number=None, experiment_number=None):
+                 subject_tracking_number=None, experiment_number=None, live_block_size=None, live_block_latency=0.02):
         """
         A data collection object for the EEG interface.
         This provides option for live data streaming and saving data to file.
 
-        Modifies the EEG_INDEX and EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.
-        These variables can be read from any thread. Use this to time mark events in your other programs.
+        Sets the eeg index in CCDLUtil/EEGInterface/EEG_INDEX.py (with EEG_INDEX.set_eeg_index) when each packet arrives.
+        The index can be read from any thread. Use EEG_INDEX.get_eeg_index_at to time mark events in your other programs.
 
         :param channels_for_live: List of channel names (or indexes) to put on the out_buffer_queue. If [], no channels
                     will be put on the out_buffer_queue. If 'All' (case is ignored), all channels will be placed on the
@@ -34,6 +46,11 @@ class EEGInterfaceParent(object):
         :param subject_name: Optional -- Name of the subject. Defaults to 'None'
         :param subject_tracking_number: Optional -- Subject Tracking Number (AKA TMS group experiment number tracker). Defaults to 'None'
         :param experiment_number: Optional -- Experimental number. Defaults to 'None'
+        :param live_block_size: Optional -- If not None, out_buffer_queue is a QueueManagement.BatchQueue that hands
+                    samples to the consumer in blocks of up to live_block_size samples (shape (sample, channel)) rather
+                    than one item per put. Defaults to None
+        :param live_block_latency: Maximum time (seconds) a sample is held back to fill a block when live_block_size is
+                    set. Defaults to 0.02
         """
 
         self.subject_name = str(subject_name) if subject_name is not None else "None"
@@ -45,7 +62,12 @@ class EEGInterfaceParent(object):
         self.live = live
         self.save_data = save_data
         # A separate queue (other than the one for storing data) that puts the channels_for_live data points on
-        self.out_buffer_queue = Queue.Queue() if live else None
+        if not live:
+            self.out_buffer_queue = None
+        elif live_block_size is not None:
+            self.out_buffer_queue = QueueManagement.BatchQueue(max_block_size=live_block_size, max_latency=live_block_latency)
+        else:
+            self.out_buffer_queue = Queue.Queue()
         # block counter to check overflows of tcpip buffer
         self.last_block = -1
         self.channels_for_live = channels_for_live
@@ -53,9 +75,24 @@ class EEGInterfaceParent(object):
             self.channels_for_live = self.channels_for_live.lower()
             if self.channels_for_live != 'all':
                 raise ValueError('Invalid channels_for_live parameter')
+        # Selects the channels for each queue. Children add their routes and resolve them once the channels are known.
+        self.channel_router = ChannelRouter.ChannelRouter()
+        self.channel_router.add_route('live', self.channels_for_live)
         # create data save queue
         self.data_save_queue = Queue.Queue() if save_data else None
         self.stopped = False
+        # Set by the savers once everything on the data_save_queue is written to disk (see wait_for_saving).  None if no
+        # saver was started.
+        self.save_finished = None
+        # Largest number of items seen waiting on the data_save_queue by start_saving_data_batched.
+        self.max_save_backlog = 0
+        # Number of times the device reported (or we detected) lost packets.
+        self.overflow_count = 0
+        # Channel names, sampling rate and resolutions of the data put on the data_save_queue.  These are set by the child
+        # once known and are written to the header when saving in the binary format (see start_saving_binary_data).
+        self.save_channel_names = None
+        self.save_fs = None
+        self.save_resolutions = None
 
     @staticmethod
     def trim_channels_with_channel_index_list(data, channel_index_list):
@@ -80,9 +117,52 @@ class EEGInterfaceParent(object):
 
     def stop_recording(self):
         """
-        To be overridden by child
+        To be overridden by child.  By default, stops the savers and waits for them to write everything to disk.
         """
-        pass
+        self.stopped = True
+        self.wait_for_saving()
+
+    def wait_for_saving(self, timeout=None):
+        """
+        Waits until start_saving_data_batched (or start_saving_binary_data) has written everything on the data_save_queue
+        to disk and closed the file.  Call after setting stopped (stop_recording does this).
+
+        :param timeout: Seconds to wait.  If None, waits until the saver is finished. Defaults to None
+        :return: True if the saver is finished (or none was started), False on timeout.
+        """
+        if self.save_finished is None:
+            return True
+        return self.save_finished.wait(timeout)
+
+    def get_save_backlog(self):
+        """
+        Returns the number of items waiting on the data_save_queue (0 if we are not saving data).  A backlog that keeps
+        growing means the saver can't keep up (see start_saving_data_batched).
+        """
+        return 0 if self.data_save_queue is None else self.data_save_queue.qsize()
+
+    @classmethod
+    def start_in_process(cls, num_channels, capacity=None, save_data_file_path=None, save_binary=False, save_kwargs=None,
+                         **streamer_kwargs):
+        """
+        Creates the streamer in a separate (acquisition) process and starts recording, so packet receipt is not delayed
+        by the other threads of the experiment.  The live data is published to a shared memory ring instead of the
+        out_buffer_queue, and the data is saved by the acquisition process.
+
+        The EEG_INDEX globals of this process are not updated - use the returned AcquisitionProcess's index_clock (or
+        get_current_index) to read the eeg index.
+
+        :param num_channels: Number of channels put on the out_buffer_queue (ie. len(channels_for_live)).
+        :param capacity: Optional -- Number of frames kept in the ring. Defaults to 10 seconds at 500 Hz.
+        :param save_data_file_path: Optional -- If not None, the data is saved to this file. Defaults to None
+        :param save_binary: If True, saves with start_saving_binary_data rather than start_saving_data_batched. Defaults to False
+        :param save_kwargs: Optional -- dict of extra arguments for the saving method.
+        :param streamer_kwargs: Arguments for the streamer's constructor (must be picklable).
+        :return: A started CCDLUtil.EEGInterface.AcquisitionProcess.AcquisitionProcess.  Call its stop method to stop.
+        """
+        return AcquisitionProcess.AcquisitionProcess(cls, num_channels, capacity=capacity,
+                                                     save_data_file_path=save_data_file_path, save_binary=save_binary,
+                                                     save_kwargs=save_kwargs, **streamer_kwargs)
 
     @threaded(False)
     def start_saving_data(self, save_data_file_path, header=None, timeout=15):
@@ -101,6 +181,8 @@ class EEGInterfaceParent(object):
                     - Data
                         A list of data points in the form [chan 1, chan 2...], where chan X is a number.
                         If data is a list, it will be comma separated.  If data is a string, we'll write it to file as it was provided to us.
+                        If data is a 2D np array of shape (sample, channel), each sample is written on its own line
+                        (with the same index and time).
 
                 Data save format.
                     Data will be saved in the comma separated format:
@@ -126,25 +208,272 @@ class EEGInterfaceParent(object):
                 if timeout is None:
                     index, t, data = self.data_save_queue.get()
                 else:
-                    index, t, data = self.data_save_queue.get(timeout)
+                    index, t, data = self.data_save_queue.get(timeout=timeout)
             except Queue.Empty:
                 print "Data is not being collected."
                 time.sleep(2)
                 # quit system
                 sys.exit(1)
-            index = '' if index is None else str(index) + ','
-            t = '' if t is None else str(t) + ','
-            if type(data) is list:
-                # convert our data items to strings
-                data = map(str, data)
-                # convert our data to a comma separated string
-                data = ','.join(data)
-            else:
-                if type(data) is not str:
-                    raise TypeError("Invalid data type -- data must be either string or ")
-            # add a newline if needed.  Commas are already accounted for
-            data_str = str(index) + str(t) + StringParser.idempotent_append_newline(data)
             # Write our index and timestamp
-            f.write(data_str)
+            f.write(EEGInterfaceParent.format_save_item(index, t, data))
             # Flush our buffer
             f.flush()
+
+    @staticmethod
+    def format_save_item(index, t, data):
+        """
+        Formats an item from the data_save_queue as lines of our csv format (see start_saving_data).
+        :return: str ending with a newline.
+        """
+        index = '' if index is None else str(index) + ','
+        t = '' if t is None else str(t) + ','
+        if isinstance(data, np.ndarray):
+            if data.ndim == 2:
+                # One line per sample.  The index and time are written on every line.
+                data = '\n'.join([str(index) + str(t) + ','.join(map(str, row)) for row in data])
+                index, t = '', ''
+            else:
+                data = ','.join(map(str, data))
+        elif type(data) is list:
+            # convert our data items to strings
+            data = map(str, data)
+            # convert our data to a comma separated string
+            data = ','.join(data)
+        else:
+            if type(data) is not str:
+                raise TypeError("Invalid data type -- data must be either string or ")
+        # add a newline if needed.  Commas are already accounted for
+        return str(index) + str(t) + StringParser.idempotent_append_newline(data)
+
+    @staticmethod
+    def format_save_items(items, float_format=None):
+        """
+        Formats a batch of items from the data_save_queue as lines of our csv format (see start_saving_data).
+
+        Numeric data (np arrays and lists of numbers) is formatted a whole item at a time with a single % operation,
+        rather than a str() per data point.  Integers are written exactly and floats with the format of their dtype in
+        SAVE_FLOAT_FORMATS.  Anything else (strings, bools, lists of lists, other float types) is formatted with
+        format_save_item.
+
+        :param items: List of (index, time, data) tuples.
+        :param float_format: Optional -- % format of each floating point data point.  If None, the format is picked by
+                             dtype from SAVE_FLOAT_FORMATS. Defaults to None
+        :return: str of all the lines.
+        """
+        chunks = []
+        for index, t, data in items:
+            if isinstance(data, np.ndarray) or type(data) is list:
+                block = np.asarray(data)
+                if block.dtype.kind in 'iu':
+                    value_format = '%d'
+                elif block.dtype.kind == 'f':
+                    value_format = float_format if float_format is not None else SAVE_FLOAT_FORMATS.get(block.dtype)
+                else:
+                    value_format = None
+                if block.ndim == 1:
+                    block = block.reshape((1, -1))
+                elif type(data) is list:
+                    # format_save_item writes each inner list as a whole.
+                    value_format = None
+                if value_format is not None and block.ndim == 2 and block.size > 0:
+                    prefix = ('' if index is None else str(index) + ',') + ('' if t is None else str(t) + ',')
+                    line_format = prefix.replace('%', '%%') + ','.join([value_format] * block.shape[1]) + '\n'
+                    chunks.append((line_format * block.shape[0]) % tuple(block.ravel().tolist()))
+                    continue
+            chunks.append(EEGInterfaceParent.format_save_item(index, t, data))
+        return ''.join(chunks)
+
+    def start_saving_data_batched(self, save_data_file_path, header=None, timeout=15, batch_size=1024,
+                                  flush_interval=1.0, flush_size=2 ** 20, float_format=None):
+        """
+        A faster version of start_saving_data, writing the same csv format.  Rather than a get, format, write and flush
+        per item, the saving thread takes everything waiting on the data_save_queue (up to batch_size items) at once,
+        formats it with format_save_items and writes it with a single write.  The file is flushed when flush_interval
+        seconds or flush_size bytes have passed since the last flush.
+
+        Once stopped is set, everything left on the queue is written and the file is synced to disk and closed.  Use
+        stop_recording (or wait_for_saving) to wait for this.  get_save_backlog reports how far behind the saver is.
+
+        :param save_data_file_path: A string - The full file name to save the data (for example './data/subjectX.csv').
+        :param header: Header for the file.  If no header is wanted, pass None.  Defaults to None.
+        :param timeout: If we don't collect any data after timeout seconds, we stop saving (and close the file).  If none, there won't be a timeout.
+        :param batch_size: Maximum number of items written at once. Defaults to 1024
+        :param flush_interval: Seconds between flushes. If None, we do not flush on time. Defaults to 1 second.
+        :param flush_size: Bytes between flushes. If None, we do not flush on size. Defaults to 1 MB.
+        :param float_format: Optional -- % format of each floating point data point (see format_save_items).  If None,
+                             it is picked by dtype: float32 data with '%.8g', float64 data with '%.12g' (12 significant
+                             digits - more than the precision of the amplifiers, and ~3x faster than '%r', which writes
+                             float64 data exactly). Defaults to None
+        """
+        self.save_finished = threading.Event()
+        self._save_data_batched(save_data_file_path, header, timeout, batch_size, flush_interval, flush_size, float_format)
+
+    @threaded(False)
+    def _save_data_batched(self, save_data_file_path, header, timeout, batch_size, flush_interval, flush_size, float_format):
+        f = file(save_data_file_path, 'w')
+        try:
+            if header is not None:
+                f.write(StringParser.idempotent_append_newline(header))
+                f.flush()
+            # Wake up at least this often to flush on time and to check stopped.
+            poll_interval = 0.1 if flush_interval is None else min(0.1, flush_interval)
+            last_item_time = last_flush_time = time.time()
+            unflushed_bytes = 0
+            while True:
+                stopped = self.stopped
+                items = []
+                try:
+                    # When stopped, don't wait - just take what is left.
+                    items.append(self.data_save_queue.get(block=not stopped, timeout=poll_interval))
+                    self.max_save_backlog = max(self.max_save_backlog, self.data_save_queue.qsize() + 1)
+                    while len(items) < batch_size:
+                        items.append(self.data_save_queue.get_nowait())
+                except Queue.Empty:
+                    pass
+                now = time.time()
+                if len(items) > 0:
+                    lines = EEGInterfaceParent.format_save_items(items, float_format=float_format)
+                    f.write(lines)
+                    unflushed_bytes += len(lines)
+                    last_item_time = now
+                elif stopped:
+                    break
+                elif timeout is not None and now - last_item_time > timeout:
+                    # Only this thread would exit, so stop saving (closing the file) rather than calling sys.exit.
+                    print "Data is not being collected.  Stopped saving to " + save_data_file_path
+                    break
+                if unflushed_bytes > 0 and ((flush_size is not None and unflushed_bytes >= flush_size) or
+                                            (flush_interval is not None and now - last_flush_time >= flush_interval)):
+                    f.flush()
+                    unflushed_bytes, last_flush_time = 0, now
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+            self.save_finished.set()
+
+    def save_data_on_loop(self, loop, save_data_file_path, header=None, interval=0.05, float_format=None):
+        """
+        The event loop version of start_saving_data_batched: rather than a thread blocking on the data_save_queue, loop
+        (a CCDLUtil.Utility.EventLoop.EventLoop) writes everything on the queue every interval seconds (formatted with
+        format_save_items).
+
+        Once self.stopped is set (or the loop stops), everything left on the queue is written and the file is synced to
+        disk and closed.  Use stop_recording (or wait_for_saving) to wait for this - but not from the loop thread.
+
+        :param loop: The EventLoop to save on.
+        :param save_data_file_path: A string - The full file name to save the data (for example './data/subjectX.csv').
+        :param header: Header for the file.  If no header is wanted, pass None.  Defaults to None.
+        :param interval: Seconds between writes. Defaults to 0.05
+        :param float_format: Optional -- % format of each floating point data point (see format_save_items). Defaults to None
+        """
+        self.save_finished = threading.Event()
+        f = file(save_data_file_path, 'w')
+        if header is not None:
+            f.write(StringParser.idempotent_append_newline(header))
+            f.flush()
+        # The timer callbacks get the (mutable) list, as the handle only exists once call_every returns.
+        timer = []
+        timer.append(loop.call_every(interval, self._save_pending_on_loop, f, timer, float_format))
+        loop.call_on_stop(self._finish_saving_on_loop, f, timer, float_format)
+
+    def _save_pending_on_loop(self, f, timer, float_format):
+        if self.stopped:
+            self._finish_saving_on_loop(f, timer, float_format)
+            return
+        items = self._get_pending_save_items()
+        if len(items) > 0:
+            f.write(EEGInterfaceParent.format_save_items(items, float_format=float_format))
+            f.flush()
+
+    def _finish_saving_on_loop(self, f, timer, float_format):
+        if f.closed:
+            return
+        try:
+            EventLoop.cancel(timer[0])
+            f.write(EEGInterfaceParent.format_save_items(self._get_pending_save_items(), float_format=float_format))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+            self.save_finished.set()
+
+    def _get_pending_save_items(self):
+        """
+        Returns all the items on the data_save_queue, without waiting for more.
+        """
+        items = []
+        while True:
+            try:
+                items.append(self.data_save_queue.get_nowait())
+            except Queue.Empty:
+                return items
+
+    def start_saving_binary_data(self, save_data_file_path, channel_names=None, fs=None, resolutions=None, timeout=15,
+                                 flush_interval=1.0, flush_size=2 ** 20):
+        """
+        The binary counterpart of start_saving_data.  Saves the data on the data_save_queue in the format of
+        CCDLUtil.DataManagement.EEGRecording, which is much smaller and faster to load than our csv files.
+
+        Data should be placed on the queue in the form (index, time, data), where data is a np array of shape
+        (sample, channel) or a list of data points (a single sample).  Index and time are saved with every sample.
+
+        The first item on the queue may instead be a string of meta information (with index and time None, as put on the
+        queue by the BrainAmpStreamer).  It is saved in the header of the recording.  Any other string raises a
+        TypeError - the OpenBCIStreamer puts preformatted lines on the queue and can only be saved with start_saving_data.
+
+        Like start_saving_data_batched, once stopped is set everything left on the queue is written and the recording is
+        synced to disk and closed.  Use stop_recording (or wait_for_saving) to wait for this.
+
+        :param save_data_file_path: A string - The full file name to save the data (for example './data/subjectX.eeg').
+        :param channel_names: List of channel names for the header.  If None, self.save_channel_names is used.
+        :param fs: Sampling rate for the header.  If None, self.save_fs is used.
+        :param resolutions: List of resolutions for the header.  If None, self.save_resolutions is used (or all 1.0).
+        :param timeout: If we don't collect any data after timeout seconds, we stop saving (and close the recording).  If none, there won't be a timeout.
+        :param flush_interval: Seconds between flushes. See EEGRecording.EEGRecordingWriter. Defaults to 1 second.
+        :param flush_size: Bytes between flushes. See EEGRecording.EEGRecordingWriter. Defaults to 1 MB.
+        """
+        self.save_finished = threading.Event()
+        self._save_binary_data(save_data_file_path, channel_names, fs, resolutions, timeout, flush_interval, flush_size)
+
+    @threaded(False)
+    def _save_binary_data(self, save_data_file_path, channel_names, fs, resolutions, timeout, flush_interval, flush_size):
+        writer, meta_info, first_item = None, '', True
+        last_item_time = time.time()
+        try:
+            while True:
+                stopped = self.stopped
+                try:
+                    # When stopped, don't wait - just take what is left.  Otherwise wake up often enough to see stopped.
+                    index, t, data = self.data_save_queue.get(block=not stopped, timeout=0.1)
+                except Queue.Empty:
+                    if stopped:
+                        break
+                    if timeout is not None and time.time() - last_item_time > timeout:
+                        # Only this thread would exit, so stop saving (closing the recording) rather than calling sys.exit.
+                        print "Data is not being collected.  Stopped saving to " + save_data_file_path
+                        break
+                    continue
+                last_item_time = time.time()
+                if type(data) is str:
+                    if not first_item:
+                        raise TypeError("Only the first item on the queue can be a string when saving binary data")
+                    meta_info = data
+                    first_item = False
+                    continue
+                first_item = False
+                if writer is None:
+                    # The channel names and sampling rate are usually only known once the first data arrives.
+                    channel_names = self.save_channel_names if channel_names is None else channel_names
+                    fs = self.save_fs if fs is None else fs
+                    resolutions = self.save_resolutions if resolutions is None else resolutions
+                    if channel_names is None or fs is None:
+                        raise ValueError('channel_names and fs must be passed or set by the streamer before data is saved')
+                    writer = EEGRecording.EEGRecordingWriter(save_data_file_path, channel_names=channel_names, fs=fs,
+                                                             resolutions=resolutions, meta_info=meta_info,
+                                                             flush_interval=flush_interval, flush_size=flush_size)
+                writer.write_block(data, eeg_indexes=-1 if index is None else index, clock_times=np.nan if t is None else t)
+        finally:
+            if writer is not None:
+                writer.close()
+            self.save_finished.set()
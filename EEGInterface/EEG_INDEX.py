@@ -3,7 +3,162 @@ To avoid messing with thread safety, we'll just keep two different counters.  Be
 the worst that could come out of this is, in a very rare case, a bad read.  Likely, this value can be reconstructed from
 other values, but we'll go ahead and keep a backup eeg_index anyway. Concurrency issues for a single float value have never
 been an issue for me (in a lot of data collection).
+
+Streamers should call set_eeg_index when each packet arrives.  This updates all the module variables below (which are kept
+for code that polls them) and records the (index, time) pair in INDEX_CLOCK, so the index that was current at any
+(recent) time can be looked up with get_eeg_index_at - ie. to time mark an event with the time it happened rather than
+the time the experiment got around to reading the index.
 """
+
+import time
+import ctypes
+import numpy as np
+import multiprocessing.sharedctypes
+
 CURR_EEG_INDEX = 0
 CURR_EEG_INDEX_2 = 0
+EEG_INDEX = 0
+EEG_INDEX_2 = 0
 EEG_ID_VAL = 0
+
+
+class EEGIndexClock(object):
+
+    def __init__(self, capacity=2 ** 15):
+        """
+        Records (eeg index, time) pairs as packets arrive, and answers which index was current at a given time.
+
+        The pairs are kept in a ring in shared memory.  There is a single writer (the streamer thread) and no lock: the
+        writer publishes each pair by advancing a counter after it is written, and readers check the counter again after
+        reading to detect pairs overwritten in the meantime.  The clock can be passed to a multiprocessing.Process (as an
+        argument) to read it from another process.
+
+        :param capacity: Number of pairs kept.  Lookups are only possible for times within the last capacity packets.
+                         Defaults to 2 ** 15
+        """
+        self.capacity = capacity
+        # Mirrored rings (every pair is stored twice, capacity apart), so the last capacity pairs are always contiguous.
+        self.raw_indexes = multiprocessing.sharedctypes.RawArray(ctypes.c_double, 2 * capacity)
+        self.raw_times = multiprocessing.sharedctypes.RawArray(ctypes.c_double, 2 * capacity)
+        # [write_begin, write_end] -- see SharedFrameRing
+        self.raw_header = multiprocessing.sharedctypes.RawArray(ctypes.c_longlong, 2)
+        self._map()
+
+    def _map(self):
+        self.indexes = np.frombuffer(self.raw_indexes, dtype=np.float64)
+        self.times = np.frombuffer(self.raw_times, dtype=np.float64)
+        self.header = np.frombuffer(self.raw_header, dtype=np.int64)
+
+    def __getstate__(self):
+        return {'capacity': self.capacity, 'raw_indexes': self.raw_indexes, 'raw_times': self.raw_times,
+                'raw_header': self.raw_header}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def record(self, eeg_index, timestamp=None):
+        """
+        Records that eeg_index became current at timestamp.  Must only be called by one thread.
+
+        :param eeg_index: The new eeg index (ie. EEGInterfaceParent.data_index).
+        :param timestamp: Time (as returned by time.time()) eeg_index became current. If None, now. Defaults to None
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        count = int(self.header[1])
+        self.header[0] = count + 1
+        slot = count % self.capacity
+        self.indexes[slot] = self.indexes[slot + self.capacity] = eeg_index
+        self.times[slot] = self.times[slot + self.capacity] = timestamp
+        self.header[1] = count + 1
+
+    def reset(self):
+        """
+        Forgets all recorded pairs.
+        """
+        self.header[0] = self.header[1] = 0
+
+    def get_num_recorded(self):
+        """
+        Returns the number of pairs recorded so far.
+        """
+        return int(self.header[1])
+
+    def get_current_index(self):
+        """
+        Returns the most recently recorded eeg index, or None if nothing has been recorded.
+        """
+        while True:
+            count = int(self.header[1])
+            if count == 0:
+                return None
+            eeg_index = self.indexes[(count - 1) % self.capacity]
+            if int(self.header[0]) - (count - 1) <= self.capacity:
+                return eeg_index
+
+    def _lookup(self, values, keys, key):
+        # Interpolates the value at key from the recorded (key, value) pairs.  keys must be nondecreasing.
+        while True:
+            end = int(self.header[1])
+            if end == 0:
+                return None
+            num_pairs = min(end, self.capacity)
+            start_slot = (end - num_pairs) % self.capacity
+            recorded_keys = keys[start_slot:start_slot + num_pairs]
+            recorded_values = values[start_slot:start_slot + num_pairs]
+            ii = int(np.searchsorted(recorded_keys, key, side='right'))
+            if ii == 0:
+                result = recorded_values[0]
+            elif ii == num_pairs or recorded_keys[ii] == recorded_keys[ii - 1]:
+                result = recorded_values[ii - 1]
+            else:
+                fraction = (key - recorded_keys[ii - 1]) / float(recorded_keys[ii] - recorded_keys[ii - 1])
+                result = recorded_values[ii - 1] + fraction * (recorded_values[ii] - recorded_values[ii - 1])
+            if int(self.header[0]) - (end - num_pairs) <= self.capacity:
+                return result
+
+    def get_index_at(self, timestamp):
+        """
+        Returns the eeg index at timestamp, linearly interpolated between the recorded pairs (so it is fractional).
+
+        Times before the oldest kept pair give the oldest index and times after the last pair give the current index.
+        Use int() on the result to get the index of the packet that had last arrived at timestamp.
+
+        :param timestamp: Time as returned by time.time()
+        :return: float, or None if nothing has been recorded.
+        """
+        return self._lookup(self.indexes, self.times, timestamp)
+
+    def get_time_of_index(self, eeg_index):
+        """
+        Returns the time eeg_index became current, linearly interpolated between the recorded pairs.
+
+        :param eeg_index: An eeg index (may be fractional).
+        :return: float, or None if nothing has been recorded.
+        """
+        return self._lookup(self.times, self.indexes, eeg_index)
+
+
+INDEX_CLOCK = EEGIndexClock()
+
+
+def set_eeg_index(eeg_index, id_val=None, timestamp=None):
+    """
+    Sets the current eeg index.  Called by the streamers when each packet arrives.
+
+    :param eeg_index: The new eeg index.
+    :param id_val: Optional -- the id the device gave the packet (ie. the OpenBCI sample id). Defaults to None
+    :param timestamp: Time eeg_index became current.  If None, now. Defaults to None
+    """
+    global CURR_EEG_INDEX, CURR_EEG_INDEX_2, EEG_INDEX, EEG_INDEX_2, EEG_ID_VAL
+    INDEX_CLOCK.record(eeg_index, timestamp)
+    CURR_EEG_INDEX = CURR_EEG_INDEX_2 = EEG_INDEX = EEG_INDEX_2 = eeg_index
+    if id_val is not None:
+        EEG_ID_VAL = id_val
+
+
+def get_eeg_index_at(timestamp):
+    """
+    Returns the eeg index at timestamp (see EEGIndexClock.get_index_at).
+    """
+    return INDEX_CLOCK.get_index_at(timestamp)
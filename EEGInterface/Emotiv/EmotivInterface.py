@@ -10,11 +10,11 @@ from CCDLUtil.Utility.Decorators import threaded
 class EmotivStreamer(EEGParent.EEGInterfaceParent):
 
     def __init__(self,eeg_file_path, lib_path, channels_for_live='All', live=True, save_data=True, 
-                 subject_name=None, subject_tracking_number=None, experiment_number=None):
+                 subject_name=None, subject_tracking_number=None, experiment_number=None, live_block_size=None):
         # call parent constructor
-        super(EmotivStreamer, self).__init__(channels_for_live=channels_for_live, subject_name=subject_name,
+        super(EmotivStreamer, self).__init__(channels_for_live=channels_for_live, live=live, subject_name=subject_name,
                                              subject_tracking_number=subject_tracking_number,
-                                             experiment_number=experiment_number)
+                                             experiment_number=experiment_number, live_block_size=live_block_size)
         sys.path.append(Constants.LIB_PATH)
         # set EDK library path
         self.lib_path = lib_path
@@ -25,6 +25,7 @@ import glob
 SAMPLE_RATE = 250.0  # Hz
 START_BYTE = 0xA0  # start of data packet
 END_BYTE = 0xC0  # end of data packet
+PACKET_SIZE = 33  # bytes, from START_BYTE to END_BYTE
 ADS1299_Vref = 4.5  # reference voltage for ADC in ADS1299.  set by its hardware
 ADS1299_gain = 24.0  # assumed gain setting for ADS1299.  set by its Arduino code
 scale_fac_uVolts_per_count = ADS1299_Vref / float((pow(2, 23) - 1)) / ADS1299_gain * 1000000.
@@ -96,7 +97,10 @@ class OpenBCIBoard(object):
         self.attempt_reconnect = False
         self.last_reconnect = 0
         self.reconnect_freq = 5
+        # Consecutive packets dropped (reset by every good packet) - used by check_connection to detect a lost connection.
         self.packets_dropped = 0
+        # Packets dropped since the board was created.
+        self.total_packets_dropped = 0
 
         # Disconnects from board when terminated
         atexit.register(self.disconnect)
@@ -186,6 +190,80 @@ class OpenBCIBoard(object):
             if self.log:
                 self.log_packet_count = self.log_packet_count + 1;
 
+    def start_streaming_blocks(self, callback, block_size=None, lapse=-1):
+        """
+        Start handling streaming data from the board in blocks of samples.  This is the block version of start_streaming:
+        rather than an OpenBCISample per sample, callbacks receive numpy arrays of many samples.
+
+        If a daisy module is attached, main board and daisy samples are merged (like start_streaming) into samples of
+        16 channels - the main board channels followed by the daisy channels, with the aux data averaged.
+
+        Args:
+          callback: A callback function -- or a list of functions -- that will receive three arguments:
+              packet_ids (np array of shape (n,)), channel_data (np array of shape (n, getNbEEGChannels())) and
+              aux_data (np array of shape (n, 3)).
+          block_size: Number of samples passed to each call.  If None, the callbacks are called with all the samples
+              read from the port at once (usually a few). Defaults to None
+          lapse: Time (seconds) to stream for. If -1, until stop is called. Defaults to -1
+        """
+        if not self.streaming:
+            self.ser.write(b'b')
+            self.streaming = True
+
+        start_time = timeit.default_timer()
+
+        # Enclose callback funtion in a list if it comes alone
+        if not isinstance(callback, list):
+            callback = [callback]
+
+        # Initialize check connection
+        self.check_connection()
+
+        pending, num_pending = [], 0
+        for packet_ids, channel_data, aux_data, dropped in self.iter_packet_blocks():
+            if self.daisy:
+                packet_ids, channel_data, aux_data = self.merge_daisy_packets(packet_ids, channel_data, aux_data)
+            if block_size is None:
+                if len(packet_ids) > 0:
+                    for call in callback:
+                        call(packet_ids, channel_data, aux_data)
+            else:
+                pending.append((packet_ids, channel_data, aux_data))
+                num_pending += len(packet_ids)
+                if num_pending >= block_size:
+                    packet_ids, channel_data, aux_data = [np.concatenate(arrays) for arrays in zip(*pending)]
+                    num_full = num_pending - num_pending % block_size
+                    for start in xrange(0, num_full, block_size):
+                        for call in callback:
+                            call(packet_ids[start:start + block_size], channel_data[start:start + block_size],
+                                 aux_data[start:start + block_size])
+                    pending = [(packet_ids[num_full:], channel_data[num_full:], aux_data[num_full:])]
+                    num_pending -= num_full
+
+            if (lapse > 0 and timeit.default_timer() - start_time > lapse):
+                self.stop();
+
+    def merge_daisy_packets(self, packet_ids, channel_data, aux_data):
+        """
+        Merges each main board packet (odd id) with the daisy packet before it (even id, one less) - the block version of
+        the merging in start_streaming.  Unpaired packets are dropped.  The last daisy packet of a block is kept until
+        the next block.
+
+        :return: packet_ids (of the main board packets), channel_data of shape (n, 2 * eeg_channels_per_sample) and aux_data
+        """
+        if self.last_odd_sample.id != -1:
+            # Prepend the daisy packet left over from the previous block.
+            packet_ids = np.concatenate(([self.last_odd_sample.id], packet_ids))
+            channel_data = np.concatenate((np.reshape(self.last_odd_sample.channel_data, (1, -1)), channel_data))
+            aux_data = np.concatenate((np.reshape(self.last_odd_sample.aux_data, (1, -1)), aux_data))
+            self.last_odd_sample = OpenBCISample(-1, [], [])
+        pairs = np.flatnonzero((packet_ids[1:] % 2 == 1) & (packet_ids[1:] - 1 == packet_ids[:-1])) + 1
+        if len(packet_ids) > 0 and packet_ids[-1] % 2 == 0:
+            self.last_odd_sample = OpenBCISample(packet_ids[-1], channel_data[-1], aux_data[-1])
+        # the aux data will be the average between the two samples, as the channel samples themselves have been averaged by the board
+        return (packet_ids[pairs], np.hstack((channel_data[pairs], channel_data[pairs - 1])),
+                (aux_data[pairs] + aux_data[pairs - 1]) / 2)
+
     """
       PARSER:
       Parses incoming data packet into OpenBCISample.
@@ -218,7 +296,8 @@ class OpenBCIBoard(object):
                         self.warn('Skipped %d bytes before start found' % (rep))
                         rep = 0;
                     packet_id = struct.unpack('B', read(1))[0]  # packet id goes from 0-255
-                    log_bytes_in = str(packet_id);
+                    # Only build up the packet string if it will be logged.
+                    log_bytes_in = str(packet_id) if self.log else None
 
                     self.read_state = 1
 
@@ -231,7 +310,8 @@ class OpenBCIBoard(object):
                     literal_read = read(3)
 
                     unpacked = struct.unpack('3B', literal_read)
-                    log_bytes_in = log_bytes_in + '|' + str(literal_read);
+                    if log_bytes_in is not None:
+                        log_bytes_in = log_bytes_in + '|' + str(literal_read);
 
                     # 3byte int in 2s compliment
                     if (unpacked[0] > 127):
@@ -258,7 +338,8 @@ class OpenBCIBoard(object):
 
                     # short = h
                     acc = struct.unpack('>h', read(2))[0]
-                    log_bytes_in = log_bytes_in + '|' + str(acc);
+                    if log_bytes_in is not None:
+                        log_bytes_in = log_bytes_in + '|' + str(acc);
 
                     if self.scaling_output:
                         aux_data.append(acc * scale_fac_accel_G_per_count)
@@ -269,7 +350,8 @@ class OpenBCIBoard(object):
             # ---------End Byte---------
             elif self.read_state == 3:
                 val = struct.unpack('B', read(1))[0]
-                log_bytes_in = log_bytes_in + '|' + str(val);
+                if log_bytes_in is not None:
+                    log_bytes_in = log_bytes_in + '|' + str(val);
                 self.read_state = 0  # read next packet
                 if (val == END_BYTE):
                     sample = OpenBCISample(packet_id, channel_data, aux_data)
@@ -278,8 +360,45 @@ class OpenBCIBoard(object):
                 else:
                     self.warn("ID:<%d> <Unexpected END_BYTE found <%s> instead of <%s>"
                               % (packet_id, val, END_BYTE))
-                    logging.debug(log_bytes_in);
+                    if log_bytes_in is not None:
+                        logging.debug(log_bytes_in);
                     self.packets_dropped = self.packets_dropped + 1
+                    self.total_packets_dropped += 1
+
+    def iter_packet_blocks(self, chunk_size=33 * 64):
+        """
+        Reads the serial port in large chunks and yields all the packets in each chunk at once (see OpenBCIPacketParser).
+        This replaces _read_serial_binary (which reads the port byte by byte) for block processing.
+
+        Streaming must already be started (ie. self.ser.write(b'b')).  Stops when self.streaming is set to False or the
+        device stalls.
+
+        :param chunk_size: Maximum number of bytes to read at once. Reads wait for at least one packet (33 bytes).
+        :return: generator of (packet_ids, channel_data, aux_data, dropped) -- see OpenBCIPacketParser.parse.  dropped
+                 also counts the packets dropped in earlier chunks that held no good packet.
+        """
+        parser = OpenBCIPacketParser(eeg_channels_per_sample=self.eeg_channels_per_sample,
+                                     aux_channels_per_sample=self.aux_channels_per_sample, scaled_output=self.scaling_output)
+        # Packets dropped since the last yield.
+        pending_dropped = 0
+        while self.streaming:
+            chunk = self.ser.read(min(max(self.ser.inWaiting(), PACKET_SIZE), chunk_size))
+            if not chunk:
+                self.warn('Device appears to be stalled (%d packets dropped since the last good packet). Quitting...'
+                          % pending_dropped)
+                return
+            packet_ids, channel_data, aux_data, dropped = parser.parse(chunk)
+            self.total_packets_dropped += dropped
+            pending_dropped += dropped
+            if len(packet_ids) > 0:
+                # Only consecutive drops count towards check_connection.
+                self.packets_dropped = 0
+                if self.log:
+                    self.log_packet_count += len(packet_ids)
+                yield packet_ids, channel_data, aux_data, pending_dropped
+                pending_dropped = 0
+            else:
+                self.packets_dropped += dropped
 
     """
     Clean Up (atexit)
@@ -585,9 +704,107 @@ class OpenBCIBoard(object):
 class OpenBCISample(object):
     """Object encapulsating a single sample from the OpenBCI board. NB: dummy imp for plugin compatiblity"""
 
+    # No per instance __dict__, as an OpenBCISample is created for every sample.
+    __slots__ = ('id', 'channel_data', 'aux_data', 'imp_data')
+
     def __init__(self, packet_id, channel_data, aux_data):
         self.id = packet_id
         self.channel_data = channel_data
         self.aux_data = aux_data
         self.imp_data = []
 
+
+class OpenBCIPacketParser(object):
+
+    def __init__(self, eeg_channels_per_sample=8, aux_channels_per_sample=3, scaled_output=True):
+        """
+        Decodes the binary packet stream of the OpenBCI board many packets at a time.
+
+        Bytes are passed in chunks of any size (packets may be split between chunks).  Packets are found by their
+        START_BYTE and END_BYTE (PACKET_SIZE bytes apart), and the 24 bit big endian channel values and 16 bit aux
+        values of all packets in a chunk are decoded at once with numpy.  Bytes between packets are skipped.
+
+        Packet Structure:
+        Start Byte(1)|Sample ID(1)|Channel Data(24)|Aux Data(6)|End Byte(1)
+        0xA0|0-255|8, 3-byte signed ints|3 2-byte signed ints|0xC0
+
+        :param eeg_channels_per_sample: Number of channels in each packet. Defaults to 8
+        :param aux_channels_per_sample: Number of aux values in each packet. Defaults to 3
+        :param scaled_output: If True, channel data is scaled to uV and aux data to G (like OpenBCIBoard). Defaults to True
+        """
+        if 2 + 3 * eeg_channels_per_sample + 2 * aux_channels_per_sample + 1 != PACKET_SIZE:
+            raise ValueError('Packets of %d channels and %d aux values are not %d bytes' % (eeg_channels_per_sample, aux_channels_per_sample, PACKET_SIZE))
+        self.eeg_channels_per_sample = eeg_channels_per_sample
+        self.aux_channels_per_sample = aux_channels_per_sample
+        self.scaled_output = scaled_output
+        self.pending = ''
+        self.last_packet_id = None
+        self.bytes_skipped = 0
+        self.packets_dropped = 0
+
+    def _find_packets(self, stream):
+        """
+        Returns the start offsets of the packets in stream (np uint8 array), and the offset parsing should resume from.
+        """
+        last_start = len(stream) - PACKET_SIZE
+        if last_start < 0:
+            return np.zeros(0, dtype=np.intp), 0
+        is_start = (stream[:last_start + 1] == START_BYTE) & (stream[PACKET_SIZE - 1:] == END_BYTE)
+        candidates = np.flatnonzero(is_start)
+        starts = []
+        offset = 0
+        while len(candidates) > 0:
+            # In an intact stream, packets follow back to back.  Take the run of back to back packets from the first
+            # candidate, then look for the next candidate after the run.
+            first = candidates[0]
+            run = first + PACKET_SIZE * np.arange((last_start - first) // PACKET_SIZE + 1)
+            broken = np.flatnonzero(~is_start[run])
+            if len(broken) > 0:
+                run = run[:broken[0]]
+            starts.append(run)
+            offset = run[-1] + PACKET_SIZE
+            candidates = candidates[np.searchsorted(candidates, offset):]
+        if len(starts) == 0:
+            # Keep the bytes that may still become the start of a packet.
+            offset = max(0, last_start + 1)
+        return np.concatenate(starts) if len(starts) > 0 else np.zeros(0, dtype=np.intp), offset
+
+    def parse(self, chunk):
+        """
+        Decodes all the complete packets received so far.
+
+        :param chunk: str of bytes read from the serial port.
+        :return: packet_ids, channel_data, aux_data, dropped
+                    packet_ids -- np int array of shape (n,)
+                    channel_data -- np array of shape (n, eeg_channels_per_sample)
+                    aux_data -- np array of shape (n, aux_channels_per_sample)
+                    dropped -- number of packets missing (from gaps in the packet ids) before and between these packets.
+        """
+        self.pending += chunk
+        stream = np.frombuffer(self.pending, dtype=np.uint8)
+        starts, offset = self._find_packets(stream)
+        # Count skipped bytes - the bytes before each packet that aren't part of the previous packet.
+        if len(starts) > 0:
+            self.bytes_skipped += int(starts[0]) + int(np.sum(np.diff(starts) - PACKET_SIZE))
+        else:
+            self.bytes_skipped += offset
+        packets = stream[starts[:, None] + np.arange(PACKET_SIZE)]
+        self.pending = self.pending[offset:]
+        packet_ids = packets[:, 1].astype(np.int64)
+        eeg_bytes = packets[:, 2:2 + 3 * self.eeg_channels_per_sample].reshape((-1, self.eeg_channels_per_sample, 3)).astype(np.int32)
+        channel_data = (eeg_bytes[:, :, 0] << 16) | (eeg_bytes[:, :, 1] << 8) | eeg_bytes[:, :, 2]
+        # 24 bit two's complement
+        channel_data -= (channel_data & 0x800000) << 1
+        aux_start = 2 + 3 * self.eeg_channels_per_sample
+        aux_data = np.ascontiguousarray(packets[:, aux_start:aux_start + 2 * self.aux_channels_per_sample]).view('>i2').astype(np.int32)
+        if self.scaled_output:
+            channel_data = channel_data * scale_fac_uVolts_per_count
+            aux_data = aux_data * scale_fac_accel_G_per_count
+        # Packet ids count up from 0 to 255 and wrap around.
+        dropped = 0
+        if len(packet_ids) > 0:
+            previous_ids = np.concatenate(([packet_ids[0] - 1 if self.last_packet_id is None else self.last_packet_id], packet_ids[:-1]))
+            dropped = int(np.sum((packet_ids - previous_ids - 1) % 256))
+            self.last_packet_id = packet_ids[-1]
+        self.packets_dropped += dropped
+        return packet_ids, channel_data, aux_data, dropped
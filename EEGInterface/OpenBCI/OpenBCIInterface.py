@@ -4,13 +4,14 @@ import CCDLUtil.EEGInterface.EEGInterface
 from CCDLUtil.Utility.Decorators import threaded
 import time
 import serial
+import numpy as np
 
 
 class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
 
     def __init__(self, channels_for_live='All', channels_for_save='All', live=True, save_data=True,
                  include_aux_in_save_file=True, subject_name=None, subject_tracking_number=None, experiment_number=None,
-                 channel_names=None, port=None, baud=115200):
+                 channel_names=None, port=None, baud=115200, live_block_size=None, block_size=None):
         """
         Inherits from CCDLUtil.EEGInterface.EEGInterfaceParent.EEGInterfaceParent
 
@@ -28,16 +29,25 @@ class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         :param subject_name: Optional -- Name of the subject. Defaults to 'None'
         :param subject_tracking_number: Optional -- Subject Tracking Number (AKA TMS group experiment number tracker). Defaults to 'None'
         :param experiment_number: Optional -- Experimental number. Defaults to 'None'
+        :param live_block_size: Optional -- If not None, samples on the out_buffer_queue are delivered in blocks of up to
+                                live_block_size samples (see EEGInterfaceParent). Defaults to None
+        :param block_size: Optional -- If not None, the board is read in blocks (see OpenBCIBoard.start_streaming_blocks)
+                           and blocks of block_size samples are put on the queues rather than single samples. Defaults to None
         """
 
         super(OpenBCIStreamer, self).__init__(
             channels_for_live=channels_for_live, live=live, save_data=save_data, subject_name=subject_name,
-            subject_tracking_number=subject_tracking_number, experiment_number=experiment_number)
+            subject_tracking_number=subject_tracking_number, experiment_number=experiment_number,
+            live_block_size=live_block_size)
         # in super, self.data_index is set to 0
         self.channel_names = str(channel_names)
         self.channels_for_save = channels_for_save
         self.include_aux_in_save_file = include_aux_in_save_file
         self.channels_for_live = channels_for_live
+        self.block_size = block_size
+        # OpenBCI channels are selected by index, so the routes can be resolved now.
+        self.channel_router.add_route('save', channels_for_save)
+        self.channel_router.resolve()
         # Set our port to default if a port isn't passed
         if port is None:
             raise ValueError("port cannot be None!")
@@ -70,42 +80,46 @@ class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
             return
 
         # Put on Out Buffer for live data analysis.
-        if self.live:
-            # Get our channels from channels for live:
-            if type(self.channels_for_live) is str and self.channels_for_live.lower() == 'all':
-                self.out_buffer_queue.put(data)
-            elif type(self.channels_for_live) is list:
-                # Get only the indexes contained in the channels for live list.
-                trimmed_data = OpenBCIStreamer.trim_channels_with_channel_index_list(data, self.channels_for_live)
-                self.out_buffer_queue.put(trimmed_data)
-            else:
-                if self.channels_for_live is not None:
-                    raise ValueError('Invalid channels_for_live value.')
+        if self.live and self.channel_router.has_channels('live'):
+            # Get only the channels for live.
+            self.out_buffer_queue.put(self.channel_router.select('live', data))
         # Save data
-        if self.save_data:
-            data_to_put_on_queue = None
-            if type(self.channels_for_save) is str and self.channels_for_save.lower() == 'all':
-                data_to_put_on_queue = data
-            elif type(self.channels_for_live) is list:
-                data_to_put_on_queue = OpenBCIStreamer.trim_channels_with_channel_index_list(data, self.channels_for_save)
-            else:
-                if self.channels_for_save is not None:
-                    raise ValueError('Invalid channels_for_live value.')
+        if self.save_data and self.channel_router.has_channels('save'):
+            data_to_put_on_queue = self.channel_router.select('save', data)
+
+            data_str = str(id_val)+','+str(time.time())+','+','.join([str(xx) for xx in data_to_put_on_queue])
 
-            if data_to_put_on_queue is not None:
+            if self.include_aux_in_save_file:
+                data_str += ',' + ','.join([str(yy) for yy in aux_data])
 
-                data_str = str(id_val)+','+str(time.time())+','+','.join([str(xx) for xx in data_to_put_on_queue])
+            # Data put on the data save queue is a len three tuple.
+            self.data_save_queue.put((None, None, data_str + '\n'))
 
-                if self.include_aux_in_save_file:
-                    data_str += ',' + ','.join([str(yy) for yy in aux_data])
+        # Set our EEG INDEX parameters.
+        CCDLUtil.EEGInterface.EEG_INDEX.set_eeg_index(self.data_index, id_val=id_val)
 
-                # Data put on the data save queue is a len three tuple.
-                self.data_save_queue.put((None, None, data_str + '\n'))
+    def block_callback_fn(self, packet_ids, channel_data, aux_data):
+        """
+        The block version of callback_fn, used when block_size is set (see OpenBCIBoard.start_streaming_blocks).
 
-        # Set our two EEG INDEX parameters.
-        CCDLUtil.EEGInterface.EEG_INDEX.CURR_EEG_INDEX = self.data_index
-        CCDLUtil.EEGInterface.EEG_INDEX.CURR_EEG_INDEX_2 = self.data_index
-        CCDLUtil.EEGInterface.EEG_INDEX.EEG_ID_VAL = id_val
+        :param packet_ids: np array of shape (sample,)
+        :param channel_data: np array of shape (sample, channel)
+        :param aux_data: np array of shape (sample, aux channel)
+        """
+        self.data_index += len(packet_ids)
+        # Put on Out Buffer for live data analysis - shape (sample, channel)
+        if self.live and self.channel_router.has_channels('live'):
+            self.out_buffer_queue.put(self.channel_router.select('live', channel_data, copy=True))
+        # Save data - one line per sample, all with the time the block arrived.
+        if self.save_data and self.channel_router.has_channels('save'):
+            rows = self.channel_router.select('save', channel_data)
+            if self.include_aux_in_save_file:
+                rows = np.hstack((rows, aux_data))
+            time_str = str(time.time())
+            lines = [str(id_val) + ',' + time_str + ',' + ','.join(map(str, row)) for id_val, row in zip(packet_ids.tolist(), rows.tolist())]
+            self.data_save_queue.put((None, None, '\n'.join(lines) + '\n'))
+        # Set our EEG INDEX parameters.
+        CCDLUtil.EEGInterface.EEG_INDEX.set_eeg_index(self.data_index, id_val=packet_ids[-1])
 
     @threaded(False)
     def start_recording(self):
@@ -115,7 +129,10 @@ class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
 
         print 'start recording'
         try:
-            self.board.start_streaming(self.callback_fn)
+            if self.block_size is not None:
+                self.board.start_streaming_blocks(self.block_callback_fn, block_size=self.block_size)
+            else:
+                self.board.start_streaming(self.callback_fn)
         except serial.SerialException:
             pass
 
@@ -124,6 +141,7 @@ class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         self.stopped = True
         self.board.stop()
         self.board.disconnect()
+        self.wait_for_saving()
 
 
 if __name__ == '__main__':
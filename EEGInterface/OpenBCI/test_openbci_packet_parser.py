@@ -0,0 +1,114 @@
+import struct
+import numpy as np
+import CCDLUtil.EEGInterface.OpenBCI.OpenBCIHardwareInterface as OpenBCIHardwareInterface
+
+
+def make_packet(packet_id, channel_values, aux_values=(1, -2, 3)):
+    channel_bytes = ''.join([struct.pack('>i', value)[1:] for value in channel_values])
+    return chr(0xA0) + chr(packet_id) + channel_bytes + struct.pack('>3h', *aux_values) + chr(0xC0)
+
+
+def make_stream(packet_ids):
+    rng = np.random.RandomState(0)
+    channel_data = rng.randint(-2 ** 23, 2 ** 23, size=(len(packet_ids), 8))
+    return ''.join([make_packet(packet_id, values) for packet_id, values in zip(packet_ids, channel_data)]), channel_data
+
+
+def parse_in_chunks(parser, stream, chunk_sizes):
+    results, position, ii = [], 0, 0
+    while position < len(stream):
+        chunk_size = chunk_sizes[ii % len(chunk_sizes)]
+        results.append(parser.parse(stream[position:position + chunk_size]))
+        position += chunk_size
+        ii += 1
+    return [np.concatenate([result[field] for result in results]) for field in range(3)], sum([result[3] for result in results])
+
+
+def test_split_chunks_match_one_chunk():
+    stream, channel_data = make_stream(range(40))
+    (packet_ids, parsed_data, aux_data), dropped = parse_in_chunks(OpenBCIHardwareInterface.OpenBCIPacketParser(scaled_output=False),
+                                                                    stream, [1, 5, 40, 33, 100, 7])
+    np.testing.assert_array_equal(packet_ids, range(40))
+    np.testing.assert_array_equal(parsed_data, channel_data)
+    np.testing.assert_array_equal(aux_data, [[1, -2, 3]] * 40)
+    assert dropped == 0
+    scaled = OpenBCIHardwareInterface.OpenBCIPacketParser().parse(stream)[1]
+    np.testing.assert_allclose(scaled, channel_data * OpenBCIHardwareInterface.scale_fac_uVolts_per_count)
+
+
+def test_garbage_bytes_are_skipped():
+    packets = [make_packet(ii, [ii] * 8) for ii in range(6)]
+    # Garbage with start bytes in it, between packets and in front of the first one.
+    garbage = chr(0xA0) + 'xyz' + chr(0xC0)
+    stream = garbage + packets[0] + packets[1] + garbage + garbage + packets[2] + 'q' + ''.join(packets[3:])
+    parser = OpenBCIHardwareInterface.OpenBCIPacketParser(scaled_output=False)
+    (packet_ids, parsed_data, _), dropped = parse_in_chunks(parser, stream, [10, 64])
+    np.testing.assert_array_equal(packet_ids, range(6))
+    np.testing.assert_array_equal(parsed_data[:, 0], range(6))
+    assert parser.bytes_skipped == 3 * len(garbage) + 1
+    assert dropped == 0
+
+
+def test_packet_id_gaps_are_counted_as_dropped():
+    # 3 missing before the wrap around, 1 after.
+    stream, _ = make_stream([250, 251, 255, 0, 2, 3])
+    parser = OpenBCIHardwareInterface.OpenBCIPacketParser(scaled_output=False)
+    (packet_ids, _, _), dropped = parse_in_chunks(parser, stream, [33 * 3 + 5])
+    np.testing.assert_array_equal(packet_ids, [250, 251, 255, 0, 2, 3])
+    assert dropped == parser.packets_dropped == 4
+
+
+class FakeSerial(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def inWaiting(self):
+        return len(self.chunks[0]) if len(self.chunks) > 0 else 0
+
+    def read(self, size):
+        return self.chunks.pop(0) if len(self.chunks) > 0 else ''
+
+
+def test_iter_packet_blocks_keeps_a_running_total_of_drops():
+    stream, _ = make_stream([0, 1, 3, 4, 8, 9])
+    board = OpenBCIHardwareInterface.OpenBCIBoard.__new__(OpenBCIHardwareInterface.OpenBCIBoard)
+    board.eeg_channels_per_sample, board.aux_channels_per_sample, board.scaling_output = 8, 3, False
+    board.streaming, board.log, board.packets_dropped, board.total_packets_dropped = True, False, 0, 0
+    board.ser = FakeSerial([stream[:33 * 3], stream[33 * 3:]])
+    blocks = list(board.iter_packet_blocks())
+    assert [list(block[0]) for block in blocks] == [[0, 1, 3], [4, 8, 9]]
+    assert [block[3] for block in blocks] == [1, 3]
+    assert board.total_packets_dropped == 4
+    assert board.packets_dropped == 0
+
+
+def merge_sample_by_sample(packet_ids, channel_data, aux_data):
+    # The per sample merging of OpenBCIBoard.start_streaming.
+    merged, last_daisy = [], None
+    for packet_id, channels, aux in zip(packet_ids, channel_data, aux_data):
+        if packet_id % 2 == 0:
+            last_daisy = (packet_id, channels, aux)
+        elif last_daisy is not None and packet_id - 1 == last_daisy[0]:
+            merged.append((packet_id, list(channels) + list(last_daisy[1]), (aux + last_daisy[2]) / 2))
+    return merged
+
+
+def test_merge_daisy_packets_matches_sample_by_sample():
+    # Gaps leave main board and daisy packets without their pair.
+    packet_ids = np.array([1, 2, 3, 4, 5, 6, 8, 9, 11, 12, 13, 14, 15, 16, 17, 18, 19])
+    rng = np.random.RandomState(1)
+    channel_data, aux_data = rng.randn(len(packet_ids), 8), rng.randn(len(packet_ids), 3)
+    board = OpenBCIHardwareInterface.OpenBCIBoard.__new__(OpenBCIHardwareInterface.OpenBCIBoard)
+    board.last_odd_sample = OpenBCIHardwareInterface.OpenBCISample(-1, [], [])
+    merged_ids, merged_data, merged_aux = [], [], []
+    # Blocks split between a daisy packet and its main board packet, and between pairs.
+    for block in np.split(np.arange(len(packet_ids)), [3, 4, 9, 12]):
+        block_ids, block_data, block_aux = board.merge_daisy_packets(packet_ids[block], channel_data[block], aux_data[block])
+        merged_ids += list(block_ids)
+        merged_data += list(block_data)
+        merged_aux += list(block_aux)
+    expected = merge_sample_by_sample(packet_ids, channel_data, aux_data)
+    assert merged_ids == [sample[0] for sample in expected] == [3, 5, 9, 13, 15, 17, 19]
+    np.testing.assert_array_equal(merged_data, [sample[1] for sample in expected])
+    np.testing.assert_allclose(merged_aux, [sample[2] for sample in expected])
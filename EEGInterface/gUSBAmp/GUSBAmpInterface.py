@@ -8,7 +8,7 @@ import CCDLUtil.EEGInterface.DataSaver
 import numpy as np
 import CCDLUtil.EEGInterface.EEG_INDEX
 import CCDLUtil.EEGInterface.EEGInterface as CCDLEEGParent
-import CCDLUtil.DataManagement.DataParser as CCDLDataParser
+import CCDLUtil.DataManagement.Buffer as CCDLBuffer
 import pylsl
 
 
@@ -23,7 +23,7 @@ class GUSBAmpStreamer(CCDLEEGParent.EEGInterfaceParent):
         For live data streaming, use with a threading or multiprocessing queue (ie. Queue.queue()
            Data will be put on the queue, which can be read by another thread.)
 
-        Modifies the EEG_INDEX and EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.  These variables can be read from any thread.
+        Sets the eeg index in CCDLUtil/EEGInterface/EEG_INDEX.py (with EEG_INDEX.set_eeg_index) when each packet arrives.  The index can be read from any thread.
             Use this to time mark events in your other programs.
 
         :param channels_for_live: List of channel names (or indexes) to put on the out_buffer_queue. If [] or None, no channels will be put on the out_buffer_queue.
@@ -48,6 +48,8 @@ class GUSBAmpStreamer(CCDLEEGParent.EEGInterfaceParent):
             raise ValueError('Misc_queue_list and misc_queue_list_channels must be the same length')
         self.misc_queue_list, self.misc_queue_list_channels = misc_queue_list, misc_queue_list_channels
         self.zipped_misc_queue_and_channel_list = zip(self.misc_queue_list, self.misc_queue_list_channels)
+        for misc_index, wanted_misc_channels in enumerate(self.misc_queue_list_channels or []):
+            self.channel_router.add_route('misc%d' % misc_index, wanted_misc_channels)
         self.samples_to_save = samples_to_save
 
         # first resolve an EEG stream on the lab network
@@ -66,58 +68,71 @@ class GUSBAmpStreamer(CCDLEEGParent.EEGInterfaceParent):
         """
         print "Starting recording..."
 
-        # samples to save counter
-        counter = 0
-
-        misc_queue_buffer = None
+        # One accumulator per misc queue, created when the first sample arrives (so we know the number of channels).
+        # The consumers of the misc queues keep the blocks, so they are not recycled.
+        self.misc_accumulators = [None] * len(self.zipped_misc_queue_and_channel_list)
 
         # ##### Main Loop #### #
         while True:
             sample, timestamp = self.inlet.pull_sample()
-            if self.current_index == 0:
-                print "Receiving Data:", sample
-
-
-            # Get the time we collected the sample
-            self.data_index += 1  # Increase our sample counter
-
-            CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX = self.data_index
-            CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX_2 = self.data_index
-            self.current_index = self.data_index
-            counter += 1
-            # print self.data_index, CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX
-            ###################
-            # Handle the Data #
-            ###################
-            # Save the Data - We put data on the queue to be saved - format for queue (index, time, data)
-            if self.data_save_queue is not None:
-                self.data_save_queue.put((self.data_index, timestamp, sample))
-
-            # Put data on the out queue
-            if self.put_data_on_out_queue_flag and self.out_buffer_queue is not None and self.channels_for_live is not None and self.channels_for_live != []:
-                # Only put on the channels we need.  self.channels_for_live is guaranteed lower case... we'll program defensively
-                if self.channels_for_live == 'all' or self.channels_for_live == 'All' or self.channels_for_live == 'ALL':
-                    trimmed_data_for_out_queue = sample
-                else:
-                    trimmed_data_for_out_queue = [sample[index] for index in self.channels_for_live]
-                self.out_buffer_queue.put(trimmed_data_for_out_queue)
-
-
-            ''' Take care of putting data on our misc queues. '''
-            for misc_queue, wanted_misc_channels in self.zipped_misc_queue_and_channel_list:
-                if wanted_misc_channels.lower().strip() == 'all':
-                    trimmed_data_for_out_queue = np.asarray(sample)
-                else:
-                    trimmed_data_for_out_queue = np.asarray([sample[index] for index in wanted_misc_channels])
-
-                trimmed_data_for_out_queue = np.expand_dims(trimmed_data_for_out_queue, axis=0)
-                assert len(trimmed_data_for_out_queue.shape) == 2
-                misc_queue_buffer = CCDLDataParser.stack_epochs(existing=misc_queue_buffer, new_trial=trimmed_data_for_out_queue, axis=0)
-                # when we save up enough samples, send them to out queue
-                if counter >= self.samples_to_save:
-                    print 'misc shape', misc_queue_buffer.shape
-                    misc_queue.put(misc_queue_buffer)
-                    counter = 0
+            self.handle_sample(sample, timestamp)
+
+    def start_recording_on_loop(self, loop, poll_interval=0.005):
+        """
+        The event loop version of start_recording: rather than blocking on the LSL inlet in a new thread, loop (a
+        CCDLUtil.Utility.EventLoop.EventLoop) polls the inlet every poll_interval seconds and handles all the samples
+        that have arrived.  LSL inlets have no file descriptor to wait on, so they can't be watched with select.
+
+        :param loop: The EventLoop to record on.
+        :param poll_interval: Seconds between polls. Defaults to 5 ms
+        """
+        print "Starting recording..."
+        self.misc_accumulators = [None] * len(self.zipped_misc_queue_and_channel_list)
+        loop.call_every(poll_interval, self._poll_inlet)
+
+    def _poll_inlet(self):
+        samples, timestamps = self.inlet.pull_chunk(timeout=0.0)
+        for sample, timestamp in zip(samples, timestamps):
+            self.handle_sample(sample, timestamp)
+
+    def handle_sample(self, sample, timestamp):
+        """
+        Puts one sample from the inlet on our queues.
+        """
+        if self.current_index == 0:
+            print "Receiving Data:", sample
+        if not self.channel_router.is_resolved():
+            # LSL doesn't give us channel names, so routes use channel indexes.
+            self.channel_router.resolve(num_channels=len(sample))
+
+
+        # Get the time we collected the sample
+        self.data_index += 1  # Increase our sample counter
+
+        CCDLUtil.EEGInterface.EEG_INDEX.set_eeg_index(self.data_index)
+        self.current_index = self.data_index
+        # print self.data_index, CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX
+        ###################
+        # Handle the Data #
+        ###################
+        # Save the Data - We put data on the queue to be saved - format for queue (index, time, data)
+        if self.data_save_queue is not None:
+            self.data_save_queue.put((self.data_index, timestamp, sample))
+
+        # Put data on the out queue
+        if self.put_data_on_out_queue_flag and self.out_buffer_queue is not None and self.channels_for_live is not None and self.channels_for_live != []:
+            # Only put on the channels we need.
+            self.out_buffer_queue.put(self.channel_router.select('live', sample))
+
+
+        ''' Take care of putting data on our misc queues. '''
+        for misc_index, (misc_queue, wanted_misc_channels) in enumerate(self.zipped_misc_queue_and_channel_list):
+            trimmed_data_for_out_queue = self.channel_router.select('misc%d' % misc_index, sample)
+            if self.misc_accumulators[misc_index] is None:
+                self.misc_accumulators[misc_index] = CCDLBuffer.BlockAccumulator(block_size=self.samples_to_save, num_channels=len(trimmed_data_for_out_queue))
+            # when we save up enough samples, send them to the misc queue - shape (samples_to_save, channel)
+            for misc_queue_buffer in self.misc_accumulators[misc_index].add_samples(trimmed_data_for_out_queue):
+                misc_queue.put(misc_queue_buffer)
 
 
 if __name__ == '__main__':
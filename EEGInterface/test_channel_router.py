@@ -0,0 +1,53 @@
+import numpy as np
+import CCDLUtil.EEGInterface.ChannelRouter as ChannelRouter
+
+
+def make_router():
+    router = ChannelRouter.ChannelRouter()
+    router.add_route('live', ['Cz', 'C3'])
+    router.add_route('save', 'All')
+    router.add_route('misc', [2, -1])
+    router.add_route('none', [])
+    router.resolve(channel_names=['C3', 'Cz', 'C4', 'Pz'])
+    return router
+
+
+def test_select_blocks_and_samples():
+    router = make_router()
+    block = np.arange(12.0).reshape(3, 4)
+    np.testing.assert_array_equal(router.select('live', block), block[:, [1, 0]])
+    np.testing.assert_array_equal(router.select('misc', block), block[:, [2, 3]])
+    np.testing.assert_array_equal(router.select('live', [10, 11, 12, 13]), [11, 10])
+    assert router.select('save', block) is block
+    assert router.select('none', block).shape == (3, 0)
+    assert router.has_channels('live') and router.has_channels('save') and not router.has_channels('none')
+    assert router.get_indexes('save') is None
+
+
+def test_select_copy_never_shares_memory():
+    router = make_router()
+    block = np.zeros((2, 4))
+    for name in ['live', 'save', 'misc']:
+        selected = router.select(name, block, copy=True)
+        selected[:] = 1
+    assert not np.any(block)
+
+
+def test_adding_a_route_needs_resolve():
+    router = make_router()
+    assert router.is_resolved()
+    router.add_route('other', ['Pz'])
+    assert not router.is_resolved()
+    router.resolve(channel_names=['C3', 'Cz', 'C4', 'Pz'])
+    np.testing.assert_array_equal(router.get_indexes('other'), [3])
+
+
+def test_invalid_channels_raise():
+    for channels, channel_names, num_channels in [('some', None, None), (['Oz'], ['C3', 'Cz'], None), ([5], None, 4)]:
+        router = ChannelRouter.ChannelRouter()
+        try:
+            router.add_route('live', channels)
+            router.resolve(channel_names=channel_names, num_channels=num_channels)
+        except ValueError:
+            continue
+        assert False, 'Expected a ValueError for %s' % str(channels)
@@ -0,0 +1,51 @@
+import multiprocessing
+import CCDLUtil.EEGInterface.EEG_INDEX as EEG_INDEX
+
+
+def test_index_at_interpolates():
+    clock = EEG_INDEX.EEGIndexClock(capacity=8)
+    assert clock.get_current_index() is None and clock.get_index_at(5.0) is None
+    for eeg_index in range(5):
+        clock.record(eeg_index, timestamp=100.0 + 0.02 * eeg_index)
+    assert clock.get_current_index() == 4
+    assert abs(clock.get_index_at(100.05) - 2.5) < 1e-9
+    assert int(clock.get_index_at(100.05)) == 2
+    # Before the first pair and after the last.
+    assert clock.get_index_at(50.0) == 0 and clock.get_index_at(200.0) == 4
+    assert abs(clock.get_time_of_index(1.5) - 100.03) < 1e-9
+
+
+def test_only_the_last_capacity_pairs_are_kept():
+    clock = EEG_INDEX.EEGIndexClock(capacity=8)
+    for eeg_index in range(20):
+        clock.record(eeg_index, timestamp=float(eeg_index))
+    assert clock.get_num_recorded() == 20
+    assert clock.get_index_at(0.0) == 12
+    assert clock.get_index_at(15.25) == 15.25
+    clock.reset()
+    assert clock.get_current_index() is None
+
+
+def read_clock(clock, result_queue):
+    result_queue.put((clock.get_current_index(), clock.get_index_at(2.5)))
+
+
+def test_read_from_another_process():
+    clock = EEG_INDEX.EEGIndexClock(capacity=8)
+    for eeg_index in range(4):
+        clock.record(eeg_index, timestamp=float(eeg_index))
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=read_clock, args=(clock, result_queue))
+    process.start()
+    assert result_queue.get(timeout=10) == (3, 2.5)
+    process.join()
+
+
+def test_set_eeg_index():
+    EEG_INDEX.INDEX_CLOCK.reset()
+    EEG_INDEX.set_eeg_index(7, id_val=3, timestamp=10.0)
+    EEG_INDEX.set_eeg_index(8, timestamp=11.0)
+    assert EEG_INDEX.EEG_INDEX == EEG_INDEX.EEG_INDEX_2 == EEG_INDEX.CURR_EEG_INDEX == EEG_INDEX.CURR_EEG_INDEX_2 == 8
+    assert EEG_INDEX.EEG_ID_VAL == 3
+    assert EEG_INDEX.get_eeg_index_at(10.5) == 7.5
+    EEG_INDEX.INDEX_CLOCK.reset()
@@ -0,0 +1,73 @@
+import numpy as np
+import CCDLUtil.EEGInterface.EEGInterface as EEGInterface
+
+format_save_item = EEGInterface.EEGInterfaceParent.format_save_item
+format_save_items = EEGInterface.EEGInterfaceParent.format_save_items
+
+
+def assert_same_values(lines, expected_lines, rtol):
+    """
+    Checks that lines hold the same csv values as expected_lines.  Numbers may be written differently (eg. 3 for 3.0),
+    but must be equal up to rtol.
+    """
+    lines, expected_lines = lines.splitlines(), expected_lines.splitlines()
+    assert len(lines) == len(expected_lines)
+    for line, expected_line in zip(lines, expected_lines):
+        fields, expected_fields = line.split(','), expected_line.split(',')
+        assert len(fields) == len(expected_fields)
+        for field, expected_field in zip(fields, expected_fields):
+            if field != expected_field:
+                np.testing.assert_allclose(float(field), float(expected_field), rtol=rtol)
+
+
+def test_format_save_items_matches_format_save_item():
+    items = [(0, 10.5, np.array([[0.1, -2.5, 3.0], [4.0, 0.25, 1e-3]], dtype=np.float32)),
+             (1, 10.75, np.array([0.1, 1 / 3.0, 123456.789])),
+             (2, 11.0, np.array([[1, -2, 2 ** 40]])),
+             (3, 11.25, [0.1, 2, 1 / 3.0]),
+             (4, 11.5, [1, 2, 3]),
+             (None, None, np.array([0.1, 7.0], dtype=np.float32)),
+             (5, None, [[1, 2], [3, 4]]),
+             (6, 12.0, np.array([True, False])),
+             (None, None, '1,2,3\n'),
+             (7, 12.25, 'marker')]
+    assert_same_values(format_save_items(items), ''.join([format_save_item(*item) for item in items]), rtol=1e-7)
+    # Only the items that are not numeric blocks are formatted by format_save_item.
+    assert format_save_items(items[5:]).endswith(''.join([format_save_item(*item) for item in items[6:]]))
+    # float32 data is written as str() writes it, rather than with the digits of its float64 value.
+    assert format_save_items([(None, None, np.array([0.1, -2.5, 1e-3], dtype=np.float32))]) == '0.1,-2.5,0.001\n'
+
+
+def test_format_save_items_keeps_the_precision_of_random_data():
+    rng = np.random.RandomState(0)
+    for dtype, rtol in [(np.float32, 1e-7), (np.float64, 1e-11)]:
+        block = (rng.randn(50, 8) * 100).astype(dtype)
+        lines = format_save_items([(ii, 10.0 + ii, block[ii:ii + 1]) for ii in range(len(block))])
+        written = np.array([line.split(',') for line in lines.splitlines()], dtype=np.float64)
+        np.testing.assert_array_equal(written[:, 0], np.arange(len(block)))
+        np.testing.assert_allclose(written[:, 2:], block, rtol=rtol)
+
+
+def test_batched_saver_drains_queue_on_stop(tmpdir):
+    file_path = str(tmpdir.join('a.csv'))
+    interface = EEGInterface.EEGInterfaceParent(live=False)
+    interface.start_saving_data_batched(file_path, header='index,time,C3,C4', batch_size=16)
+    items = [(ii, 10.0 + ii, np.full((1, 2), ii, dtype=np.float32)) for ii in range(100)]
+    for item in items:
+        interface.data_save_queue.put(item)
+    interface.stop_recording()
+    with open(file_path) as f:
+        assert f.readline() == 'index,time,C3,C4\n'
+        assert_same_values(f.read(), ''.join([format_save_item(*item) for item in items]), rtol=0)
+    assert interface.get_save_backlog() == 0
+
+
+def test_batched_saver_closes_file_on_timeout(tmpdir):
+    file_path = str(tmpdir.join('a.csv'))
+    interface = EEGInterface.EEGInterfaceParent(live=False)
+    interface.start_saving_data_batched(file_path, timeout=0.2)
+    interface.data_save_queue.put((0, 10.0, [1, 2]))
+    # No more data arrives, so the saver stops by itself without stopped being set.
+    assert interface.wait_for_saving(5)
+    with open(file_path) as f:
+        assert f.read() == '0,10.0,1,2\n'
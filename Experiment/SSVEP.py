@@ -8,7 +8,7 @@ import EEGInterface.BrainAmp.BrainAmpInterface as BrainAmp
 import EEGInterface.OpenBCI.OpenBCIInterface as OpenBCI
 from Graphics.CursorTask.CursorTask import CursorTask
 from ArduinoInterface.Arduino2LightInterface import Arduino2LightInterface as Arduino
-from SignalProcessing.Filters import butter_bandpass_filter
+from SignalProcessing.Filters import FilterBank
 from DataManagement.Log import Log
 
 # some constants for the SSVEP demo
@@ -123,8 +123,15 @@ def trial_logic(eeg_system, out_buffer_queue, cursor_task, fs, high_freq, low_fr
         window_size_samples = WINDOW_SIZE_SECONDS * fs
         window_size_packets = window_size_samples / samples_per_packet
 
-        # b is the np array to hold all data in single trial
-        b = np.zeros(shape=(single_trial_duration_samples,))
+        # Each packet is filtered (5 - 30 Hz) once as it arrives, keeping the filter state between packets.
+        filter_bank = FilterBank(fs=fs, num_channels=1)
+        filter_bank.add_bandpass(5, 30, order=2)
+        # The densities of the last window are updated with every packet, so only the new segments are computed.
+        # Only the two frequencies we compare are computed, not the full spectrum.
+        estimator = Fourier.IncrementalWelchEstimator(fs=fs, nperseg=fs, noverlap=fs // 2, window_size=window_size_samples,
+                                                      dtype=np.float32, target_freqs=[high_freq, low_freq])
+        # density is reused for every window.  shape (freq, channel) -> density[0] is high_freq, density[1] is low_freq
+        density = np.zeros(shape=(len(estimator.freqs), 1), dtype=np.float32)
         packet_index = 0
 
         QueueManagement.clear_queue(out_buffer_queue)
@@ -132,23 +139,17 @@ def trial_logic(eeg_system, out_buffer_queue, cursor_task, fs, high_freq, low_fr
             # insert the visualizer here
             packet = out_buffer_queue.get()  # Gives us a (10, 1) matrix.
             # get the sample
-            samples = np.squeeze(packet)      # Gives us a (10,) array
-            sample_index = packet_index * samples_per_packet
-            b[sample_index: sample_index + samples_per_packet] = samples
+            samples = np.array(packet, dtype=np.float64).ravel()      # Gives us a (10,) array
+            filter_bank.filter(samples, out=samples)
+            estimator.add_samples(samples)
             packet_index += 1
-            # if we have enough samples, perform FFT on a single window
+            # if we have enough samples, compare the densities of the last window
             if packet_index != 0 and packet_index % window_size_packets == 0:
-                # print "packet index: ", packet_index, ", do FFT"
-                window = b[packet_index * samples_per_packet - window_size_samples:packet_index * samples_per_packet]
-                # filter using 5 - 30 Hz
-                window = butter_bandpass_filter(window, 5, 30, 250, order=2)
-                # perform FFT
-                freq, density = Fourier.get_fft_all_channels(data=np.expand_dims(np.expand_dims(window, axis=0), axis=2),
-                                                             fs=fs, noverlap=fs // 2, nperseg=fs)
+                freq, density = estimator.get_density(out=density)
 
                 # compare densities of 17Hz and 15Hz frequencies
                 #print density.shape
-                if density[0][high_freq][0] <= density[0][low_freq][0]:
+                if density[0][0] <= density[1][0]:
                     cursor_x += STEP
                     cursor_task.move_cursor_delta_x(STEP)
                 else:
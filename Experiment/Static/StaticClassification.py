@@ -5,8 +5,10 @@ import CCDLUtil.Utility.Constants as CCDLConstants
 import CCDLUtil.Utility.SystemInformation as CCDLSI
 import CCDLUtil.Graphics.PyCrosshair as CCDLPyCross
 import CCDLUtil.SignalProcessing.Fourier as CCDLFourier
+import CCDLUtil.SignalProcessing.Filters as CCDLFilters
 import CCDLUtil.DataManagement.DataParser as CCDLDataParser
 import CCDLUtil.DataManagement.FileParser as CCDLFileParser
+import CCDLUtil.DataManagement.EEGRecording as CCDLEEGRecording
 import CCDLUtil.EEGInterface.DataSaver as CCDLEEGDatasaver
 import CCDLUtil.EEGInterface.gUSBAmp.GUSBAmpInterface as CCDLGusb
 import CCDLUtil.Experiment.Static.Static_ML_Util as CCDL_Static_ML
@@ -36,6 +38,21 @@ def get_channel_info(eeg_system):
     return channel_list, channel_dict
 
 
+def trim_channels_by_type(channel_data, eeg_type):
+    """
+    Removes the channels of our eeg system that are not eeg (like the heart channel of the BrainAmp).
+
+    :param channel_data: Our channel data of shape (sample, channel), without the index stamps and timestamps.
+    :param eeg_type: str - our eeg system type
+    :return: trim_data, aux_data
+    """
+    if eeg_type != CCDLConstants.EEGSystemNames.BRAIN_AMP:
+        raise ValueError('Only BrainAmp recordings are supported')
+    trim_data = channel_data[:, :-1]  # remove the heart channel.
+    assert trim_data.shape[1] == 31  # Assure we have 31 channels.
+    return trim_data, None
+
+
 def extract_bci_data_by_type(eeg_data, eeg_type, eeg_col_index=0, clock_col_index=1):
     """
 
@@ -47,16 +64,36 @@ def extract_bci_data_by_type(eeg_data, eeg_type, eeg_col_index=0, clock_col_inde
     """
     eeg_indexes = eeg_data[:, eeg_col_index]
     clock_times = eeg_data[:, clock_col_index]
-    aux_data = None
-    if eeg_type == CCDLConstants.EEGSystemNames.BRAIN_AMP:
-        trim_data = eeg_data[:, clock_col_index + 1:-1]  # remove the index stamps, timestamps and heart channel.
-        assert trim_data.shape[1] == 31  # Assure we have 31 channels.
-    else:
-        raise NotImplemented('Only extracting BrainAmp data is supported currently.')
+    # remove the index stamps and timestamps.
+    trim_data, aux_data = trim_channels_by_type(eeg_data[:, clock_col_index + 1:], eeg_type)
+    return eeg_indexes, clock_times, trim_data, aux_data
+
+
+def extract_bci_recording_by_type(eeg_file_path, eeg_type, fs, skiprows=15):
+    """
+    Same as extract_bci_data_by_type on the loaded csv, but the csv is converted (once) to a binary recording that is
+    memory mapped. All returned arrays are np.memmap views, so nothing is loaded into memory until it is used
+    (for example when epoching). Channel data is returned as float32.
+
+    :param eeg_file_path: Path to our eeg csv file.
+    :param eeg_type: str - our eeg system type
+    :param fs: Sampling rate of the eeg data.
+    :param skiprows: Number of header rows in the csv. Defaults to 15
+    :return: eeg_indexes, clock_times, trim_data, aux_data
+    """
+    reader = CCDLEEGRecording.load_csv_as_recording(csv_file_path=eeg_file_path, fs=fs, skiprows=skiprows)
+    eeg_indexes, clock_times, channel_data = reader.memmap()
+    trim_data, aux_data = trim_channels_by_type(channel_data, eeg_type)
     return eeg_indexes, clock_times, trim_data, aux_data
 
 
-def extract_csv(log_file_path, eeg_file_path, header_size=1):
+def extract_csv(log_file_path, eeg_file_path, header_size=1, use_memmap=False):
+    """
+    Loads our log file and eeg csv file.
+
+    :param use_memmap: If True, the eeg csv is converted once to a binary recording (saved next to the csv) and memory
+                       mapped instead of being parsed every time. Defaults to False
+    """
     trial_list, header_list = CCDLFileParser.load_ast_dictionary_by_trial(file_path=log_file_path, header_size=header_size)
     start_eeg_index_keys = header_list[0]['start_eeg_index_keys']
     start_time_list_keys = header_list[0]['start_time_list_keys']
@@ -68,8 +105,11 @@ def extract_csv(log_file_path, eeg_file_path, header_size=1):
     date_collected = header_list[0]['date_collected']
     eeg_type = header_list[0]['EEG_SYSTEM']
     task_description = header_list[0]['task_description']
-    eeg_indexes, clock_times, eeg_data, aux_data = extract_bci_data_by_type(eeg_data=CCDLFileParser.iter_loadtxt(filename=eeg_file_path, skiprows=15),
-                                                                            eeg_type=eeg_type)
+    if use_memmap:
+        eeg_indexes, clock_times, eeg_data, aux_data = extract_bci_recording_by_type(eeg_file_path=eeg_file_path, eeg_type=eeg_type, fs=fs)
+    else:
+        eeg_indexes, clock_times, eeg_data, aux_data = extract_bci_data_by_type(eeg_data=CCDLFileParser.iter_loadtxt(filename=eeg_file_path, skiprows=15),
+                                                                                eeg_type=eeg_type)
     return start_eeg_index_keys, start_time_list_keys, end_eeg_index_keys, end_time_list_keys, tasks, eeg_type, task_description, eeg_indexes, clock_times, eeg_data, fs, date_collected, subject_name, aux_data, trial_list, header_list
 
 
@@ -113,9 +153,10 @@ def save_classifier(log_file_path, classifier, verbose=True):
         print "Classifier saved to:", new_path
 
 
-def main(log_file_path, eeg_file_path, eeg_type, channel_list, channel_dict, labels, relevant_indexes, feature_type, left_ssvep=11, right_ssvep=13, extract_by='indexes'):
+def main(log_file_path, eeg_file_path, eeg_type, channel_list, channel_dict, labels, relevant_indexes, feature_type, left_ssvep=11, right_ssvep=13, extract_by='indexes', use_memmap=False,
+         filter_band=None, filter_order=4, filter_threads=1):
     start_eeg_index_keys, start_time_list_keys, end_eeg_index_keys, end_time_list_keys, tasks, eeg_type, task_description, eeg_indexes, clock_times, \
-        eeg_data, fs, date_collected, subject_name, aux_data, trial_list, header_list = extract_csv(log_file_path, eeg_file_path)
+        eeg_data, fs, date_collected, subject_name, aux_data, trial_list, header_list = extract_csv(log_file_path, eeg_file_path, use_memmap=use_memmap)
 
     mat_save_path = log_file_path.replace('_log.txt', '.mat')
 
@@ -131,11 +172,11 @@ def main(log_file_path, eeg_file_path, eeg_type, channel_list, channel_dict, lab
     """ Epoch the data """
     if extract_by == 'indexes':
         epoched_data_list = CCDLDataParser.epoch_data_from_key(eeg_data_indexes=eeg_indexes, eeg_data=eeg_data, trial_list=trial_list,
-                                                               start_key_list=start_eeg_index_keys, end_key_list=end_eeg_index_keys)
+                                                               start_key_list=start_eeg_index_keys, end_key_list=end_eeg_index_keys, allow_view=True)
     else:
         # Extract by time.
         epoched_data_list = CCDLDataParser.epoch_data_from_key(eeg_data_indexes=clock_times, eeg_data=eeg_data, trial_list=trial_list,
-                                                               start_key_list=start_time_list_keys, end_key_list=end_time_list_keys)
+                                                               start_key_list=start_time_list_keys, end_key_list=end_time_list_keys, allow_view=True)
     assert len(epoched_data_list) == len(labels)
 
     """ Tidy up our Epochs. """
@@ -147,20 +188,31 @@ def main(log_file_path, eeg_file_path, eeg_type, channel_list, channel_dict, lab
     epoched_data = np.concatenate((epoched_data_list[0], epoched_data_list[1]), axis=0)
     labels = [labels[0]] * len(epoched_data_list[0]) + [labels[1]] * len(epoched_data_list[1])  # Create our labels
 
-    rewindowed_epoched_data, labels, windows_per_epoch = CCDLDataParser.reepoch_data_with_fixed_window_size(epoched_data=epoched_data, labels=labels, window_size=CLASSIFICATION_WINDOW_SIZE_SECONDS * fs)
+    """ Filter our Epochs """
+    if filter_band is not None:
+        # Zero phase bandpass each epoch. epoched_data is a new array (from the concatenate), so we filter it in place.
+        sos = CCDLFilters.butter_bandpass_sos(low=filter_band[0], high=filter_band[1], fs=fs, order=filter_order)
+        CCDLFilters.batch_filtfilt(data=epoched_data, sos=sos, axis=1, out=epoched_data, num_threads=filter_threads)
+
+    windows, labels, windows_per_epoch = CCDLDataParser.reepoch_data_with_fixed_window_size(epoched_data=epoched_data, labels=labels, window_size=CLASSIFICATION_WINDOW_SIZE_SECONDS * fs, as_view=True)
+    # Only copy the relevant channels out of our windows view.  windows -> shape (epoch, window, sample, channel)
+    rewindowed_epoched_data = windows[:, :, :, relevant_indexes]
+    rewindowed_epoched_data = rewindowed_epoched_data.reshape((-1,) + rewindowed_epoched_data.shape[2:])
     # rewindowed_epoched_data -> shape (epoch, sample, channel)
-    rewindowed_epoched_data = CCDLDataParser.idempotent_add_channel_dimension(rewindowed_epoched_data[:, :, relevant_indexes])
+    rewindowed_epoched_data = CCDLDataParser.idempotent_add_channel_dimension(rewindowed_epoched_data)
 
     """ Extract our Features """
-    freqs, density = CCDLFourier.get_fft_all_channels(data=rewindowed_epoched_data, fs=fs, nperseg=nperseg, noverlap=noverlap)
-
     # Todo fix this so it can do more than just alpha.
     if feature_type == CCDLStaticConstants.ALPHA:
+        freqs, density = CCDLFourier.get_fft_all_channels(data=rewindowed_epoched_data, fs=fs, nperseg=nperseg, noverlap=noverlap)
         feature_names, features = CCDL_Static_ML.extact_alpha_features_single_channel(freqs=freqs, density_from_only_relevant_channels=density, inclusive_exclusive_alpha_band=(8, 13))
     elif feature_type == CCDLStaticConstants.SSVEP_ALPHA:
+        freqs, density = CCDLFourier.get_fft_all_channels(data=rewindowed_epoched_data, fs=fs, nperseg=nperseg, noverlap=noverlap)
         feature_names, features = CCDL_Static_ML.extact_alpha_features_single_channel(freqs=freqs, density_from_only_relevant_channels=density, inclusive_exclusive_alpha_band=(8, 14))
     elif feature_type == CCDLStaticConstants.SSVEP_LR:
-        feature_names, features = CCDL_Static_ML.extract_ssvep_features(freqs=freqs, density_from_only_relevant_channels=density, freq_left=left_ssvep, freq_right=right_ssvep)
+        # Only the densities at the two light frequencies are needed.
+        feature_names, features = CCDL_Static_ML.extract_targeted_ssvep_features(epoched_data=rewindowed_epoched_data, fs=fs, nperseg=nperseg, noverlap=noverlap,
+                                                                                 freq_left=left_ssvep, freq_right=right_ssvep)
     else:
         raise
     features = features.squeeze()
@@ -23,6 +23,28 @@ def extract_ssvep_features(freqs, density_from_only_relevant_channels, freq_left
     return feature_names, features
 
 
+def extract_targeted_ssvep_features(epoched_data, fs, nperseg, noverlap, freq_left, freq_right, num_harmonics=1):
+    """
+    Drop in replacement for extract_ssvep_features(*CCDLFourier.get_fft_all_channels(epoched_data, ...)) that only computes
+    the densities at the light frequencies (and their harmonics) rather than the full spectrum.
+    With nperseg == fs and whole Hz frequencies, the features are the same as those of extract_ssvep_features.
+
+    :param epoched_data: shape (epoch, sample, channel)
+    :param fs: sampling rate
+    :param nperseg: nperseg for welch
+    :param noverlap: noverlap for welch
+    :param freq_left: int - frequency of the left light
+    :param freq_right: int - frequency of the right light
+    :param num_harmonics: Number of multiples of each light frequency to include. Defaults to 1 (only the fundamentals)
+    :return: feature_names, features
+        features is a np array of shape [epoch, feature, channel]
+    """
+    freqs, features = CCDLFourier.get_targeted_power_all_channels(data=epoched_data, fs=fs, target_freqs=[freq_left, freq_right],
+                                                                  nperseg=nperseg, noverlap=noverlap, num_harmonics=num_harmonics)
+    feature_names = CCDLFourier.get_harmonics([freq_left, freq_right], num_harmonics=num_harmonics, max_freq=fs / 2.0)
+    return feature_names, features
+
+
 def extract_single_ssvep_features(freqs, density_from_only_relevant_channels, freq_left, freq_right):
     """
     :param freqs = list of freqs
@@ -5,8 +5,8 @@ import time
 import math
 from random import randrange  # for starfield, random number generator
 from random import randint
-import scipy.signal as sig
 import CCDLUtil.DataManagement.DataParser as CCDLDataParser
+import CCDLUtil.SignalProcessing.Fourier as CCDLFourier
 import Queue
 
 
@@ -193,7 +193,7 @@ def main(data_queue, fs, nperseg=None, noverlap=None):
 
                 #print BaselinedValues[channel, :].shape
                 print BaselinedValues.shape
-                freq, density = sig.welch(BaselinedValues, fs=fs, nperseg=512, noverlap=200, scaling='density')
+                freq, density = CCDLFourier.welch(BaselinedValues, fs=fs, nperseg=512, noverlap=200, scaling='density')
                 #print 'Density.shape', density.shape
 
                 timeseriesindex = 0
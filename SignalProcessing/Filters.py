@@ -4,6 +4,7 @@ For filters related to EEG data processing.
 
 import numpy as np
 import scipy.signal as scisig
+from multiprocessing.pool import ThreadPool
 
 def butter_bandpass(low, high, fs, order=5):
     """
@@ -18,7 +19,7 @@ def butter_bandpass(low, high, fs, order=5):
     b, a = scisig.butter(order, [low / nyq, high / nyq], btype='band')
     return b, a
 
-def butter_bandpass_filter(data, low, high, fs, order=5):
+def butter_bandpass_filter(data, low, high, fs, order=5, axis=-1):
     """
     Filters passed data with a bandpass butter function
     :param data: data to be bandpass filtered
@@ -26,8 +27,254 @@ def butter_bandpass_filter(data, low, high, fs, order=5):
     :param high: Frequency to filter below
     :param fs: Sampling rate (hz)
     :param order: Order of filter to use (default = 5)
+    :param axis: Axis of the samples (the mean is removed and the data filtered along this axis). Defaults to -1
     :return: filtered data (and modifies original data).
     """
     b, a = butter_bandpass(low, high, fs, order=order)
-    data = data - np.mean(data)
-    return scisig.lfilter(b, a, data)
\ No newline at end of file
+    data = data - np.mean(data, axis=axis, keepdims=True)
+    return scisig.lfilter(b, a, data, axis=axis)
+
+
+def butter_bandpass_sos(low, high, fs, order=4):
+    """
+    Same as butter_bandpass, but returns the filter as second order sections (which is numerically stable for higher
+    orders and is what sosfilt and sosfiltfilt expect).
+    :return: sos - np array of shape (section, 6)
+    """
+    nyq = 0.5 * fs
+    return scisig.butter(order, [low / nyq, high / nyq], btype='band', output='sos')
+
+
+def batch_filtfilt(data, sos, axis=1, out=None, num_threads=1, max_chunk_bytes=2 ** 27):
+    """
+    Zero phase filters data along the sample axis with scipy.signal.sosfiltfilt, a block of channels at a time.
+
+    data is typically epoched data of shape (epoch, sample, channel) (axis=1), or a whole session of shape
+    (sample, channel) (axis=0).  Channels are split into chunks of at most max_chunk_bytes of data, and only one chunk
+    (per thread) is held in memory at a time.  Thus if data is a np.memmap (ie. from EEGRecordingReader.memmap) and out is
+    a writable np.memmap (or data itself when it's writable), a whole session can be filtered without loading it all.
+
+    :param data: np array (or np.memmap) with channels along the last axis.
+    :param sos: Filter as second order sections (ie. from butter_bandpass_sos or FilterBank.sos)
+    :param axis: Sample axis of data. Must not be the last (channel) axis. Defaults to 1
+    :param out: Optional -- np array of the same shape as data to write the result into. Can be data itself to filter in
+                place. If None, a new array is returned. Defaults to None
+    :param num_threads: Number of threads to filter chunks of channels in parallel. Defaults to 1
+    :param max_chunk_bytes: Maximum size of data in each chunk. Defaults to 128 MB
+    :return: The filtered data (out, if given).
+    """
+    if axis % data.ndim == data.ndim - 1:
+        raise ValueError('The sample axis cannot be the channel (last) axis.  Data Shape %s' % str(data.shape))
+    num_channels = data.shape[-1]
+    if out is None:
+        out = np.empty(data.shape, dtype=np.result_type(data.dtype, np.float32))
+    channel_bytes = max(1, data.nbytes // max(1, num_channels))
+    chunk_channels = int(max(1, min(num_channels, max_chunk_bytes // channel_bytes)))
+    if num_threads > 1:
+        # Give every thread at least one chunk.
+        chunk_channels = max(1, min(chunk_channels, -(-num_channels // num_threads)))
+
+    def filter_chunk(start):
+        chunk = np.asarray(data[..., start:start + chunk_channels])
+        out[..., start:start + chunk_channels] = scisig.sosfiltfilt(sos, chunk, axis=axis)
+
+    starts = range(0, num_channels, chunk_channels)
+    if num_threads > 1 and len(starts) > 1:
+        pool = ThreadPool(processes=num_threads)
+        try:
+            pool.map(filter_chunk, starts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for start in starts:
+            filter_chunk(start)
+    return out
+
+
+class PolyphaseDecimator(object):
+    """
+    A stateful, anti-aliased FIR decimator for data of shape (sample, channel).
+
+    Data can be passed in blocks of any size (such as one packet at a time).  The last numtaps - 1 samples of each block
+    are kept so that the filter runs continuously across blocks, thus decimating block by block gives the same result as
+    decimating the whole recording at once.  Only the output samples that are kept are computed (the polyphase form),
+    and all channels are filtered at once.
+
+    The FIR filter is linear phase with a delay of (numtaps - 1) / 2 input samples (see delay).  Output sample k is
+    centered on input sample k * factor - delay, so the output lags the plain data[::factor] slice by delay input samples
+    (20 ms with the defaults when decimating 5000 Hz to 500 Hz).  An event at input sample n is at output sample
+    (n + delay) / factor - correct for this when epoching decimated data from event indexes or times.
+    """
+
+    def __init__(self, factor=None, fs=None, target_fs=None, numtaps=None, cutoff=0.8, window='hamming'):
+        """
+        Either factor or both fs and target_fs must be passed.
+
+        :param factor: int - The decimation factor.  Every factor-th (filtered) sample is kept.
+        :param fs: Original sampling rate (Hz).
+        :param target_fs: Desired sampling rate (Hz). fs / target_fs must be an integer.
+        :param numtaps: Length of the anti-aliasing filter.  Defaults to 20 * factor + 1.
+        :param cutoff: Cutoff of the anti-aliasing filter as a fraction of the new nyquist frequency.
+                       Defaults to 0.8 (ie. 200 Hz when decimating to 500 Hz).
+        :param window: Window used to design the filter (see scipy.signal.firwin). Defaults to 'hamming'.
+        """
+        if factor is None:
+            if fs is None or target_fs is None:
+                raise ValueError('Either factor or both fs and target_fs must be passed.')
+            factor = fs / float(target_fs)
+            if abs(factor - round(factor)) > 1e-9:
+                raise ValueError('fs / target_fs must be an integer: %s / %s' % (str(fs), str(target_fs)))
+        factor = int(round(factor))
+        if factor < 1:
+            raise ValueError('The decimation factor must be a positive integer: %d' % factor)
+        if factor == 1:
+            # Nothing to filter out, so we pass the data through unchanged.
+            numtaps = 1
+        elif numtaps is None:
+            numtaps = 20 * factor + 1
+        self.factor = factor
+        self.numtaps = numtaps
+        # Group delay of the filter, in input samples.  Divide by the original sampling rate for seconds.
+        self.delay = (numtaps - 1) / 2.0
+        self.taps = scisig.firwin(numtaps, cutoff / factor, window=window) if factor > 1 else np.ones(1)
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the filter state, as if no data has been passed.
+        """
+        self._history = None
+        # Index (in the next block) of the next sample to keep.
+        self._phase = 0
+
+    def decimate(self, data):
+        """
+        Filters and decimates the next block of data.
+        :param data: np array of shape (sample, channel).  All blocks must have the same number of channels.
+        :return: The decimated block - shape (new sample, channel).  The number of samples returned is the number of
+                 kept sample positions in this block, thus this can vary by one from block to block if the block size is
+                 not a multiple of factor.
+        """
+        data = np.asarray(data)
+        if data.ndim != 2:
+            raise ValueError("Must be shape (sample, channel).  Actual Shape %s" % str(data.shape))
+        if self._history is None:
+            dtype = data.dtype if data.dtype in (np.float32, np.float64) else np.float64
+            self._history = np.zeros((self.numtaps - 1, data.shape[1]), dtype=dtype)
+            self._reversed_taps = self.taps[::-1].astype(dtype)
+        extended = np.concatenate((self._history, data), axis=0)
+        num_samples = data.shape[0]
+        num_out = max(0, (num_samples - self._phase + self.factor - 1) // self.factor)
+        # Window ii covers the numtaps samples ending at the ii-th kept sample.  This is a view - nothing is copied.
+        windows = np.lib.stride_tricks.as_strided(extended[self._phase:],
+                                                  shape=(num_out, self.numtaps, extended.shape[1]),
+                                                  strides=(self.factor * extended.strides[0],) + extended.strides)
+        decimated = np.tensordot(windows, self._reversed_taps, axes=([1], [0]))
+        self._phase = self._phase + num_out * self.factor - num_samples
+        self._history = extended[num_samples:].copy()
+        return decimated
+
+
+class FilterBank(object):
+    """
+    A stateful chain of IIR filters for streaming data of shape (sample, channel).
+
+    Every stage is designed once (as second order sections) when it is added, and the filter state of every channel is
+    kept between calls, so filtering a stream block by block (ie. packet by packet) gives the same result as filtering
+    the whole stream at once.  Each sample only needs to be filtered once, and there are no edge transients at the
+    start of each block.
+
+    Example:
+        bank = FilterBank(fs=250, num_channels=8)
+        bank.add_highpass(1)
+        bank.add_notch(60)
+        bank.add_bandpass(5, 30)
+        filtered = bank.filter(packet)
+    """
+
+    def __init__(self, fs, num_channels=1, initialize_from_first_sample=True):
+        """
+        :param fs: Sampling rate (hz)
+        :param num_channels: Number of channels in each block.
+        :param initialize_from_first_sample: If True, the filter state is set from the first sample filtered (as if the
+                                             signal had been constant at that value before), rather than zeros.  This
+                                             avoids a large transient from the DC offset of the EEG at the start of the
+                                             stream. Defaults to True
+        """
+        self.fs = fs
+        self.num_channels = num_channels
+        self.initialize_from_first_sample = initialize_from_first_sample
+        self.sos = np.zeros((0, 6))
+        self.zi = None
+
+    def add_bandpass(self, low, high, order=4):
+        """
+        Adds a butterworth bandpass stage.
+        :param low: Frequency to filter above
+        :param high: Frequency to filter below
+        :param order: Order of filter to use (default = 4)
+        """
+        nyq = 0.5 * self.fs
+        self._add_stage(scisig.butter(order, [low / nyq, high / nyq], btype='band', output='sos'))
+
+    def add_highpass(self, cutoff, order=4):
+        """
+        Adds a butterworth highpass stage.
+        :param cutoff: Frequency to filter above
+        :param order: Order of filter to use (default = 4)
+        """
+        self._add_stage(scisig.butter(order, cutoff / (0.5 * self.fs), btype='highpass', output='sos'))
+
+    def add_lowpass(self, cutoff, order=4):
+        """
+        Adds a butterworth lowpass stage.
+        :param cutoff: Frequency to filter below
+        :param order: Order of filter to use (default = 4)
+        """
+        self._add_stage(scisig.butter(order, cutoff / (0.5 * self.fs), btype='lowpass', output='sos'))
+
+    def add_notch(self, freq, quality=30.0):
+        """
+        Adds a notch stage (ie. to remove 60 hz line noise).
+        :param freq: Frequency to remove
+        :param quality: Quality factor of the notch - the higher, the narrower the notch. Defaults to 30
+        """
+        b, a = scisig.iirnotch(freq / (0.5 * self.fs), quality)
+        self._add_stage(scisig.tf2sos(b, a))
+
+    def _add_stage(self, sos):
+        self.sos = np.concatenate((self.sos, sos), axis=0)
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the filter state (ie. between trials).
+        """
+        self.zi = None
+
+    def filter(self, data, out=None):
+        """
+        Filters a block of samples, continuing from the previous block.
+
+        :param data: np array of shape (sample, channel), or (sample,) if there is only one channel.
+        :param out: Optional -- np array of the same shape as data to write the filtered samples into. Pass data itself to
+                    filter in place. Defaults to None
+        :return: The filtered block (out, if given).
+        """
+        if len(self.sos) == 0:
+            raise ValueError('No filter stages have been added')
+        data = np.asarray(data)
+        samples = data.reshape((-1, self.num_channels))
+        if len(samples) == 0:
+            return data if out is None else out
+        if self.zi is None:
+            # zi - shape (section, 2, channel)
+            self.zi = np.zeros((len(self.sos), 2, self.num_channels))
+            if self.initialize_from_first_sample:
+                self.zi += scisig.sosfilt_zi(self.sos)[:, :, np.newaxis] * samples[0]
+        filtered, self.zi = scisig.sosfilt(self.sos, samples, axis=0, zi=self.zi)
+        if out is None:
+            return filtered.reshape(data.shape)
+        out.reshape((-1, self.num_channels))[...] = filtered
+        return out
@@ -4,10 +4,15 @@ Functions related to the fourier transform.
 
 import scipy.signal as scisig
 import bisect
+import collections
 import matplotlib.pyplot as plt
 import numpy as np
 import CCDLUtil.DataManagement.DataParser as CCDLDataParser
 
+# Number of WelchEstimators kept by get_welch_estimator.
+WELCH_ESTIMATOR_CACHE_SIZE = 8
+_welch_estimator_cache = collections.OrderedDict()
+
 
 def get_channel_fft(single_channel_signal, fs, nperseg, noverlap, filter_sig=False, filter_above=40, filter_below=1):
     """ Returns frequencies and densities from the welch algorithm filtered as appropriate
@@ -21,26 +26,307 @@ def get_channel_fft(single_channel_signal, fs, nperseg, noverlap, filter_sig=Fal
     return freqs, density
 
 
-def get_fft_all_channels(data, fs, nperseg, noverlap):
+class WelchEstimator(object):
+
+    def __init__(self, fs, nperseg, noverlap=None, window='hann', scaling='density', dtype=np.float64, target_freqs=None):
+        """
+        Welch's power spectral density estimate with everything that only depends on the parameters (the window, its
+        scaling, the frequency vector and the segment layout for each input length) computed once.  Calling estimate
+        repeatedly (ie. for each window of an online loop) gives the same result as
+        scipy.signal.welch(x, fs=fs, nperseg=nperseg, noverlap=noverlap, window=window, scaling=scaling, axis=axis)
+        with the scipy defaults for everything else (constant detrending, one sided, mean over segments).
+
+        If target_freqs is given, only those frequencies are computed.  Instead of an fft of each segment, each segment is
+        multiplied with a precomputed table of the windowed complex exponentials at the target frequencies (the
+        vectorized equivalent of running the Goertzel algorithm for each frequency).  For a few frequencies this is much
+        cheaper than the full spectrum, and at frequencies that fall on an fft bin (ie. whole Hz with nperseg == fs)
+        the result is the same as the full estimate at that bin.
+
+        Use get_welch_estimator to share estimators with the same parameters.
+
+        :param fs: sampling rate
+        :param nperseg: Length of each segment
+        :param noverlap: Number of samples to overlap between segments.  If None, nperseg // 2 (as in scipy).
+        :param window: Window passed to scipy.signal.get_window. Defaults to 'hann'
+        :param scaling: 'density' (V**2/Hz) or 'spectrum' (V**2).  Defaults to 'density'
+        :param dtype: dtype of the returned densities (np.float32 or np.float64). Defaults to np.float64
+        :param target_freqs: Optional -- list of frequencies (Hz) to compute.  If None, the full one sided spectrum is
+                             computed. Defaults to None
+        """
+        noverlap = nperseg // 2 if noverlap is None else noverlap
+        if noverlap >= nperseg:
+            raise ValueError('noverlap must be less than nperseg.')
+        self.fs, self.nperseg, self.noverlap, self.dtype = fs, nperseg, noverlap, np.dtype(dtype)
+        self.step = nperseg - noverlap
+        self.window = scisig.get_window(window, nperseg).astype(self.dtype)
+        if scaling == 'density':
+            scale = 1.0 / (fs * np.sum(self.window ** 2))
+        elif scaling == 'spectrum':
+            scale = 1.0 / np.sum(self.window) ** 2
+        else:
+            raise ValueError('Unknown scaling: %s' % str(scaling))
+        if target_freqs is None:
+            self.freqs = np.fft.rfftfreq(nperseg, 1.0 / fs)
+            self.kernel, self.kernel_sum = None, None
+        else:
+            self.freqs = np.asarray(target_freqs, dtype=np.float64)
+            if np.any(self.freqs < 0) or np.any(self.freqs > fs / 2.0):
+                raise ValueError('Target frequencies must be between 0 and fs / 2 (%s Hz)' % str(fs / 2.0))
+            # Windowed complex exponentials - shape (nperseg, freq)
+            self.kernel = self.window[:, np.newaxis] * np.exp(-2j * np.pi * np.outer(np.arange(nperseg), self.freqs) / fs)
+            # Used to remove the segment mean (constant detrending) after multiplying with the kernel.
+            self.kernel_sum = np.sum(self.kernel, axis=0)
+        # One sided spectrum - every bin except DC (and Nyquist if nperseg is even) is doubled.
+        self.bin_scale = np.full(len(self.freqs), 2.0 * scale)
+        self.bin_scale[self.freqs == 0] = scale
+        if nperseg % 2 == 0:
+            self.bin_scale[self.freqs == fs / 2.0] = scale
+        self._num_segments = {}
+
+    def get_num_segments(self, num_samples):
+        """
+        Returns the number of segments in an input of num_samples samples.
+        """
+        if num_samples not in self._num_segments:
+            if num_samples < self.nperseg:
+                raise ValueError('Input of %d samples is shorter than nperseg (%d)' % (num_samples, self.nperseg))
+            self._num_segments[num_samples] = (num_samples - self.nperseg) // self.step + 1
+        return self._num_segments[num_samples]
+
+    def get_segment_power(self, data):
+        """
+        Returns the unscaled power of each (detrended and windowed) segment of data.  Multiply by bin_scale to get the
+        density (or spectrum) of each segment.
+
+        :param data: np array with samples along the last axis.
+        :return: np array of shape (..., segment, freq)
+        """
+        data = np.asarray(data, dtype=self.dtype)
+        num_segments = self.get_num_segments(data.shape[-1])
+        # Segment view - shape (..., segment, nperseg).  No data is copied.
+        segments = np.lib.stride_tricks.as_strided(data, shape=data.shape[:-1] + (num_segments, self.nperseg),
+                                                   strides=data.strides[:-1] + (self.step * data.strides[-1], data.strides[-1]))
+        if self.kernel is not None:
+            spectrum = np.dot(segments, self.kernel) - np.mean(segments, axis=-1, keepdims=True) * self.kernel_sum
+        else:
+            segments = (segments - np.mean(segments, axis=-1, keepdims=True)) * self.window
+            spectrum = np.fft.rfft(segments, axis=-1)
+        return np.square(spectrum.real) + np.square(spectrum.imag)
+
+    def estimate(self, data, axis=-1, out=None):
+        """
+        Returns the power spectral density of data along axis.
+
+        :param data: np array. The spectrum is estimated along axis, all other axes are kept.
+        :param axis: Axis of data to estimate along (ie. 1 for data of shape (epoch, sample, channel)). Defaults to -1
+        :param out: Optional -- np array to write the densities into.  Must be the shape of data with axis replaced by
+                    the number of frequencies. Defaults to None
+        :return: freqs, density
+        """
+        power = self.get_segment_power(np.moveaxis(data, axis, -1))
+        if out is None:
+            density = np.mean(power, axis=-2).astype(self.dtype)
+            density *= self.bin_scale
+            return self.freqs, np.moveaxis(density, -1, axis)
+        out_view = np.moveaxis(out, axis, -1)
+        if out_view.shape != power.shape[:-2] + (len(self.freqs),):
+            raise ValueError("out must have %d frequencies along axis %d and match data on all other axes.  Actual Shape %s" % (len(self.freqs), axis, str(out.shape)))
+        np.mean(power, axis=-2, out=out_view)
+        out_view *= self.bin_scale
+        return self.freqs, out
+
+
+class IncrementalWelchEstimator(object):
+
+    def __init__(self, fs, nperseg, window_size, num_channels=1, noverlap=None, window='hann', scaling='density', dtype=np.float64,
+                 target_freqs=None):
+        """
+        Welch's estimate over a sliding window of a stream of samples, updated as samples arrive.
+
+        The periodogram of each segment is computed once, when the segment is complete, and kept in a ring of the last
+        num_segments periodograms along with their running sum.  Adding a packet therefore only costs the segments it
+        completes, however long the window is.
+
+        Segments start every nperseg - noverlap samples of the stream.  Whenever the stream length is a multiple of
+        nperseg - noverlap (and at least window_size), get_density returns the same result as Welch over the last
+        window_size samples.
+
+        :param fs: sampling rate
+        :param nperseg: Length of each segment
+        :param window_size: Number of samples in the sliding window (ie. 2 * fs for a 2 second window).
+        :param num_channels: Number of channels in each block of samples. Defaults to 1
+        :param noverlap: Number of samples to overlap between segments.  If None, nperseg // 2.
+        :param window: Window passed to scipy.signal.get_window. Defaults to 'hann'
+        :param scaling: 'density' (V**2/Hz) or 'spectrum' (V**2).  Defaults to 'density'
+        :param dtype: dtype of the returned densities (np.float32 or np.float64). Defaults to np.float64
+        :param target_freqs: Optional -- list of frequencies (Hz) to compute (see WelchEstimator). Defaults to None
+        """
+        self.estimator = get_welch_estimator(fs=fs, nperseg=nperseg, noverlap=noverlap, window=window, scaling=scaling, dtype=dtype,
+                                             target_freqs=target_freqs)
+        self.freqs = self.estimator.freqs
+        self.num_channels = num_channels
+        self.num_segments = self.estimator.get_num_segments(window_size)
+        # Ring of segment powers - shape (segment, channel, freq). Slots that were never filled are zero.
+        self.segment_power = np.zeros((self.num_segments, num_channels, len(self.freqs)))
+        self.power_sum = np.zeros((num_channels, len(self.freqs)))
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all samples.
+        """
+        self.segment_power[:] = 0
+        self.power_sum[:] = 0
+        self.ring_index = 0
+        self.num_filled = 0
+        self._added_since_sum = 0
+        # Samples from the start of the next segment on.
+        self.tail = np.zeros((0, self.num_channels), dtype=self.estimator.dtype)
+
+    def add_samples(self, data):
+        """
+        Adds a block of samples to the stream and updates the estimate with every segment that is now complete.
+
+        :param data: np array of shape (sample, channel), or (sample,) if there is only one channel.
+        :return: The number of new segments.
+        """
+        data = np.asarray(data, dtype=self.estimator.dtype).reshape((-1, self.num_channels))
+        samples = np.concatenate((self.tail, data), axis=0) if len(self.tail) > 0 else data
+        nperseg, step = self.estimator.nperseg, self.estimator.step
+        num_new = (len(samples) - nperseg) // step + 1 if len(samples) >= nperseg else 0
+        if num_new > 0:
+            # Segments that would be pushed out of the ring by this same block are never computed.
+            first = max(0, num_new - self.num_segments)
+            power = self.estimator.get_segment_power(samples[first * step:(num_new - 1) * step + nperseg].T)
+            power = np.swapaxes(power, 0, 1)  # (segment, channel, freq)
+            ring_indexes = (self.ring_index + np.arange(len(power))) % self.num_segments
+            self.power_sum -= np.sum(self.segment_power[ring_indexes], axis=0)
+            self.segment_power[ring_indexes] = power
+            self.power_sum += np.sum(power, axis=0)
+            self.ring_index = (self.ring_index + len(power)) % self.num_segments
+            self.num_filled = min(self.num_segments, self.num_filled + len(power))
+            self._added_since_sum += len(power)
+            if self._added_since_sum >= self.num_segments:
+                # Start from an exact sum again so rounding errors can't build up.
+                self.power_sum = np.sum(self.segment_power, axis=0)
+                self._added_since_sum = 0
+        self.tail = samples[num_new * step:].copy()
+        return num_new
+
+    def is_ready(self):
+        """
+        Returns True once a full window of segments has been added.
+        """
+        return self.num_filled == self.num_segments
+
+    def get_density(self, out=None):
+        """
+        Returns the estimate over the segments in the window (all segments so far if the window isn't full yet).
+
+        :param out: Optional -- np array of shape (freq, channel) to write the densities into. Defaults to None
+        :return: freqs, density - shape (freq, channel)
+        """
+        if self.num_filled == 0:
+            raise ValueError('No complete segments have been added yet')
+        density = (self.power_sum * (self.estimator.bin_scale / self.num_filled)).T
+        if out is None:
+            return self.freqs, density.astype(self.estimator.dtype)
+        out[...] = density
+        return self.freqs, out
+
+
+def get_welch_estimator(fs, nperseg, noverlap=None, window='hann', scaling='density', dtype=np.float64, target_freqs=None):
+    """
+    Returns a WelchEstimator for the given parameters.  The most recently used WELCH_ESTIMATOR_CACHE_SIZE estimators
+    are cached, so repeated calls with the same parameters reuse the same window and frequency tables.
+
+    See WelchEstimator for the parameters.
+    """
+    key = (fs, nperseg, noverlap, window if not isinstance(window, np.ndarray) else window.tostring(), scaling, np.dtype(dtype).str,
+           None if target_freqs is None else tuple(np.ravel(target_freqs)))
+    estimator = _welch_estimator_cache.pop(key, None)
+    if estimator is None:
+        estimator = WelchEstimator(fs=fs, nperseg=nperseg, noverlap=noverlap, window=window, scaling=scaling, dtype=dtype,
+                                   target_freqs=target_freqs)
+        if len(_welch_estimator_cache) >= WELCH_ESTIMATOR_CACHE_SIZE:
+            _welch_estimator_cache.popitem(last=False)
+    _welch_estimator_cache[key] = estimator
+    return estimator
+
+
+def welch(data, fs, nperseg, noverlap=None, axis=-1, scaling='density', dtype=np.float64, out=None):
+    """
+    Same as scipy.signal.welch (with the default window and detrending), but uses a cached WelchEstimator.
+
+    :return: freqs, density
+    """
+    estimator = get_welch_estimator(fs=fs, nperseg=nperseg, noverlap=noverlap, scaling=scaling, dtype=dtype)
+    return estimator.estimate(data, axis=axis, out=out)
+
+
+def get_harmonics(freqs, num_harmonics=1, max_freq=None):
+    """
+    Returns the frequencies and their harmonics, ordered by frequency and then harmonic.
+
+    Example:
+        get_harmonics([11, 13], num_harmonics=2) -> [11, 22, 13, 26]
+
+    :param freqs: list of fundamental frequencies
+    :param num_harmonics: Number of multiples of each frequency to include (1 gives only the fundamentals). Defaults to 1
+    :param max_freq: If not None, harmonics above max_freq (ie. fs / 2) are left out. Defaults to None
+    :return: list of frequencies
+    """
+    harmonics = [freq * multiple for freq in freqs for multiple in range(1, num_harmonics + 1)]
+    return [freq for freq in harmonics if max_freq is None or freq <= max_freq]
+
+
+def get_targeted_power_all_channels(data, fs, target_freqs, nperseg, noverlap, num_harmonics=1, dtype=None):
+    """
+    The same as get_fft_all_channels, but only computes the densities at target_freqs (and their harmonics) instead of
+    the full spectrum.  See WelchEstimator for how this is done.
+
+    :param data: Must be of the form (epoch, sample, channel)
+    :param fs: sampling rate
+    :param target_freqs: list of frequencies (Hz) to compute, ie. [11, 13] for two SSVEP lights.
+    :param nperseg: nperseg for welch
+    :param noverlap: noverlap for welch
+    :param num_harmonics: Number of multiples of each target frequency to compute (see get_harmonics). Defaults to 1
+    :param dtype: If np.float32, the densities are computed in single precision. Defaults to None
+    :return: freqs, np array of densities - shape(epoch, freq, channel) with one freq for every frequency in freqs
+    """
+    if len(data.shape) != 3:
+        raise ValueError("Must be shape (epoch, sample, channel).  Actual Shape %s" % str(data.shape))
+    if dtype is None:
+        dtype = np.float32 if data.dtype == np.float32 else np.float64
+    freqs = get_harmonics(target_freqs, num_harmonics=num_harmonics, max_freq=fs / 2.0)
+    estimator = get_welch_estimator(fs=fs, nperseg=nperseg, noverlap=noverlap, dtype=dtype, target_freqs=freqs)
+    return estimator.estimate(data, axis=1)
+
+
+def get_fft_all_channels(data, fs, nperseg, noverlap, dtype=None, out=None):
     """
     Returns a np array of densities - shape(epoch, density, channel) and the frequency list
 
     data is shape (epoch, sample, channel)
 
+    Welch is run once over all epochs and channels (along the sample axis), so no per channel loop or transposing is needed.
+    The window and frequency tables are reused between calls with the same parameters (see get_welch_estimator).
+
     :param data: Must be of the form (epoch, sample, channel)
     :param fs: sampling rate
     :param nperseg: nperseg for welch
     :param noverlap: noverlap for welch
+    :param dtype: If np.float32, the densities are computed (and returned) in single precision. If None, the precision
+                  of data is used (float64 for integer data). Defaults to None
+    :param out: Optional -- np array of shape (epoch, nperseg // 2 + 1, channel) to write the densities into, so the same
+                buffer can be reused between calls (ie. for each window of an online loop). Defaults to None
     :return: freqs, np array of densities - shape(epoch, density, channel)
     """
     if len(data.shape) != 3:
         raise ValueError("Must be shape (epoch, sample, channel).  Actual Shape %s" % str(data.shape))
-    num_channels = data.shape[2]
-    dens, freqs = [], None
-    for chan in range(num_channels):
-        freqs, density = scisig.welch(data[:, :, chan], fs=fs, nperseg=nperseg, noverlap=noverlap, axis=1)
-        dens.append(density)
-    return freqs, np.swapaxes(np.swapaxes(np.asarray(dens), 0, 1), 1, 2)
+    if dtype is None:
+        dtype = np.float32 if data.dtype == np.float32 else np.float64
+    return welch(data, fs=fs, nperseg=nperseg, noverlap=noverlap, axis=1, dtype=dtype, out=out)
 
 
 def band_power(freqs, density, inclusive_range):
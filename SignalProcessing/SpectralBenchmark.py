@@ -0,0 +1,73 @@
+"""
+Measures the per call latency of scipy.signal.welch against a cached Fourier.WelchEstimator for the window sizes used
+by our online loops, and of the full spectrum against only computing the SSVEP frequencies (target_freqs).
+
+Usage:
+    python SpectralBenchmark.py
+"""
+
+import time
+import numpy as np
+import scipy.signal as scisig
+import CCDLUtil.SignalProcessing.Fourier as Fourier
+
+# (name, fs, window samples, nperseg, noverlap, channels)
+CONFIGURATIONS = [('SSVEP (2 s window)', 250, 500, 250, 125, 1),
+                  ('SignalDisplay (5 s window)', 5000, 25000, 512, 200, 1),
+                  ('8 channel OpenBCI', 250, 500, 250, 125, 8)]
+
+
+def time_calls(fn, calls):
+    """
+    Calls fn calls times and returns the latency of each call in microseconds.
+    """
+    latencies = np.empty(calls)
+    for ii in xrange(calls):
+        start = time.time()
+        fn()
+        latencies[ii] = time.time() - start
+    return latencies * 1e6
+
+
+def run_benchmark(calls=500):
+    print '%-28s %-22s %10s %10s %10s' % ('Configuration', 'Method', 'median us', 'p99 us', 'max us')
+    for name, fs, num_samples, nperseg, noverlap, channels in CONFIGURATIONS:
+        window = np.random.randn(num_samples, channels)
+        estimator = Fourier.get_welch_estimator(fs=fs, nperseg=nperseg, noverlap=noverlap)
+        assert np.allclose(scisig.welch(window, fs=fs, nperseg=nperseg, noverlap=noverlap, axis=0)[1],
+                           estimator.estimate(window, axis=0)[1]), 'Estimates differ'
+        out = np.empty((nperseg // 2 + 1, channels))
+        methods = [('scipy.signal.welch', lambda: scisig.welch(window, fs=fs, nperseg=nperseg, noverlap=noverlap, axis=0)),
+                   ('WelchEstimator', lambda: estimator.estimate(window, axis=0)),
+                   ('WelchEstimator out=', lambda: estimator.estimate(window, axis=0, out=out)),
+                   ('Fourier.welch (cached)', lambda: Fourier.welch(window, fs=fs, nperseg=nperseg, noverlap=noverlap, axis=0))]
+        for method_name, fn in methods:
+            latencies = time_calls(fn, calls)
+            print '%-28s %-22s %10.1f %10.1f %10.1f' % (name, method_name, np.median(latencies), np.percentile(latencies, 99), np.max(latencies))
+
+
+def run_targeted_benchmark(calls=500, target_freqs=(11, 13), num_harmonics=2):
+    """
+    Compares the full Welch spectrum with only computing target_freqs and their harmonics.
+    """
+    print
+    print '%-28s %-22s %10s %10s %10s' % ('Configuration', 'Method', 'median us', 'p99 us', 'max us')
+    for name, fs, num_samples, nperseg, noverlap, channels in CONFIGURATIONS:
+        window = np.random.randn(num_samples, channels)
+        freqs = Fourier.get_harmonics(target_freqs, num_harmonics=num_harmonics, max_freq=fs / 2.0)
+        full = Fourier.get_welch_estimator(fs=fs, nperseg=nperseg, noverlap=noverlap)
+        targeted = Fourier.get_welch_estimator(fs=fs, nperseg=nperseg, noverlap=noverlap, target_freqs=freqs)
+        bins = np.searchsorted(full.freqs, freqs)
+        if np.array_equal(full.freqs[bins], freqs):
+            assert np.allclose(full.estimate(window, axis=0)[1][bins], targeted.estimate(window, axis=0)[1]), 'Estimates differ'
+        methods = [('scipy.signal.welch', lambda: scisig.welch(window, fs=fs, nperseg=nperseg, noverlap=noverlap, axis=0)),
+                   ('full WelchEstimator', lambda: full.estimate(window, axis=0)),
+                   ('%d target freqs' % len(freqs), lambda: targeted.estimate(window, axis=0))]
+        for method_name, fn in methods:
+            latencies = time_calls(fn, calls)
+            print '%-28s %-22s %10.1f %10.1f %10.1f' % (name, method_name, np.median(latencies), np.percentile(latencies, 99), np.max(latencies))
+
+
+if __name__ == '__main__':
+    run_benchmark()
+    run_targeted_benchmark()
@@ -0,0 +1,29 @@
+import numpy as np
+import scipy.signal as scisig
+import CCDLUtil.SignalProcessing.Filters as Filters
+
+
+def test_matches_sosfiltfilt_in_chunks_and_threads():
+    data = np.random.RandomState(0).randn(4, 1000, 7)
+    sos = Filters.butter_bandpass_sos(5, 30, fs=250)
+    expected = scisig.sosfiltfilt(sos, data, axis=1)
+    # One chunk, one channel per chunk, and chunks of two channels over three threads.
+    for max_chunk_bytes, num_threads in [(2 ** 27, 1), (1, 1), (2 * 4 * 1000 * 8, 3)]:
+        np.testing.assert_allclose(Filters.batch_filtfilt(data, sos, max_chunk_bytes=max_chunk_bytes, num_threads=num_threads),
+                                   expected, rtol=1e-10, atol=1e-12)
+
+
+def test_session_in_place():
+    data = np.random.RandomState(1).randn(2000, 3)
+    sos = Filters.butter_bandpass_sos(1, 40, fs=500)
+    expected = scisig.sosfiltfilt(sos, data, axis=0)
+    assert Filters.batch_filtfilt(data, sos, axis=0, out=data, max_chunk_bytes=1) is data
+    np.testing.assert_allclose(data, expected, rtol=1e-10, atol=1e-12)
+
+
+def test_channel_axis_raises():
+    try:
+        Filters.batch_filtfilt(np.zeros((10, 100)), Filters.butter_bandpass_sos(5, 30, fs=250), axis=-1)
+    except ValueError:
+        return
+    assert False, 'Expected a ValueError'
@@ -0,0 +1,47 @@
+import numpy as np
+import scipy.signal as scisig
+import CCDLUtil.SignalProcessing.Filters as Filters
+
+
+def decimate_in_packets(decimator, data, packet_size=100):
+    return np.concatenate([decimator.decimate(data[start:start + packet_size])
+                           for start in xrange(0, len(data), packet_size)])
+
+
+def test_delay_is_half_the_filter_length():
+    decimator = Filters.PolyphaseDecimator(fs=5000, target_fs=500)
+    assert decimator.numtaps == 201
+    assert decimator.delay == 100
+    assert Filters.PolyphaseDecimator(factor=10, numtaps=51).delay == 25
+
+
+def test_impulse_is_delayed_by_delay():
+    decimator = Filters.PolyphaseDecimator(fs=5000, target_fs=500)
+    data = np.zeros((3000, 1))
+    data[1000] = 1.0
+    out = decimate_in_packets(decimator, data)
+    # An event at input sample n is at output sample (n + delay) / factor.
+    assert np.argmax(out[:, 0]) == (1000 + decimator.delay) / decimator.factor
+
+
+def test_output_lags_plain_slice_by_delay():
+    fs = 5000
+    decimator = Filters.PolyphaseDecimator(fs=fs, target_fs=500)
+    t = np.arange(5000) / float(fs)
+    data = np.column_stack([np.sin(2 * np.pi * 7 * t), np.cos(2 * np.pi * 13 * t)])
+    out = decimate_in_packets(decimator, data)
+    delay = int(decimator.delay)
+    # Input samples kept by the plain slice, skipping the start, where the filter is still filling.
+    kept = np.arange(0, len(data), decimator.factor)
+    kept = kept[kept >= decimator.numtaps]
+    errors = [np.max(np.abs(out[kept // decimator.factor] - data[kept - shift])) for shift in (delay - 1, delay, delay + 1)]
+    # Small at delay (the passband ripple of the filter), and a one sample misalignment is much worse.
+    assert errors[1] < 5e-3
+    assert errors[1] < errors[0] / 4 and errors[1] < errors[2] / 4
+
+
+def test_matches_lfilter_then_slice():
+    decimator = Filters.PolyphaseDecimator(fs=5000, target_fs=500)
+    data = np.random.RandomState(0).randn(2000, 4)
+    expected = scisig.lfilter(decimator.taps, 1.0, data, axis=0)[::decimator.factor]
+    np.testing.assert_allclose(decimate_in_packets(decimator, data, packet_size=37), expected, atol=1e-10)
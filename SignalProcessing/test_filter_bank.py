@@ -0,0 +1,49 @@
+import numpy as np
+import scipy.signal as scisig
+import CCDLUtil.SignalProcessing.Filters as Filters
+
+
+def make_bank(fs=250, num_channels=4, initialize_from_first_sample=True):
+    bank = Filters.FilterBank(fs=fs, num_channels=num_channels, initialize_from_first_sample=initialize_from_first_sample)
+    bank.add_highpass(1)
+    bank.add_notch(60)
+    bank.add_bandpass(5, 30)
+    return bank
+
+
+def test_chunked_matches_whole():
+    data = np.random.RandomState(0).randn(1000, 4) + 50.0
+    whole = make_bank().filter(data)
+    bank = make_bank()
+    chunked = np.concatenate([bank.filter(data[start:start + 33]) for start in xrange(0, len(data), 33)])
+    np.testing.assert_allclose(chunked, whole, atol=1e-10)
+
+
+def test_matches_sosfilt_from_zero_state():
+    data = np.random.RandomState(1).randn(500, 4)
+    bank = make_bank(initialize_from_first_sample=False)
+    np.testing.assert_allclose(bank.filter(data), scisig.sosfilt(bank.sos, data, axis=0), atol=1e-12)
+
+
+def test_initialize_from_first_sample_removes_dc_transient():
+    bank = Filters.FilterBank(fs=250, num_channels=2)
+    bank.add_highpass(1)
+    filtered = bank.filter(np.full((250, 2), 1000.0))
+    assert np.max(np.abs(filtered)) < 1e-6
+
+
+def test_filter_in_place_and_reset():
+    data = np.random.RandomState(2).randn(200, 4)
+    expected = make_bank().filter(data)
+    bank = make_bank()
+    bank.filter(data[:100])
+    bank.reset()
+    in_place = data.copy()
+    assert bank.filter(in_place, out=in_place) is in_place
+    np.testing.assert_allclose(in_place, expected, atol=1e-12)
+
+
+def test_single_channel_shape():
+    bank = Filters.FilterBank(fs=250, num_channels=1)
+    bank.add_lowpass(30)
+    assert bank.filter(np.ones(50)).shape == (50,)
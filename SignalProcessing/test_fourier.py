@@ -0,0 +1,87 @@
+import numpy as np
+import scipy.signal as scisig
+import CCDLUtil.SignalProcessing.Fourier as Fourier
+
+
+def test_fft_all_channels_matches_per_channel_welch():
+    data = np.random.RandomState(3).randn(5, 600, 4)
+    freqs, density = Fourier.get_fft_all_channels(data, fs=250, nperseg=250, noverlap=125)
+    assert density.shape == (5, 126, 4)
+    for chan in range(4):
+        expected_freqs, expected = scisig.welch(data[:, :, chan], fs=250, nperseg=250, noverlap=125, axis=1)
+        np.testing.assert_allclose(freqs, expected_freqs)
+        np.testing.assert_allclose(density[:, :, chan], expected, rtol=1e-10, atol=1e-15)
+    out = np.empty((5, 126, 4), dtype=np.float32)
+    assert Fourier.get_fft_all_channels(data, fs=250, nperseg=250, noverlap=125, dtype=np.float32, out=out)[1] is out
+    np.testing.assert_allclose(out, density, rtol=1e-4, atol=1e-9)
+
+
+def test_welch_matches_scipy():
+    data = np.random.RandomState(0).randn(3, 1000)
+    for nperseg, noverlap, scaling in [(256, None, 'density'), (250, 100, 'density'), (128, 0, 'spectrum')]:
+        estimator = Fourier.WelchEstimator(fs=250, nperseg=nperseg, noverlap=noverlap, scaling=scaling)
+        freqs, density = estimator.estimate(data)
+        expected_freqs, expected = scisig.welch(data, fs=250, nperseg=nperseg, noverlap=noverlap, scaling=scaling)
+        np.testing.assert_allclose(freqs, expected_freqs)
+        np.testing.assert_allclose(density, expected, rtol=1e-10, atol=1e-15)
+
+
+def test_welch_along_axis_with_out():
+    # Shape (epoch, sample, channel), as epoched by the experiments.
+    data = np.random.RandomState(1).randn(2, 500, 4)
+    estimator = Fourier.WelchEstimator(fs=250, nperseg=250)
+    out = np.empty((2, len(estimator.freqs), 4))
+    freqs, density = estimator.estimate(data, axis=1, out=out)
+    assert density is out
+    np.testing.assert_allclose(density, scisig.welch(data, fs=250, nperseg=250, axis=1)[1], rtol=1e-10, atol=1e-15)
+
+
+def test_input_shorter_than_nperseg_raises():
+    estimator = Fourier.WelchEstimator(fs=250, nperseg=250)
+    try:
+        estimator.estimate(np.zeros(100))
+    except ValueError:
+        return
+    assert False, 'Expected a ValueError'
+
+
+def test_incremental_welch_matches_welch_over_last_window():
+    data = np.random.RandomState(4).randn(5000, 3)
+    estimator = Fourier.IncrementalWelchEstimator(fs=250, nperseg=100, window_size=500, num_channels=3, noverlap=50)
+    position = 0
+    # Uneven blocks, including a single sample and a block longer than the window.
+    for block_size in [37, 130, 1, 600, 432] + [50] * 76:
+        estimator.add_samples(data[position:position + block_size])
+        position += block_size
+        if position >= 500 and (position - 100) % 50 == 0:
+            assert estimator.is_ready()
+            freqs, density = estimator.get_density()
+            expected_freqs, expected = scisig.welch(data[position - 500:position], fs=250, nperseg=100, noverlap=50, axis=0)
+            np.testing.assert_allclose(freqs, expected_freqs)
+            np.testing.assert_allclose(density, expected, rtol=1e-9, atol=1e-15)
+    assert position == 5000
+
+
+def test_incremental_welch_before_the_window_is_full():
+    data = np.random.RandomState(5).randn(300)
+    estimator = Fourier.IncrementalWelchEstimator(fs=250, nperseg=100, window_size=500, noverlap=50)
+    assert estimator.add_samples(data) == 5
+    assert not estimator.is_ready()
+    # Averages the segments so far.
+    np.testing.assert_allclose(estimator.get_density()[1][:, 0], scisig.welch(data, fs=250, nperseg=100, noverlap=50)[1], rtol=1e-9)
+    estimator.reset()
+    try:
+        estimator.get_density()
+    except ValueError:
+        return
+    assert False, 'Expected a ValueError'
+
+
+def test_target_freqs_match_full_spectrum_on_bins():
+    data = np.random.RandomState(2).randn(4, 1000)
+    target_freqs = [6.0, 7.0, 8.5, 12.0]
+    full_freqs, full = Fourier.WelchEstimator(fs=250, nperseg=500).estimate(data)
+    freqs, targeted = Fourier.WelchEstimator(fs=250, nperseg=500, target_freqs=target_freqs).estimate(data)
+    np.testing.assert_array_equal(freqs, target_freqs)
+    bins = [int(np.flatnonzero(full_freqs == freq)[0]) for freq in target_freqs]
+    np.testing.assert_allclose(targeted, full[:, bins], rtol=1e-8)
@@ -0,0 +1,197 @@
+"""
+A single threaded event loop, so acquisition, saving and logging can share one thread rather than each running its own
+blocking loop in a @threaded thread.
+
+Sockets are watched with select (add_reader).  Sources without a file descriptor (queues, LSL inlets - and anything on
+Windows, where select only works on sockets) are polled with periodic timers (call_every).
+
+Usage:
+    loop = EventLoop()
+    streamer.start_recording_on_loop(loop)
+    streamer.save_data_on_loop(loop, 'subject.csv')
+    loop.start()  # Runs the loop in a new (daemon) thread.  Or call loop.run() to run it in this thread.
+    ...
+    loop.stop()
+"""
+
+import time
+import heapq
+import socket
+import select
+import threading
+import collections
+from CCDLUtil.Utility.Decorators import threaded
+
+
+def make_socket_pair():
+    """
+    Returns a pair of connected sockets (socket.socketpair is not available on Windows in Python 2).
+    """
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(listener.getsockname())
+        server, _ = listener.accept()
+    finally:
+        listener.close()
+    return server, client
+
+
+class EventLoop(object):
+
+    def __init__(self):
+        """
+        Runs reader callbacks (when a socket has data), timer callbacks and callbacks passed from other threads (with
+        call_soon_threadsafe), all in the thread that calls run.
+
+        Callbacks must not block - they should only handle the data that is already available.
+        """
+        # fileno -> (file object, callback, args)
+        self.readers = {}
+        # heap of [when, sequence number, callback, args, interval, cancelled]
+        self.timers = []
+        self.timer_count = 0
+        self.pending_calls = collections.deque()
+        self.pending_lock = threading.Lock()
+        # (callback, args) to call when the loop stops.
+        self.stop_callbacks = []
+        # Written to by other threads to wake select up.
+        self.wakeup_receiver, self.wakeup_sender = make_socket_pair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.running = False
+
+    def add_reader(self, fileobj, callback, *args):
+        """
+        Calls callback(*args) whenever fileobj (a socket) has data to read.  Must be called from the loop thread, or
+        before the loop is running.
+        """
+        self.readers[fileobj.fileno()] = (fileobj, callback, args)
+
+    def remove_reader(self, fileobj):
+        """
+        Stops watching fileobj (which may already be closed).
+        """
+        for fileno, reader in self.readers.items():
+            if reader[0] is fileobj:
+                del self.readers[fileno]
+
+    def call_later(self, delay, callback, *args):
+        """
+        Calls callback(*args) once, after delay seconds.
+        :return: A handle that can be passed to cancel.
+        """
+        return self._add_timer(time.time() + delay, callback, args, None)
+
+    def call_every(self, interval, callback, *args):
+        """
+        Calls callback(*args) every interval seconds (starting interval seconds from now) until cancelled.
+        :return: A handle that can be passed to cancel.
+        """
+        return self._add_timer(time.time() + interval, callback, args, interval)
+
+    def _add_timer(self, when, callback, args, interval):
+        self.timer_count += 1
+        timer = [when, self.timer_count, callback, args, interval, False]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    @staticmethod
+    def cancel(handle):
+        """
+        Cancels a timer returned by call_later or call_every.
+        """
+        handle[5] = True
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+        Calls callback(*args) in the loop thread as soon as possible.  This is the only method that may be called from
+        other threads while the loop is running.
+        """
+        with self.pending_lock:
+            self.pending_calls.append((callback, args))
+        try:
+            self.wakeup_sender.send(b'\0')
+        except socket.error:
+            pass  # The wakeup socket is full, so the loop will wake up anyway.
+
+    def call_on_stop(self, callback, *args):
+        """
+        Calls callback(*args) in the loop thread when the loop stops (ie. to write what is left and close files).
+        """
+        self.stop_callbacks.append((callback, args))
+
+    def stop(self):
+        """
+        Stops the loop (after the current callbacks), then calls the call_on_stop callbacks.  Can be called from any
+        thread.
+        """
+        self.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        self.running = False
+
+    def run(self):
+        """
+        Runs the loop in this thread until stop is called.
+        """
+        self.running = True
+        while self.running:
+            timeout = None
+            while len(self.timers) > 0 and self.timers[0][5]:
+                heapq.heappop(self.timers)
+            if len(self.timers) > 0:
+                timeout = max(0.0, self.timers[0][0] - time.time())
+            with self.pending_lock:
+                if len(self.pending_calls) > 0:
+                    timeout = 0.0
+            filenos = [self.wakeup_receiver.fileno()] + self.readers.keys()
+            readable, _, _ = select.select(filenos, [], [], timeout)
+            for fileno in readable:
+                if fileno == self.wakeup_receiver.fileno():
+                    self._drain_wakeup()
+                elif fileno in self.readers:
+                    fileobj, callback, args = self.readers[fileno]
+                    callback(*args)
+            self._run_timers()
+            self._run_pending_calls()
+        for callback, args in self.stop_callbacks:
+            callback(*args)
+
+    @threaded(True)
+    def start(self):
+        """
+        Runs the loop in a new daemon thread.
+        """
+        self.run()
+
+    def _drain_wakeup(self):
+        try:
+            while self.wakeup_receiver.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _run_timers(self):
+        now = time.time()
+        while len(self.timers) > 0 and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)
+            if timer[5]:
+                continue
+            when, sequence, callback, args, interval, cancelled = timer
+            if interval is not None:
+                # Reschedule before calling, so the callback can cancel itself.  Skip missed ticks rather than bursting.
+                timer[0] = when + interval if when + interval > now else now + interval
+                heapq.heappush(self.timers, timer)
+            callback(*args)
+
+    def _run_pending_calls(self):
+        with self.pending_lock:
+            calls = list(self.pending_calls)
+            self.pending_calls.clear()
+        for callback, args in calls:
+            callback(*args)
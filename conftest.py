@@ -0,0 +1,2 @@
+# SignalProcessing/test_filter.py is a plotting script (it loads a recording from ~/Downloads), not a test.
+collect_ignore = ['SignalProcessing/test_filter.py']